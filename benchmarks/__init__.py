@@ -0,0 +1,34 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+'''
+Mesh export benchmarks, runnable without Blender.
+
+fake_bpy provides a stand-in for the parts of the bpy mesh API used by the
+mesh writers and GeometryExporter.writeMesh, meshes generates synthetic
+meshes from them, and run times every writer and format:
+
+    python -m benchmarks.run --sizes 1000,10000,100000 --output results.json
+
+Results are saved as JSON so runs of different commits can be compared.
+'''
@@ -0,0 +1,320 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+'''
+Minimal stand-in for the bpy mesh API, backed by NumPy arrays.
+
+Collections support foreach_get like bpy_prop_collection, and item access
+returning tuples like bpy_prop_array, so both the NumPy writers and the
+per-face Python writers can run on the same data.
+'''
+
+import os
+import re
+import sys
+import types
+
+import numpy
+
+
+class FakeItem:
+    def __init__(self, collection, index):
+        self.collection = collection
+        self.index = index
+
+    def __getattr__(self, name):
+        try:
+            data = self.collection.attributes[name]
+
+        except KeyError:
+            raise AttributeError(name)
+
+        value = data[self.index]
+
+        if name == 'vertices':
+            # Triangles are stored with a zero fourth vertex index
+            return tuple(value.tolist() if value[3] != 0 else value[:3].tolist())
+
+        if name == 'uv':
+            return tuple(tuple(uv) for uv in value.reshape((4, 2)).tolist())
+
+        if numpy.ndim(value) == 0:
+            return value.item()
+
+        return tuple(value.tolist())
+
+
+class FakeCollection:
+    '''
+    Collection of items with array attributes of shape (len, ...)
+    '''
+
+    def __init__(self, length, attributes):
+        self.length = length
+        self.attributes = attributes
+
+        if 'vertices_raw' in attributes:
+            attributes['vertices'] = attributes['vertices_raw']
+
+        if 'uv_raw' in attributes:
+            attributes['uv'] = attributes['uv_raw']
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not -self.length <= index < self.length:
+            raise IndexError(index)
+
+        return FakeItem(self, index % self.length)
+
+    def __iter__(self):
+        return (FakeItem(self, i) for i in range(self.length))
+
+    def foreach_get(self, attr, seq):
+        seq[:] = numpy.asarray(self.attributes[attr]).ravel()
+
+
+class FakeLayer:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeLayers(list):
+    active = None
+
+    def add(self, layer):
+        self.append(layer)
+        self.active = layer
+
+
+def loop_data(face_vertices, smooth, vertex_normals, face_normals):
+    '''
+    Polygon loops of tessellated faces, with split normals and the fan
+    triangulation of every polygon
+    '''
+
+    sides = numpy.where(face_vertices[:, 3] != 0, 4, 3)
+    starts = numpy.cumsum(sides) - sides
+    corner_face = numpy.repeat(numpy.arange(len(sides)), sides)
+    corner_slot = numpy.arange(int(sides.sum())) - numpy.repeat(starts, sides)
+    loop_vertices = face_vertices[corner_face, corner_slot]
+    loop_normals = numpy.where(smooth[corner_face, None], vertex_normals[loop_vertices], face_normals[corner_face])
+
+    quads = numpy.flatnonzero(sides == 4)
+    triangle_loops = numpy.concatenate([starts[:, None] + (0, 1, 2), starts[quads][:, None] + (0, 2, 3)])
+    triangle_polygons = numpy.concatenate([numpy.arange(len(sides)), quads])
+    order = numpy.argsort(triangle_polygons, kind='mergesort')
+
+    return (corner_face, corner_slot, loop_vertices, loop_normals, triangle_loops[order], triangle_polygons[order])
+
+
+class FakeMesh:
+    '''
+    Tessellated mesh as read by the mesh writers.
+
+    co and normals are (vertices, 3) arrays, face_vertices is (faces, 4)
+    with a zero fourth index for triangles, uvs is (faces, 4, 2) and colors
+    is (faces, 4, 3).
+    '''
+
+    def __init__(self, name, co, normals, face_vertices, face_normals, smooth, material_index,
+                 materials=1, uvs=None, colors=None):
+        num_faces = len(face_vertices)
+
+        self.name = name
+        self.materials = [None] * materials
+        self.show_double_sided = False
+        self.vertices = FakeCollection(len(co), {'co': co, 'normal': normals})
+        self.tessfaces = FakeCollection(num_faces, {
+            'vertices_raw': face_vertices,
+            'normal': face_normals,
+            'use_smooth': smooth,
+            'material_index': material_index,
+        })
+
+        self.uv_textures = FakeLayers()
+        self.tessface_uv_textures = FakeLayers()
+        self.tessface_vertex_colors = FakeLayers()
+
+        if uvs is not None:
+            layer = FakeLayer(FakeCollection(num_faces, {'uv_raw': uvs.reshape((num_faces, 8))}))
+            self.tessface_uv_textures.add(layer)
+            self.uv_textures.add(layer)
+
+        if colors is not None:
+            self.tessface_vertex_colors.add(FakeLayer(FakeCollection(num_faces,
+                {'color%d' % (j + 1): colors[:, j] for j in range(4)})))
+
+        # Every tessface is also a polygon
+        corner_face, corner_slot, loop_vertices, loop_normals, triangle_loops, triangle_polygons = \
+            loop_data(face_vertices, smooth, normals, face_normals)
+        num_loops = len(loop_vertices)
+
+        self.loops = FakeCollection(num_loops, {'vertex_index': loop_vertices, 'normal': loop_normals})
+        self.polygons = FakeCollection(num_faces, {'use_smooth': smooth, 'material_index': material_index})
+        self.loop_triangles = FakeCollection(len(triangle_loops), {'loops': triangle_loops, 'polygon_index': triangle_polygons})
+
+        self.uv_layers = FakeLayers()
+        self.vertex_colors = FakeLayers()
+
+        if uvs is not None:
+            self.uv_layers.add(FakeLayer(FakeCollection(num_loops, {'uv': uvs[corner_face, corner_slot]})))
+
+        if colors is not None:
+            self.vertex_colors.add(FakeLayer(FakeCollection(num_loops, {'color': colors[corner_face, corner_slot]})))
+
+    def calc_loop_triangles(self):
+        pass
+
+    def calc_normals_split(self):
+        pass
+
+    @property
+    def num_faces(self):
+        return len(self.tessfaces)
+
+
+class FakeID:
+    '''
+    Hashable datablock with the given attributes
+    '''
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class FakeObject:
+    '''
+    Mesh object without modifiers, as seen by GeometryExporter.writeMesh
+    '''
+
+    type = 'MESH'
+    parent = None
+    modifiers = ()
+    material_slots = ()
+    particle_systems = ()
+    animation_data = None
+
+    def __init__(self, mesh, mesh_type='global', extraction='tessfaces'):
+        self.name = mesh.name
+        self.mesh = mesh
+        self.data = FakeID(
+            name=mesh.name,
+            users=1,
+            animation_data=None,
+            shape_keys=None,
+            mitsuba_mesh=types.SimpleNamespace(mesh_type=mesh_type, normals='default', extraction=extraction),
+        )
+
+    def to_mesh(self, scene, apply_modifiers, settings):
+        return self.mesh
+
+
+def engine_settings(**overrides):
+    '''
+    Default mitsuba_engine settings used by GeometryExporter
+    '''
+
+    settings = {
+        'mesh_type': 'serialized',
+        'mesh_container': 'shape',
+        'mesh_precision': 'double',
+        'mesh_compression': 6,
+        'mesh_chunk_size': 1000000,
+        'mesh_cache': False,
+        'prune_attributes': False,
+        'mesh_store': False,
+        'mesh_store_size': 4096,
+        'hair_format': 'ascii',
+        'partial_export': False,
+    }
+    settings.update(overrides)
+
+    return types.SimpleNamespace(**settings)
+
+
+def fake_scene(name='Scene', **engine):
+    return FakeID(
+        name=name,
+        frame_current=1,
+        frame_subframe=0.0,
+        mitsuba_engine=engine_settings(**engine),
+    )
+
+
+class FakeExportContext:
+    def get_export_path(self, path, id_data=None, relative=False):
+        return path
+
+    def data_add(self, mts_dict, name=''):
+        return True
+
+
+def clean_name(name, replace='_'):
+    return re.sub(r'[^A-Za-z0-9_]', replace, name)
+
+
+def package_module(name, path, **attributes):
+    '''
+    Register an empty package, so its submodules import without running
+    its __init__.py
+    '''
+
+    module = types.ModuleType(name)
+    module.__path__ = [path]
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+
+    return module
+
+
+def install(root):
+    '''
+    Install the fake bpy and mathutils modules, and the add-on packages
+    needed by the mesh writers and GeometryExporter, for the add-on at root.
+    '''
+
+    bpy = types.ModuleType('bpy')
+    bpy.utils = types.SimpleNamespace(user_resource=lambda *args, **kwargs: '', script_paths=lambda: [])
+    bpy.path = types.SimpleNamespace(clean_name=clean_name, abspath=lambda path, *args: path)
+    bpy.data = types.SimpleNamespace(filepath='', meshes=types.SimpleNamespace(remove=lambda mesh: None))
+    bpy.app = types.SimpleNamespace()
+    sys.modules['bpy'] = bpy
+
+    mathutils = types.ModuleType('mathutils')
+    sys.modules['mathutils'] = mathutils
+
+    package = os.path.join(root, 'mtsblend')
+    package_module('mtsblend', package)
+    package_module('mtsblend.extensions_framework', os.path.join(package, 'extensions_framework'))
+    package_module('mtsblend.outputs', os.path.join(package, 'outputs'),
+                   MtsLog=lambda *args, **kwargs: None, MtsManager=None)
+
+    pure_api = types.ModuleType('mtsblend.outputs.pure_api')
+    pure_api.PYMTS_AVAILABLE = False
+    sys.modules['mtsblend.outputs.pure_api'] = pure_api
+
+    materials = types.ModuleType('mtsblend.export.materials')
+    materials.export_material = lambda export_ctx, material: None
+    sys.modules['mtsblend.export.materials'] = materials
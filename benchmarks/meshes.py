@@ -0,0 +1,156 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+'''
+Synthetic meshes of about a given number of faces, see MESHES.
+'''
+
+import math
+
+import numpy
+
+from .fake_bpy import FakeMesh
+
+
+def face_normals(co, face_vertices):
+    a, b, c = (co[face_vertices[:, i]] for i in range(3))
+    normals = numpy.cross(b - a, c - a)
+    length = numpy.sqrt((normals * normals).sum(axis=1))
+    length[length == 0] = 1
+
+    return (normals / length[:, None]).astype(numpy.float32)
+
+
+def fix_quads(face_vertices):
+    '''
+    Rotate quads whose fourth vertex index is zero, which Blender would
+    read as a triangle
+    '''
+
+    rotate = (face_vertices[:, 3] == 0) & (face_vertices[:, 2] != 0)
+    face_vertices[rotate] = numpy.roll(face_vertices[rotate], 1, axis=1)
+
+    return face_vertices
+
+
+def quad_grid(rows, columns):
+    '''
+    Vertex indices of the quads of a rows x columns grid of vertices
+    '''
+
+    corner = (numpy.arange(rows - 1)[:, None] * columns + numpy.arange(columns - 1)).ravel()
+
+    return numpy.stack([corner, corner + 1, corner + columns + 1, corner + columns], axis=1).astype(numpy.int32)
+
+
+def grid(faces, seed=0):
+    '''
+    Flat smooth-shaded grid of quads with one UV layer
+    '''
+
+    side = max(int(math.sqrt(faces)), 1) + 1
+    u, v = numpy.meshgrid(numpy.linspace(0, 1, side), numpy.linspace(0, 1, side))
+
+    co = numpy.stack([u.ravel(), v.ravel(), numpy.zeros(side * side)], axis=1).astype(numpy.float32)
+    normals = numpy.tile(numpy.float32([0, 0, 1]), (len(co), 1))
+    face_vertices = fix_quads(quad_grid(side, side))
+    uvs = co[face_vertices, :2]
+
+    return FakeMesh('grid', co, normals, face_vertices, face_normals(co, face_vertices),
+                    numpy.ones(len(face_vertices), dtype=bool), numpy.zeros(len(face_vertices), dtype=numpy.int32),
+                    uvs=uvs)
+
+
+def sphere(faces, seed=0):
+    '''
+    Smooth UV sphere, quads with triangle fans at the poles, one UV layer
+    '''
+
+    segments = max(int(math.sqrt(faces * 2)), 3)
+    rings = max(faces // segments, 2)
+
+    theta = numpy.linspace(0, math.pi, rings + 1)[1:-1]
+    phi = numpy.linspace(0, 2 * math.pi, segments, endpoint=False)
+    t, p = numpy.meshgrid(theta, phi, indexing='ij')
+
+    co = numpy.concatenate([
+        [[0, 0, 1]],
+        numpy.stack([numpy.sin(t) * numpy.cos(p), numpy.sin(t) * numpy.sin(p), numpy.cos(t)], axis=-1).reshape((-1, 3)),
+        [[0, 0, -1]],
+    ]).astype(numpy.float32)
+    bottom = len(co) - 1
+
+    # Wrap around the segments
+    ring = numpy.arange(rings - 1)[:, None] * segments + 1
+    current = ring + numpy.arange(segments)
+    following = ring + (numpy.arange(segments) + 1) % segments
+
+    quads = numpy.stack([current[:-1], following[:-1], following[1:], current[1:]], axis=-1).reshape((-1, 4))
+    top_fan = numpy.stack([numpy.zeros(segments, dtype=numpy.int64), current[0], following[0], numpy.zeros(segments, dtype=numpy.int64)], axis=1)
+    bottom_fan = numpy.stack([current[-1], numpy.full(segments, bottom), following[-1], numpy.zeros(segments, dtype=numpy.int64)], axis=1)
+    # The top fan starts at vertex 0, move it out of the first slot
+    top_fan[:, :3] = top_fan[:, [1, 2, 0]]
+
+    face_vertices = numpy.concatenate([top_fan, quads, bottom_fan]).astype(numpy.int32)
+    num_faces = len(face_vertices)
+
+    uvs = numpy.empty((num_faces, 4, 2), dtype=numpy.float32)
+    uvs[..., 0] = (numpy.arctan2(co[face_vertices, 1], co[face_vertices, 0]) / (2 * math.pi)) % 1.0
+    uvs[..., 1] = numpy.arccos(numpy.clip(co[face_vertices, 2], -1, 1)) / math.pi
+
+    return FakeMesh('sphere', co, co.copy(), face_vertices, face_normals(co, face_vertices),
+                    numpy.ones(num_faces, dtype=bool), numpy.zeros(num_faces, dtype=numpy.int32),
+                    uvs=uvs)
+
+
+def soup(faces, seed=0, materials=8):
+    '''
+    Random triangles and quads over shared vertices, mixing flat and smooth
+    faces, spread over several materials, with UVs and vertex colors
+    '''
+
+    rng = numpy.random.RandomState(seed)
+    num_vertices = max(faces // 2, 8)
+
+    co = rng.uniform(-1, 1, (num_vertices, 3)).astype(numpy.float32)
+    normals = co / numpy.sqrt((co * co).sum(axis=1))[:, None]
+
+    face_vertices = rng.randint(1, num_vertices, (faces, 4)).astype(numpy.int32)
+    face_vertices[rng.rand(faces) < 0.5, 3] = 0
+    # Use vertex 0 too, outside the fourth slot
+    face_vertices[::7, 0] = 0
+
+    # Quantized values, so smooth corners share vertices
+    uvs = (rng.randint(0, 4, (faces, 4, 2)) * 0.25).astype(numpy.float32)
+    colors = (rng.randint(0, 2, (faces, 4, 3)) * 0.5).astype(numpy.float32)
+
+    return FakeMesh('soup', co, normals.astype(numpy.float32), face_vertices, face_normals(co, face_vertices),
+                    rng.rand(faces) < 0.7, rng.randint(0, materials, faces).astype(numpy.int32),
+                    materials=materials, uvs=uvs, colors=colors)
+
+
+MESHES = {
+    'grid': grid,
+    'sphere': sphere,
+    'soup': soup,
+}
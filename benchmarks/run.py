@@ -0,0 +1,279 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+'''
+Time the mesh writers on synthetic meshes.
+
+Every case runs in its own process, so the peak memory of one writer does
+not hide the next one. Writers:
+
+    python      write_serialized_mesh / write_ply_mesh, per face RNA access
+    numpy       write_serialized_mesh_numpy / write_ply_mesh_numpy
+    chunked     write_serialized_mesh_chunked / write_ply_mesh_chunked
+    writeMesh   GeometryExporter.writeMesh, including the write pipeline
+    loopTris    GeometryExporter.writeMesh reading the loop triangles
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+try:
+    import resource
+
+except ImportError:
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WRITERS = ['python', 'numpy', 'chunked', 'writeMesh', 'loopTris']
+FORMATS = ['serialized', 'ply']
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+def peak_memory():
+    '''
+    Peak resident set size of this process in bytes, None if unknown
+    '''
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(base, name))
+               for base, dirs, files in os.walk(path) for name in files)
+
+
+def material_faces(mesh):
+    from mtsblend.outputs.mesh_buffers import read_material_faces
+
+    return read_material_faces(mesh)
+
+
+def write_python(mesh, file_format, out_dir, chunk_size):
+    from mtsblend.outputs.mesh_serialized import write_serialized_mesh
+    from mtsblend.outputs.mesh_ply import write_ply_mesh
+
+    for i, faces in material_faces(mesh).items():
+        file_path = os.path.join(out_dir, '%s_%d.%s' % (mesh.name, i, file_format))
+
+        if file_format == 'ply':
+            write_ply_mesh(file_path, mesh.name, mesh, faces)
+
+        else:
+            write_serialized_mesh(file_path, mesh.name, mesh, faces)
+
+
+def write_numpy(mesh, file_format, out_dir, chunk_size):
+    from mtsblend.outputs.mesh_buffers import MeshBuffers, split_material_faces
+    from mtsblend.outputs.mesh_serialized import write_serialized_mesh_numpy
+    from mtsblend.outputs.mesh_ply import write_ply_mesh_numpy
+
+    buffers = MeshBuffers(mesh)
+
+    for i, faces in split_material_faces(buffers.material_index).items():
+        file_path = os.path.join(out_dir, '%s_%d.%s' % (mesh.name, i, file_format))
+
+        if file_format == 'ply':
+            write_ply_mesh_numpy(file_path, mesh.name, buffers, faces)
+
+        else:
+            write_serialized_mesh_numpy(file_path, mesh.name, buffers, faces)
+
+
+def write_chunked(mesh, file_format, out_dir, chunk_size):
+    from mtsblend.outputs.mesh_buffers import MeshBuffers, split_material_faces
+    from mtsblend.outputs.mesh_serialized import write_serialized_mesh_chunked
+    from mtsblend.outputs.mesh_ply import write_ply_mesh_chunked
+
+    buffers = MeshBuffers(mesh)
+
+    for i, faces in split_material_faces(buffers.material_index).items():
+        file_path = os.path.join(out_dir, '%s_%d.%s' % (mesh.name, i, file_format))
+
+        if file_format == 'ply':
+            write_ply_mesh_chunked(file_path, mesh.name, buffers, faces, chunk_size)
+
+        else:
+            write_serialized_mesh_chunked(file_path, None, mesh.name, buffers, faces, chunk_size)
+
+
+def write_geometry_exporter(mesh, file_format, out_dir, chunk_size, extraction='tessfaces'):
+    from .fake_bpy import FakeObject, FakeExportContext, fake_scene
+    from mtsblend.extensions_framework import util as efutil
+    from mtsblend.export.geometry import GeometryExporter
+
+    efutil.export_path = out_dir + '/'
+    scene = fake_scene(mesh_chunk_size=chunk_size)
+
+    exporter = GeometryExporter(FakeExportContext(), scene)
+    exporter.geometry_scene = scene
+    exporter.writeMesh(FakeObject(mesh, extraction=extraction), file_format=file_format)
+    exporter.finish()
+
+
+def write_loop_triangles(mesh, file_format, out_dir, chunk_size):
+    write_geometry_exporter(mesh, file_format, out_dir, chunk_size, extraction='loop_triangles')
+
+
+WRITER_FUNCTIONS = {
+    'python': write_python,
+    'numpy': write_numpy,
+    'chunked': write_chunked,
+    'writeMesh': write_geometry_exporter,
+    'loopTris': write_loop_triangles,
+}
+
+
+def run_case(mesh_kind, faces, writer, file_format, chunk_size):
+    '''
+    Run one benchmark case in this process and return its result
+    '''
+
+    from . import fake_bpy
+    from .meshes import MESHES
+
+    fake_bpy.install(ROOT)
+
+    mesh = MESHES[mesh_kind](faces)
+    out_dir = tempfile.mkdtemp(prefix='mts_bench_')
+    base_memory = peak_memory()
+
+    try:
+        start = time.perf_counter()
+        WRITER_FUNCTIONS[writer](mesh, file_format, out_dir, chunk_size)
+        seconds = time.perf_counter() - start
+        bytes_written = directory_size(out_dir)
+
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    end_memory = peak_memory()
+
+    return {
+        'mesh': mesh_kind,
+        'faces': mesh.num_faces,
+        'writer': writer,
+        'format': file_format,
+        'seconds': seconds,
+        'faces_per_second': mesh.num_faces / seconds if seconds > 0 else None,
+        'bytes_written': bytes_written,
+        'peak_memory': end_memory,
+        'peak_memory_increase': end_memory - base_memory if end_memory is not None else None,
+    }
+
+
+def run_subprocess(mesh_kind, faces, writer, file_format, chunk_size):
+    command = [sys.executable, '-m', 'benchmarks.run', '--case',
+               '%s,%d,%s,%s,%d' % (mesh_kind, faces, writer, file_format, chunk_size)]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, universal_newlines=True)
+    output = process.communicate()[0]
+
+    if process.returncode != 0:
+        return None
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def split_list(value):
+    return [v for v in value.split(',') if v]
+
+
+def main(argv=None):
+    from .meshes import MESHES
+
+    parser = argparse.ArgumentParser(description='Benchmark the Mitsuba mesh writers on synthetic meshes')
+    parser.add_argument('--meshes', type=split_list, default=sorted(MESHES), help='comma separated: %s' % ', '.join(sorted(MESHES)))
+    parser.add_argument('--sizes', type=lambda v: [int(s) for s in split_list(v)], default=DEFAULT_SIZES, help='comma separated face counts')
+    parser.add_argument('--writers', type=split_list, default=WRITERS, help='comma separated: %s' % ', '.join(WRITERS))
+    parser.add_argument('--formats', type=split_list, default=FORMATS, help='comma separated: %s' % ', '.join(FORMATS))
+    parser.add_argument('--chunk-size', type=int, default=100000, help='faces per chunk of the chunked writers')
+    parser.add_argument('--max-python-faces', type=int, default=100000, help='skip the per face Python writers above this size')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file receiving the results')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        mesh_kind, faces, writer, file_format, chunk_size = args.case.split(',')
+        print(json.dumps(run_case(mesh_kind, int(faces), writer, file_format, int(chunk_size))))
+        return 0
+
+    results = []
+
+    for mesh_kind in args.meshes:
+        for faces in args.sizes:
+            for file_format in args.formats:
+                for writer in args.writers:
+                    if writer == 'python' and faces > args.max_python_faces:
+                        continue
+
+                    result = run_subprocess(mesh_kind, faces, writer, file_format, args.chunk_size)
+
+                    if result is None:
+                        print('%-6s %9d %-10s %-9s FAILED' % (mesh_kind, faces, file_format, writer))
+                        continue
+
+                    results.append(result)
+                    print('%-6s %9d %-10s %-9s %9.3fs %12.0f faces/s %12d bytes %8s MB peak' % (
+                        mesh_kind, result['faces'], file_format, writer, result['seconds'],
+                        result['faces_per_second'] or 0, result['bytes_written'],
+                        '%d' % (result['peak_memory_increase'] // (1024 * 1024)) if result['peak_memory_increase'] is not None else '?'))
+
+    with open(args.output, 'w') as output:
+        json.dump({
+            'revision': git_revision(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'chunk_size': args.chunk_size,
+            'results': results,
+        }, output, indent=1)
+
+    print('Results written to %s' % args.output)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -41,6 +41,8 @@ from ..export import get_output_filename
 from ..export.scene import SceneExporter
 from ..outputs import MtsManager
 from ..outputs import MtsLog
+from ..outputs.profiler import set_profiler, profile
+from ..outputs.tracer import ExportTracer
 
 # Exporter Property Groups need to be imported to ensure initialisation
 from ..properties import (
@@ -143,6 +145,8 @@ class RENDERENGINE_mitsuba(bpy.types.RenderEngine):
         '''
 
         with RENDERENGINE_mitsuba.render_lock:  # just render one thing at a time
+            tracer = None
+
             try:
                 self.MtsManager = None
                 self.render_update_timer = None
@@ -160,16 +164,28 @@ class RENDERENGINE_mitsuba(bpy.types.RenderEngine):
                     self.render_preview(scene)
                     return
 
-                exported_file = self.export_scene(scene)
+                if scene.mitsuba_testing.trace_render:
+                    tracer = ExportTracer()
+                    set_profiler(tracer, 'trace')
+
+                with profile('export_scene', scene.name):
+                    exported_file = self.export_scene(scene)
+
                 if exported_file is False:
                     return  # Export frame failed, abort rendering
 
-                self.render_start(scene)
+                with profile('render', scene.name):
+                    self.render_start(scene)
 
             except Exception as err:
                 MtsLog('%s' % err)
                 self.report({'ERROR'}, '%s' % err)
 
+            finally:
+                if tracer is not None:
+                    set_profiler(None, 'trace')
+                    tracer.save(os.path.join(self.output_dir, '%s_trace.json' % get_output_filename(scene)))
+
     def render_preview(self, scene):
         xres, yres = scene.camera.data.mitsuba_camera.mitsuba_film.resolution(scene)
         # Don't render the tiny images
@@ -358,6 +374,7 @@ class RENDERENGINE_mitsuba(bpy.types.RenderEngine):
         scene_exporter.properties.write_files = write_files     # Use file write decision from above
         scene_exporter.properties.write_all_files = False       # Use UI file write settings
         scene_exporter.set_scene(scene)
+        scene_exporter.set_engine(self)
 
         export_result = scene_exporter.export()
 
@@ -433,7 +450,9 @@ class RENDERENGINE_mitsuba(bpy.types.RenderEngine):
                     render_ctx.cmd_args.extend(['-r', '%i' % scene.mitsuba_engine.refresh_interval])
 
             render_ctx.set_scene(self.MtsManager.export_ctx)
-            render_ctx.render_start(self.output_file.replace('//', '/'))
+            with profile('render_start'):
+                render_ctx.render_start(self.output_file.replace('//', '/'))
+
             self.MtsManager.start()
 
             if internal or scene.mitsuba_engine.binary_name != 'mtsgui':
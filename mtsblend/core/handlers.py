@@ -27,22 +27,53 @@ from bpy.app.handlers import persistent
 
 from ..nodes import MitsubaNodeManager
 from ..export.geometry import GeometryExporter
+from ..export.scene import SceneExporter
 from ..outputs import MtsLog
 
 
 @persistent
 def mts_scene_update(context):
+    dependencies = SceneExporter.Dependencies
+
     if bpy.data.objects.is_updated:
         for ob in bpy.data.objects:
             if ob is None:
                 continue
 
+            if ob.is_updated:
+                dependencies.mark_dirty(('object', ob.name))
+
             # only flag as updated if either modifiers or
             # mesh data is updated
             if ob.is_updated_data or (ob.data is not None and ob.data.is_updated):
                 GeometryExporter.KnownModifiedObjects.add(ob)
+                GeometryExporter.EvaluatedMeshes.invalidate({ob.name, ob.data.name} if ob.data is not None else {ob.name})
+                dependencies.mark_dirty(('object', ob.name))
+
+                if ob.data is not None:
+                    dependencies.mark_dirty(('data', ob.data.name))
+
+    if bpy.data.materials.is_updated or bpy.data.textures.is_updated:
+        for mat in bpy.data.materials:
+            if mat.is_updated or (mat.node_tree is not None and mat.node_tree.is_updated) or \
+                    any(slot.texture.is_updated for slot in mat.texture_slots if slot is not None and slot.texture is not None):
+                dependencies.mark_dirty(('material', mat.name))
+
+    if bpy.data.images.is_updated:
+        for image in bpy.data.images:
+            if image.is_updated:
+                dependencies.mark_dirty(('image', image.name))
+
+    if bpy.data.worlds.is_updated:
+        for world in bpy.data.worlds:
+            if world.is_updated:
+                dependencies.mark_dirty(('world', world.name))
 
     if bpy.data.node_groups.is_updated:
+        for ntree in bpy.data.node_groups:
+            if ntree.is_updated:
+                dependencies.mark_dirty(('node_tree', ntree.name))
+
         context.mitsuba_nodegroups.refresh()
 
 
@@ -55,10 +86,20 @@ def mts_node_manager_lock(context):
 def mts_scene_load(context):
     # clear known list on scene load and unlock node manager
     GeometryExporter.KnownExportedObjects = set()
+    GeometryExporter.EvaluatedMeshes.clear()
+    SceneExporter.Dependencies.clear()
     MitsubaNodeManager.unlock()
 
+
+@persistent
+def mts_scene_undo(context):
+    # undo restores datablocks without flagging them as updated
+    SceneExporter.Dependencies.clear()
+
 if hasattr(bpy.app, 'handlers') and hasattr(bpy.app.handlers, 'scene_update_post'):
     bpy.app.handlers.scene_update_post.append(mts_scene_update)
     bpy.app.handlers.load_pre.append(mts_node_manager_lock)
     bpy.app.handlers.load_post.append(mts_scene_load)
+    bpy.app.handlers.undo_post.append(mts_scene_undo)
+    bpy.app.handlers.redo_post.append(mts_scene_undo)
     MtsLog('Installed scene post-update handler')
@@ -22,8 +22,12 @@
 # ***** END GPL LICENSE BLOCK *****
 
 from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 
 import os
+import time
+import threading
+import multiprocessing
 
 import bpy
 import mathutils
@@ -53,6 +57,60 @@ class ExportProgressThread(efutil.TimerThread):
             MtsLog(self.message % pc)
 
 
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportProgress:
+    '''
+    Shows the progress of an export in the render engine, if any. check()
+    polls test_break() of the engine at most every CHECK_PERIOD seconds and
+    raises ExportCancelled once the user cancelled, so long loops of the
+    export stop within about that delay.
+    '''
+
+    CHECK_PERIOD = 0.2
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.stage = ''
+        self.total = 0
+        self.done = 0
+        self.cancelled = False
+        self.last_check = time.perf_counter()
+
+    def start(self, stage, total=0):
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.update()
+
+    def step(self, count=1):
+        self.done += count
+        self.check()
+
+    def check(self):
+        if self.cancelled or time.perf_counter() - self.last_check >= self.CHECK_PERIOD:
+            self.update()
+
+    def update(self):
+        self.last_check = time.perf_counter()
+
+        if self.engine is None:
+            return
+
+        if self.cancelled or self.engine.test_break():
+            self.cancelled = True
+            raise ExportCancelled('Export cancelled')
+
+        if self.total > 0:
+            self.engine.update_stats('', 'Mitsuba: %s %i/%i' % (self.stage, self.done, self.total))
+            self.engine.update_progress(min(1.0, self.done / self.total))
+
+        else:
+            self.engine.update_stats('', 'Mitsuba: %s' % self.stage)
+
+
 class ExportCache:
     def __init__(self, name='Cache'):
         self.name = name
@@ -84,6 +142,112 @@ class ExportCache:
             raise Exception('Item %s not found in %s!' % (ck, self.name))
 
 
+class ExportPipeline:
+    '''
+    Runs the vertex de-duplication, encoding and writing of mesh and hair
+    files on a small thread pool, so they overlap with the reads of Blender
+    data, which must stay on the main thread. NumPy, zlib and file writes
+    release the GIL, which is where the jobs spend their time.
+
+    At most max_pending jobs are queued or running at any time; submit()
+    blocks until a slot is free, which bounds the memory held by buffers
+    waiting to be written. Errors raised by a job are re-raised on the main
+    thread by the next submit() or by wait().
+    '''
+
+    POLL_PERIOD = ExportProgress.CHECK_PERIOD
+
+    def __init__(self, max_workers=None, max_pending=None, poll=None):
+        if max_workers is None:
+            try:
+                max_workers = min(4, multiprocessing.cpu_count())
+
+            except NotImplementedError:
+                max_workers = 1
+
+        if max_pending is None:
+            max_pending = 2 * max_workers
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+        # called every POLL_PERIOD seconds while blocked, e.g. ExportProgress.check
+        self.poll = poll
+
+    def release(self, future):
+        self.slots.release()
+
+    def check(self):
+        '''
+        Forget finished jobs, re-raising the first error found.
+        '''
+
+        pending = []
+
+        for future in self.futures:
+            if not future.done():
+                pending.append(future)
+
+            elif future.exception() is not None:
+                raise future.exception()
+
+        self.futures = pending
+
+    def submit(self, fn, *args, **kwargs):
+        self.check()
+
+        if self.poll is None:
+            self.slots.acquire()
+
+        else:
+            while not self.slots.acquire(timeout=self.POLL_PERIOD):
+                self.poll()
+
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+
+        except:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(self.release)
+        self.futures.append(future)
+
+        return future
+
+    def wait(self):
+        '''
+        Block until every submitted job has finished, re-raising the first error.
+        '''
+
+        if self.poll is not None:
+            while wait_futures(self.futures, timeout=self.POLL_PERIOD).not_done:
+                self.poll()
+
+        futures, self.futures = self.futures, []
+        error = None
+
+        for future in futures:
+            if future.exception() is not None and error is None:
+                error = future.exception()
+
+        if error is not None:
+            raise error
+
+    def shutdown(self):
+        self.futures = []
+        self.executor.shutdown(wait=True)
+
+    def cancel(self):
+        '''
+        Drop the jobs not started yet. The running ones are left to finish,
+        see shutdown(), as they may wait on files the caller must release.
+        '''
+
+        for future in self.futures:
+            future.cancel()
+
+
 class ExportContextBase:
     '''
     Export Context base class
@@ -96,6 +260,7 @@ class ExportContextBase:
     exported_ids = set()
     motion = {}
     color_mode = 'rgb'
+    dependencies = None
 
     def __init__(self):
         self.scene_data = OrderedDict([('type', 'scene')])
@@ -132,6 +297,10 @@ class ExportContextBase:
         if mts_dict is None or not isinstance(mts_dict, dict) or len(mts_dict) == 0 or 'type' not in mts_dict:
             return False
 
+        # Keep the element for incremental export, see SceneExporter
+        if self.dependencies is not None:
+            self.dependencies.record(name, mts_dict)
+
         if not name:
             try:
                 name = mts_dict['id']
@@ -146,9 +315,13 @@ class ExportContextBase:
 
 
 class Instance:
-    obj = None
-    motion = []
-    mesh = None
+    '''
+    Object to export with its motion, a list of (seq, matrix), and the
+    meshes written for it, if any. Scenes with many duplis hold one per
+    dupli, hence the slots.
+    '''
+
+    __slots__ = ('obj', 'motion', 'mesh')
 
     def __init__(self, obj, trafo=None, mesh=None):
         self.obj = obj
@@ -202,11 +375,24 @@ class ReferenceCounter:
         ReferenceCounter.stack.pop()
 
 
-def get_param_recursive_loop(scene_data, params, key):
+# yielded by get_param_recursive for a reference to an element missing
+# from the scene data
+MISSING_REFERENCE = object()
+
+
+def get_param_recursive_loop(scene_data, params, key, missing):
     if isinstance(params, dict):
         if 'type' in params and params['type'] == 'ref':
+            referenced = scene_data.get(params['id'])
+
+            if referenced is None:
+                if missing:
+                    yield MISSING_REFERENCE
+
+                return
+
             with ReferenceCounter(params['id']):
-                for r in get_param_recursive_loop(scene_data, scene_data[params['id']], key):
+                for r in get_param_recursive_loop(scene_data, referenced, key, missing):
                     yield r
 
         else:
@@ -215,13 +401,20 @@ def get_param_recursive_loop(scene_data, params, key):
                     yield p
 
                 if isinstance(p, dict):
-                    for r in get_param_recursive_loop(scene_data, p, key):
+                    for r in get_param_recursive_loop(scene_data, p, key, missing):
                         yield r
 
 
-def get_param_recursive(scene_data, params, key):
+def get_param_recursive(scene_data, params, key, missing=False):
+    '''
+    Values of key in params and in the elements they reference. Referenced
+    elements may be missing from the scene data, e.g. when exported to a
+    shared file of an animation export: they yield MISSING_REFERENCE when
+    missing is True, and nothing otherwise.
+    '''
+
     ReferenceCounter.reset()
-    for r in get_param_recursive_loop(scene_data, params, key):
+    for r in get_param_recursive_loop(scene_data, params, key, missing):
         yield r
 
 
@@ -350,6 +543,117 @@ def is_deforming(obj):
     return False
 
 
+def is_data_animated(obj):
+    '''
+    True when the evaluated geometry of obj may change from frame to frame
+    without any change to its modifier settings.
+    '''
+
+    if is_deforming(obj):
+        return True
+
+    data = obj.data
+
+    if data is None:
+        return False
+
+    if data.animation_data is not None:
+        return True
+
+    shape_keys = getattr(data, 'shape_keys', None)
+
+    return shape_keys is not None and shape_keys.animation_data is not None
+
+
+def modifier_objects(obj):
+    '''
+    Objects used by the modifiers of obj, like the target of a shrinkwrap
+    or boolean modifier, or the armature of an armature modifier.
+    '''
+
+    objects = []
+
+    for mod in getattr(obj, 'modifiers', ()):
+        for prop in mod.bl_rna.properties:
+            if prop.type == 'POINTER' and prop.fixed_type.identifier == 'Object':
+                value = getattr(mod, prop.identifier, None)
+
+                if value is not None:
+                    objects.append(value)
+
+    return objects
+
+
+def is_object_animated(obj):
+    '''
+    True when the transform or geometry of obj may change within a frame,
+    so it has to be sampled at every motion blur subframe. Objects with
+    animation data, drivers, constraints, rigid bodies or modifiers using
+    other objects count as animated, and so do their children.
+    '''
+
+    if obj.is_duplicator or is_data_animated(obj):
+        return True
+
+    for mod in getattr(obj, 'modifiers', ()):
+        if getattr(mod, 'object', None) is not None:
+            return True
+
+    while obj is not None:
+        if obj.animation_data is not None or len(obj.constraints) > 0 or \
+                getattr(obj, 'rigid_body', None) is not None:
+            return True
+
+        if obj.parent is not None and obj.parent_type in {'VERTEX', 'VERTEX_3'} and \
+                is_data_animated(obj.parent):
+            return True
+
+        obj = obj.parent
+
+    return False
+
+
+def rna_value_key(value):
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+
+    if isinstance(value, (str, bytes)) or not hasattr(value, '__len__'):
+        return value
+
+    return tuple(rna_value_key(v) for v in value)
+
+
+def rna_signature(struct):
+    '''
+    Hashable snapshot of the properties of an RNA struct, collections left
+    out. Datablocks it points to are identified by name.
+    '''
+
+    values = []
+
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == 'rna_type' or prop.type == 'COLLECTION':
+            continue
+
+        value = getattr(struct, prop.identifier, None)
+
+        if prop.type == 'POINTER':
+            value = getattr(value, 'name', None)
+
+        values.append(rna_value_key(value))
+
+    return tuple(values)
+
+
+def modifier_signature(obj):
+    '''
+    Hashable snapshot of the render relevant settings of every modifier
+    of obj. Datablocks used by a modifier are identified by name.
+    '''
+
+    return tuple((mod.type,) + rna_signature(mod) for mod in obj.modifiers)
+
+
 def get_worldscale(as_scalematrix=True):
     ws = 1
 
@@ -375,6 +679,10 @@ def object_anim_matrices(scene, obj, steps=1):
     per-frame interpolation steps.
     The number of matrices returned is at most steps+1.
     '''
+
+    if not is_object_animated(obj):
+        return []
+
     old_sf = scene.frame_subframe
     cur_frame = scene.frame_current
 
@@ -454,5 +762,13 @@ def get_output_subdir(scene, frame=None):
     return subdir
 
 
+def get_mesh_store_dir():
+    '''
+    Directory of the mesh files shared by all scenes and frames of the blend file
+    '''
+
+    return os.path.join(efutil.export_path, efutil.scene_filename(), 'meshes')
+
+
 def get_output_filename(scene):
     return '%s.%s.%05d' % (efutil.scene_filename(), bpy.path.clean_name(scene.name), scene.frame_current)
@@ -0,0 +1,375 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+# System Libs
+from collections import OrderedDict
+
+import os
+
+# Blender Libs
+import bpy
+
+# Extensions_Framework Libs
+from ..extensions_framework import util as efutil
+
+# Mitsuba libs
+from ..export import get_output_filename, is_object_animated
+from ..export.dependencies import DependencyGraph
+from ..export.environment import is_environment_animated
+from ..export.materials import replay_textures
+from ..export.scene import SceneExporter, SceneExporterProperties
+from ..outputs import MtsLog
+from ..outputs.file_api import FileExportContext
+from ..outputs.mesh_buffers import NUMPY_AVAILABLE
+from ..outputs.mesh_store import MeshStore
+
+
+def entry_key(export_ctx, name, params):
+    '''
+    Key of an element in the scene data, as given by data_add()
+    '''
+
+    if name:
+        return name
+
+    if 'id' in params:
+        return params['id']
+
+    export_ctx.counter += 1
+
+    return 'elm%i' % (export_ctx.counter - 1)
+
+
+class SharedChunk:
+    '''
+    XML file holding the elements of export nodes shared by several frames
+    '''
+
+    def __init__(self, path, kind, keys, ids):
+        self.path = path
+        self.kind = kind
+        self.keys = keys
+        self.ids = ids
+
+
+class AnimationExportSession:
+    '''
+    Exports frames frame_start to frame_end of a scene to one scene file per
+    frame, in a single session:
+
+        session = AnimationExportSession(scene, '/path/to/export/', 1, 250)
+        session.export()
+
+    Materials, textures, objects and the world that do not change over the
+    frames are exported once. Their elements are written to XML files of a
+    shared directory, included by the scene file of every frame, and their
+    mesh and hair files are written once to that directory too. Animated and
+    deforming objects, the camera and animated materials are exported again
+    for each frame. Files are always exported through the file API.
+    '''
+
+    def __init__(self, scene, directory, frame_start=None, frame_end=None, frame_step=1):
+        self.scene = scene
+        self.directory = directory
+        self.frame_start = scene.frame_start if frame_start is None else frame_start
+        self.frame_end = scene.frame_end if frame_end is None else frame_end
+        self.frame_step = frame_step
+
+        self.dependencies = DependencyGraph()
+        self.chunks = []
+        # shared node keys -> chunk of their elements
+        self.shared = {}
+        self.shared_dir = None
+        self.mesh_store = None
+
+    def export(self):
+        '''
+        Export every frame of the range, stopping at the first frame that
+        fails to export. Returns {'FINISHED'} or {'CANCELLED'}.
+        '''
+
+        scene = self.scene
+        origframe = scene.frame_current
+
+        self.dependencies.clear()
+        self.chunks = []
+        self.shared = {}
+        self.shared_dir = None
+        self.mesh_store = None
+
+        frames = range(self.frame_start, self.frame_end + 1, self.frame_step)
+
+        try:
+            for frame in frames:
+                scene.frame_set(frame)
+
+                properties = SceneExporterProperties()
+                properties.directory = self.directory
+                properties.filename = get_output_filename(scene)
+                properties.api_type = 'FILE'
+
+                scene_exporter = SceneExporter()
+                scene_exporter.set_properties(properties)
+                scene_exporter.set_scene(scene)
+                scene_exporter.session = self
+
+                export_result = scene_exporter.export()
+
+                if not export_result or 'CANCELLED' in export_result:
+                    return {'CANCELLED'}
+
+        finally:
+            scene.frame_set(origframe)
+
+        MtsLog('Animation export: %d frames, %d elements shared in %d files' % (
+            len(frames), len(self.shared), len(self.chunks)))
+
+        return {'FINISHED'}
+
+    def begin_frame(self, export_ctx):
+        '''
+        Start the export of a frame, returning the dependency graph of the
+        session. Every node not shared is exported again.
+        '''
+
+        if self.shared_dir is None:
+            self.shared_dir = os.path.join(efutil.export_path, efutil.scene_filename(),
+                bpy.path.clean_name(self.scene.name), 'shared')
+
+            if not os.path.exists(self.shared_dir):
+                os.makedirs(self.shared_dir)
+
+            if NUMPY_AVAILABLE:
+                self.mesh_store = MeshStore(os.path.join(self.shared_dir, 'meshes'),
+                    self.scene.mitsuba_engine.mesh_store_size * 1024 * 1024)
+
+        dependencies = self.dependencies
+
+        for key in dependencies.nodes:
+            if key not in self.shared:
+                dependencies.mark_dirty(key)
+
+        dependencies.begin(export_ctx, self)
+
+        # Materials exported this frame reference the shared textures
+        # instead of adding them again under the same ids
+        for key in self.shared:
+            if key[0] == 'export_material':
+                replay_textures(export_ctx, dependencies.nodes[key], False)
+
+        return dependencies
+
+    def is_static(self, source):
+        '''
+        Whether the datablock of a source key stays the same over the frames
+        '''
+
+        kind, name = source
+
+        if kind == 'object':
+            obj = bpy.data.objects.get(name)
+
+            return obj is not None and not is_object_animated(obj) and \
+                not any(psys.use_hair_dynamics for psys in obj.particle_systems)
+
+        if kind == 'data':
+            # data animation makes the object animated
+            return True
+
+        if kind == 'material':
+            material = bpy.data.materials.get(name)
+
+            return material is not None and material.animation_data is None
+
+        if kind == 'node_tree':
+            ntree = bpy.data.node_groups.get(name)
+
+            return ntree is not None and ntree.animation_data is None
+
+        if kind == 'image':
+            image = bpy.data.images.get(name)
+
+            return image is not None and image.source not in {'SEQUENCE', 'MOVIE'}
+
+        if kind == 'world':
+            world = bpy.data.worlds.get(name)
+
+            return world is not None and world.animation_data is None and not is_environment_animated(world)
+
+        return False
+
+    def is_shareable(self, node, shareable, shared_textures):
+        for dep in node.deps:
+            if dep[0].startswith('export_'):
+                if dep not in shareable and dep not in self.shared:
+                    return False
+
+            elif not self.is_static(dep):
+                return False
+
+        if 'textures' in node.data:
+            ids = {params.get('id') for name, params in node.entries}
+
+            for tex_id, signature, tex_params in node.data['textures']:
+                if tex_params is None or (tex_id not in ids and tex_id not in shared_textures):
+                    return False
+
+        return True
+
+    def write_chunk(self, kind, entries):
+        path = os.path.join(self.shared_dir, '%s_%05d.xml' % (kind, self.scene.frame_current))
+        chunk_ctx = FileExportContext()
+        chunk_ctx.set_filename(self.scene, path)
+
+        # Elements of the chunks written before are referenced by id
+        for chunk in self.chunks:
+            chunk_ctx.exported_ids |= chunk.ids
+
+        scene_data = OrderedDict([('type', 'scene')])
+
+        for name, params in entries:
+            scene_data[entry_key(chunk_ctx, name, params)] = params
+
+        try:
+            chunk_ctx.pmgr_create(scene_data)
+
+        finally:
+            chunk_ctx.exit()
+
+        return (path, {params['id'] for name, params in entries if 'id' in params})
+
+    def drop_chunks(self, export_ctx):
+        '''
+        Stop sharing the chunks holding a node exported again, and the chunks
+        depending on them. Returns the elements to add to the scene data of
+        this frame in their place, by kind.
+        '''
+
+        dependencies = self.dependencies
+        dropped_keys = set()
+        entries = {'materials': [], 'objects': []}
+
+        for chunk in list(self.chunks):
+            if not any(key in dependencies.built or dependencies.nodes[key].deps & dropped_keys for key in chunk.keys):
+                continue
+
+            self.chunks.remove(chunk)
+            dropped_keys.update(chunk.keys)
+
+            for key in chunk.keys:
+                del self.shared[key]
+                dependencies.shared.discard(key)
+
+                # The textures of dropped materials may be referenced by the
+                # materials exported this frame, keep them all
+                if chunk.kind == 'materials' or (key in dependencies.replayed and key not in dependencies.built):
+                    entries[chunk.kind].extend(dependencies.nodes[key].entries)
+
+        return entries
+
+    def end_frame(self, export_ctx):
+        '''
+        Move the elements of the nodes that became shared this frame to new
+        chunks, and include every chunk used by the frame in its scene data.
+        '''
+
+        dependencies = self.dependencies
+        dropped = self.drop_chunks(export_ctx)
+
+        built = [key for key in dependencies.built if key not in dependencies.failed]
+        used = set(built) | dependencies.replayed
+
+        # Materials first, as objects can only be shared with their materials
+        shareable = OrderedDict()
+        shared_textures = set()
+
+        for chunk in self.chunks:
+            if chunk.kind == 'materials':
+                shared_textures |= chunk.ids
+
+        for key in sorted(built, key=lambda key: key[0] != 'export_material'):
+            node = dependencies.built[key]
+
+            if self.is_shareable(node, shareable, shared_textures):
+                shareable[key] = node
+
+                if key[0] == 'export_material':
+                    shared_textures.update(params.get('id') for name, params in node.entries)
+
+        # Shared elements leave the scene data of the frame
+        shared_params = set()
+
+        for kind in ('materials', 'objects'):
+            keys = [key for key in shareable if (key[0] == 'export_material') == (kind == 'materials')]
+            entries = [entry for key in keys for entry in shareable[key].entries]
+
+            if len(entries) == 0:
+                continue
+
+            path, ids = self.write_chunk(kind, entries)
+            chunk = SharedChunk(path, kind, keys, ids)
+            self.chunks.append(chunk)
+
+            for key in keys:
+                self.shared[key] = chunk
+                dependencies.shared.add(key)
+
+            shared_params.update(id(params) for name, params in entries)
+
+        scene_data = OrderedDict([('type', 'scene')])
+
+        for chunk in self.chunks:
+            # Objects of a chunk not all in this frame are added one by one
+            if chunk.kind == 'objects' and not all(key in used for key in chunk.keys):
+                dropped['objects'].extend(entry for key in chunk.keys if key in dependencies.replayed
+                    for entry in dependencies.nodes[key].entries)
+                continue
+
+            scene_data['include_%s' % os.path.basename(chunk.path)] = {
+                'type': 'include',
+                'filename': export_ctx.get_export_path(chunk.path, relative=True),
+            }
+            export_ctx.exported_ids |= chunk.ids
+
+        frame_data = [(key, params) for key, params in export_ctx.scene_data.items()
+            if key != 'type' and id(params) not in shared_params]
+
+        def add_dropped(kind):
+            for name, params in dropped[kind]:
+                if params.get('id') in export_ctx.exported_ids:
+                    continue
+
+                key = entry_key(export_ctx, name, params)
+
+                if key not in export_ctx.scene_data:
+                    scene_data[key] = params
+
+        add_dropped('materials')
+        scene_data.update(frame_data)
+        add_dropped('objects')
+
+        export_ctx.scene_data = scene_data
+
+        MtsLog('Animation export: %d shared elements included, %d elements shared, %d exported' % (
+            sum(len(chunk.keys) for chunk in self.chunks if 'include_%s' % os.path.basename(chunk.path) in scene_data),
+            len(shareable), len(built) - len(shareable)))
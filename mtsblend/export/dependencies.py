@@ -0,0 +1,248 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+'''
+Dependency graph for incremental export.
+
+Export nodes, such as ('export_object', name) or ('export_material', name),
+record the scene data elements added while they are built. Their
+dependencies are other export nodes, or source keys of Blender datablocks
+marked dirty by the scene update handler:
+
+    ('object', name), ('data', name), ('material', name),
+    ('node_tree', name), ('image', name), ('world', name)
+
+A node is clean when it was built by a previous export with the same
+signature, none of its dependencies is dirty, and its fingerprint did not
+change. Clean nodes are replayed from their recorded elements instead of
+being exported again, or only have their side effects replayed when their
+elements are written to a shared file.
+'''
+
+
+def copy_params(params):
+    '''
+    Copy of nested parameter dicts, leaving other values shared
+    '''
+
+    if isinstance(params, dict):
+        return type(params)((key, copy_params(value)) for key, value in params.items())
+
+    return params
+
+
+class ExportNode:
+    def __init__(self, fingerprint=None):
+        self.fingerprint = fingerprint
+        self.entries = []
+        self.deps = set()
+        self.data = {}
+
+
+class BuildNode:
+    def __init__(self, graph, key, fingerprint):
+        self.graph = graph
+        self.key = key
+        self.fingerprint = fingerprint
+
+    def __enter__(self):
+        graph = self.graph
+        graph.depend(self.key)
+
+        if self.key not in graph.built:
+            graph.built[self.key] = ExportNode(self.fingerprint)
+
+        graph.stack.append(self.key)
+
+        return graph.built[self.key]
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.graph.stack.pop()
+
+        if exc_type is not None:
+            self.graph.failed.add(self.key)
+
+
+class DependencyGraph:
+    '''
+    Persistent record of the scene data produced by each export node.
+    '''
+
+    # Functions replaying the side effects of a node kind, other than
+    # adding its elements to the scene data, e.g. registering materials
+    replay_hooks = {}
+
+    def __init__(self):
+        self.nodes = {}
+        self.dirty = set()
+        self.signature = None
+        # Nodes whose elements are written to a file included by every
+        # export, see AnimationExportSession
+        self.shared = set()
+        self.export_ctx = None
+        self.pending = set()
+        self.built = {}
+        self.failed = set()
+        self.replayed = set()
+        self.clean = {}
+        self.stack = []
+
+    def clear(self):
+        self.nodes = {}
+        self.dirty = set()
+        self.signature = None
+        self.shared = set()
+
+    def mark_dirty(self, key):
+        self.dirty.add(key)
+
+    def begin(self, export_ctx, signature):
+        '''
+        Start an export, dropping every node when the signature of the
+        export settings changed.
+        '''
+
+        if signature != self.signature:
+            self.nodes = {}
+            self.shared = set()
+            self.signature = signature
+
+        # Updates caused by the export itself apply to the next one
+        self.pending = self.dirty
+        self.dirty = set()
+
+        self.export_ctx = export_ctx
+        self.built = {}
+        self.failed = set()
+        self.replayed = set()
+        self.clean = {}
+        self.stack = []
+
+        export_ctx.dependencies = self
+
+    def commit(self):
+        '''
+        Keep the nodes built by a finished export, dropping the nodes that
+        went stale without being exported again.
+        '''
+
+        for key in list(self.nodes):
+            if key not in self.built and not self.is_clean(key):
+                del self.nodes[key]
+
+        for key, node in self.built.items():
+            if key in self.failed:
+                self.nodes.pop(key, None)
+                continue
+
+            # Elements may be modified after being added, keep them as exported
+            node.entries = [(name, copy_params(params)) for name, params in node.entries]
+            self.nodes[key] = node
+
+        self.end()
+
+    def abort(self):
+        self.dirty |= self.pending
+        self.end()
+
+    def end(self):
+        if self.export_ctx is not None:
+            self.export_ctx.dependencies = None
+
+        self.export_ctx = None
+        self.pending = set()
+        self.built = {}
+        self.clean = {}
+        self.stack = []
+
+    def is_clean(self, key, fingerprint=None):
+        node = self.nodes.get(key)
+
+        if node is None or key in self.pending or key in self.failed:
+            return False
+
+        if fingerprint is not None and node.fingerprint != fingerprint:
+            return False
+
+        if key not in self.clean:
+            self.clean[key] = False
+            self.clean[key] = all(
+                self.is_clean(dep, self.nodes[dep].fingerprint) if dep in self.nodes else dep not in self.pending
+                for dep in node.deps
+            )
+
+        return self.clean[key]
+
+    def build(self, key, fingerprint=None):
+        '''
+        Context of a node being exported, recording the elements added to
+        the scene data and the dependencies declared within it.
+        '''
+
+        return BuildNode(self, key, fingerprint)
+
+    def depend(self, key):
+        if self.stack and self.stack[-1] is not None:
+            self.built[self.stack[-1]].deps.add(key)
+
+    def record(self, name, params):
+        if self.stack and self.stack[-1] is not None:
+            self.built[self.stack[-1]].entries.append((name, params))
+
+    def replay(self, key):
+        '''
+        Add the elements of a clean node and of its dependencies to the
+        scene data, returning the node.
+        '''
+
+        node = self.nodes[key]
+        self.depend(key)
+
+        if key in self.replayed:
+            return node
+
+        self.replayed.add(key)
+
+        # Elements added while replaying belong to no node being built
+        self.stack.append(None)
+
+        try:
+            for dep in sorted(node.deps):
+                if dep in self.nodes and dep not in self.built:
+                    self.replay(dep)
+
+            # Elements of shared nodes are already in a file of their own
+            add_elements = key not in self.shared
+            hook = self.replay_hooks.get(key[0])
+
+            if hook is not None:
+                hook(self.export_ctx, node, add_elements)
+
+            if add_elements:
+                for name, params in node.entries:
+                    self.export_ctx.data_add(copy_params(params), name)
+
+        finally:
+            self.stack.pop()
+
+        return node
@@ -21,8 +21,11 @@
 #
 # ***** END GPL LICENSE BLOCK *****
 
+import bpy
 import mathutils
 
+from ..export import is_object_animated
+
 
 # TODO: convert blender and cycles environment to mitsuba dict
 def world_dict_to_nodes(ntree, params):
@@ -55,6 +58,31 @@ def get_environment_trafo(world):
         return None
 
 
+def is_environment_animated(world):
+    '''
+    True when the environment transform may change within a frame
+    '''
+
+    if world is None:
+        return False
+
+    try:
+        ntree = world.mitsuba_nodes.get_node_tree()
+
+        if world.animation_data is not None or ntree.animation_data is not None:
+            return True
+
+        world_node = ntree.find_node('MtsNodeWorldOutput')
+        transform = world_node.inputs['Environment'].get_linked_node().transform
+
+    except:
+        return False
+
+    transform_obj = bpy.data.objects.get(transform) if transform else None
+
+    return transform_obj is not None and is_object_animated(transform_obj)
+
+
 def export_world_environment(export_ctx, world_environment, is_preview=False):
     if world_environment.obj is None:
         return
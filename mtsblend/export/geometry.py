@@ -23,21 +23,29 @@
 
 from collections import OrderedDict
 
+import hashlib
 import os
-import math
 
 import bpy
 import mathutils
 
 from ..outputs import MtsLog
-from ..outputs.mesh_ply import write_ply_mesh
-from ..outputs.mesh_serialized import write_serialized_mesh
-from ..export import ExportProgressThread, ExportCache
-from ..export import is_deforming
-from ..export import get_output_subdir
-from ..export import get_param_recursive
+from ..outputs.hair import StrandBuffers, write_hair_file, write_binary_hair_file
+from ..outputs.mesh_buffers import NUMPY_AVAILABLE, MeshBuffers, foreach_get_array, LoopTriangleBuffers, read_material_faces, split_material_faces
+from ..outputs.mesh_ply import write_ply_mesh, write_ply_mesh_numpy, write_ply_mesh_chunked
+from ..outputs.mesh_serialized import SerializedContainer, write_serialized_mesh, write_serialized_shape_numpy, \
+    write_serialized_mesh_chunked
+from ..outputs.mesh_store import MeshStore, shape_key
+from ..outputs.profiler import get_profiler, profile
+from ..export import ExportProgressThread, ExportProgress, ExportCache, ExportPipeline
+from ..export import is_deforming, is_data_animated, is_object_animated, modifier_objects, modifier_signature, rna_signature
+from ..export import get_output_subdir, get_mesh_store_dir
+from ..export import get_param_recursive, MISSING_REFERENCE
 from ..export.materials import export_material
 
+if NUMPY_AVAILABLE:
+    import numpy
+
 
 class InvalidGeometryException(Exception):
     #MtsLog("Invalid Geometry Exception ")
@@ -49,6 +57,10 @@ class UnexportableObjectException(Exception):
     pass
 
 
+# plugins reading the UV parametrization of the shapes they are used on
+UV_PLUGINS = {'bitmap', 'checkerboard', 'gridtexture', 'bumpmap', 'normalmap', 'ward'}
+
+
 class MeshExportProgressThread(ExportProgressThread):
     #MtsLog("Mash Export Progress Thread  ")
     message = 'Exporting meshes: %i%%'
@@ -59,6 +71,169 @@ class DupliExportProgressThread(ExportProgressThread):
     message = '... %i%% ...'
 
 
+class EvaluatedMeshCache:
+    '''
+    Buffers of evaluated meshes kept between exports, so objects whose
+    geometry did not change skip to_mesh() and the attribute extraction.
+    The least recently used entries are dropped above max_size bytes.
+    '''
+
+    def __init__(self, max_size=1024 * 1024 * 1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.__init__(max_size=self.max_size)
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+
+        return self.entries[key][1]
+
+    def add(self, key, entry, size):
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[0]
+
+        self.entries[key] = (size, entry)
+        self.size += size
+
+        while self.size > self.max_size and len(self.entries) > 1:
+            self.size -= self.entries.popitem(last=False)[1][0]
+
+    def invalidate(self, names):
+        '''
+        Drop the entries of the objects or mesh datablocks with the given names
+        '''
+
+        for key in [k for k in self.entries if k[1] in names or k[2] in names]:
+            self.size -= self.entries.pop(key)[0]
+
+
+def bspline_basis_value(knots, i, u, degree):
+    '''
+    Value at u of the i-th B-spline basis function of the given degree, by
+    the Cox-de Boor recursion
+    '''
+
+    if degree == 0:
+        return 1 if knots[i] <= u < knots[i + 1] else 0
+
+    N0 = bspline_basis_value(knots, i, u, degree - 1)
+    N1 = bspline_basis_value(knots, i + 1, u, degree - 1)
+    sum1 = 0
+    sum2 = 0
+
+    if N0 != 0:
+        sum1 = (u - knots[i]) / (knots[i + degree] - knots[i]) * N0
+
+    if N1 != 0:
+        sum2 = (knots[i + 1 + degree] - u) / (knots[i + 1 + degree] - knots[i + 1]) * N1
+
+    return sum1 + sum2
+
+
+# (point count, degree, sample count) -> basis matrix
+bspline_bases = {}
+
+
+def bspline_basis(count, degree, samples):
+    '''
+    Weights of count control points, clamped at both ends, in each of the
+    samples points resampling a B-spline curve of the given degree, one row
+    per sample. Cached, as the strands of a hair system mostly have the
+    same number of points.
+    '''
+
+    key = (count, degree, samples)
+    basis = bspline_bases.get(key)
+
+    if basis is not None:
+        return basis
+
+    knots = []
+
+    for i in range(count + degree + 1):
+        if i <= degree:
+            knots.append(0)
+
+        elif i >= count:
+            knots.append(count - degree)
+
+        else:
+            knots.append(i - degree)
+
+    basis = []
+
+    for j in range(samples):
+        u = j * (count - degree) / max(samples - 1, 1)
+
+        # keep the last sample inside the last knot span
+        if j > 0:
+            u -= 0.0000000000001
+
+        basis.append([bspline_basis_value(knots, i, u, degree) for i in range(count)])
+
+    if NUMPY_AVAILABLE:
+        basis = numpy.array(basis, dtype=numpy.float64).reshape(samples, count)
+
+    bspline_bases[key] = basis
+
+    return basis
+
+
+def resample_bspline_strands(strands, degree, samples):
+    '''
+    Resample every strand to samples points of the B-spline curve its points
+    control. Strands are StrandBuffers with NumPy, resampled together by
+    number of points in one matrix product, or lists of points without.
+    '''
+
+    if not NUMPY_AVAILABLE:
+        resampled = []
+
+        for points in strands:
+            basis = bspline_basis(len(points), degree, samples)
+            resampled.append([
+                sum((w * p for w, p in zip(weights, points) if w != 0), mathutils.Vector((0.0, 0.0, 0.0)))
+                for weights in basis
+            ])
+
+        return resampled
+
+    resampled = numpy.empty((len(strands), samples, 3), dtype=numpy.float64)
+    strand_ids = strands.strand_ids()
+
+    for count in numpy.unique(strands.counts).tolist():
+        selected = strands.counts == count
+        group = int(numpy.count_nonzero(selected))
+        basis = bspline_basis(count, degree, samples)
+        points = strands.points[selected[strand_ids]].reshape(group, count, 3)
+
+        # (samples, count) . (count, strands * 3) -> (strands, samples, 3)
+        curves = basis.dot(points.transpose(1, 0, 2).reshape(count, group * 3))
+        resampled[selected] = curves.reshape(samples, group, 3).transpose(1, 0, 2)
+
+    return StrandBuffers(resampled.reshape(-1, 3), numpy.full(len(strands), samples, dtype=numpy.int64))
+
+
+def transform_points(matrix, points):
+    '''
+    Points of a (points, 3) array transformed by a 4x4 mathutils matrix
+    '''
+
+    matrix = numpy.array(matrix, dtype=numpy.float64)
+
+    return points.dot(matrix[:3, :3].T) + matrix[:3, 3]
+
+
 class GeometryExporter:
 
     # for partial mesh export
@@ -66,45 +241,337 @@ class GeometryExporter:
     KnownModifiedObjects = set()
     NewExportedObjects = set()
 
-    def __init__(self, export_ctx, visibility_scene):
+    # evaluated meshes reused across exports, see mts_scene_update
+    EvaluatedMeshes = EvaluatedMeshCache()
+
+    def __init__(self, export_ctx, visibility_scene, progress=None):
         self.export_ctx = export_ctx
         self.visibility_scene = visibility_scene
+        self.progress = progress if progress is not None else ExportProgress()
 
         self.ExportedMeshes = ExportCache('ExportedMeshes')
         self.ExportedObjects = ExportCache('ExportedObjects')
         self.ExportedFiles = ExportCache('ExportedFiles')
+        # open multi-shape serialized files, by file path
+        self.MeshContainers = {}
+        # serialized files handed to a close job, with the job, until the export ends
+        self.ClosingContainers = []
         # start fresh
         GeometryExporter.NewExportedObjects = set()
 
         self.objects_used_as_duplis = set()
 
+        # compression and file writes of the NumPy writers run in the background
+        self.pipeline = ExportPipeline(poll=self.progress.check)
+        # files written by the pipeline, with the job writing them
+        self.pipeline_files = []
+
+        engine = visibility_scene.mitsuba_engine
+        self.single_precision = engine.mesh_precision == 'single'
+        self.compression_level = engine.mesh_compression
+        self.chunk_size = engine.mesh_chunk_size
+        self.mesh_cache = engine.mesh_cache and NUMPY_AVAILABLE
+        self.prune_attributes = engine.prune_attributes
+        self.hair_format = engine.hair_format
+        GeometryExporter.EvaluatedMeshes.hits = 0
+        GeometryExporter.EvaluatedMeshes.misses = 0
+        # hair files found in the mesh store, and written to it
+        self.hair_hits = 0
+        self.hair_misses = 0
+        self.hair_source_hits = 0
+        # store keys of the files of the mesh store, by exported filename
+        self.store_files = {}
+
+        # shared content-addressed mesh files, keyed on the NumPy buffers
+        if engine.mesh_store and NUMPY_AVAILABLE:
+            self.mesh_store = MeshStore(get_mesh_store_dir(), engine.mesh_store_size * 1024 * 1024)
+
+        else:
+            self.mesh_store = None
+
         self.serializer = None
         self.fast_export = False
 
         from ..outputs.pure_api import PYMTS_AVAILABLE
 
-        if PYMTS_AVAILABLE:
+        # The Mitsuba serializer always uses its own precision and compression
+        if PYMTS_AVAILABLE and not self.single_precision and self.compression_level == 6 and \
+                self.mesh_store is None and not self.mesh_cache:
             from ..outputs.pure_api import Serializer
 
             self.serializer = Serializer()
             self.fast_export = True
 
+        # directory of the hair files shared by the frames of an animation export
+        self.shared_dir = None
+
+    def useSharedStore(self, mesh_store, shared_dir):
+        """
+        Write the meshes to mesh_store and the hair of static objects to
+        shared_dir, for files shared by the frames of an animation export.
+        """
+
+        self.mesh_store = mesh_store
+        self.shared_dir = shared_dir
+        self.mesh_cache = NUMPY_AVAILABLE
+
+        if self.mesh_cache:
+            self.serializer = None
+            self.fast_export = False
+
+    def recordStoredFiles(self, dependencies):
+        """
+        Record on the nodes built by this export the store keys of the files
+        their elements reference, see useStoredFiles.
+        """
+
+        for node in dependencies.built.values():
+            node.data['store_keys'] = {
+                self.store_files[filename]
+                for name, params in node.entries
+                for filename in get_param_recursive({}, params, 'filename')
+                if filename in self.store_files
+            }
+
+    def useStoredFiles(self, node):
+        """
+        Keep the store files of a node reused from a previous export, which
+        the store would otherwise evict as unused. Returns False when a file
+        is gone, and the node must be exported again.
+        """
+
+        store_keys = node.data.get('store_keys', ())
+
+        if len(store_keys) == 0:
+            return True
+
+        if self.mesh_store is None:
+            return False
+
+        return all([self.mesh_store.use(key) for key in store_keys])
+
+    def openMeshContainer(self, file_path):
+        if file_path not in self.MeshContainers:
+            if self.fast_export:
+                self.MeshContainers[file_path] = self.serializer.open_container(file_path)
+
+            else:
+                self.MeshContainers[file_path] = SerializedContainer(file_path)
+
+        return self.MeshContainers[file_path]
+
+    def closeMeshContainer(self, file_path):
+        container = self.MeshContainers.pop(file_path)
+
+        if self.fast_export:
+            container.close()
+            MtsLog('Mesh file written: %s' % file_path)
+
+        else:
+            # queued behind the shapes of the container still being written
+            self.submitJob(file_path, get_profiler().wrap('write', None, self.writeFile, file_path), file_path, container.close)
+            self.ClosingContainers.append((container, self.pipeline_files[-1][1]))
+
+    def writeFile(self, file_path, write_func, *args, **kwargs):
+        write_func(*args, **kwargs)
+        MtsLog('Mesh file written: %s' % file_path)
+
+    def submitFile(self, obj, file_path, store_key, write_func, *args, **kwargs):
+        """
+        Queue write_func(file_path, *args, **kwargs) for the mesh of obj,
+        going through the mesh store when the file is stored under store_key.
+        """
+
+        write_file = get_profiler().wrap('write', obj.name, self.writeFile, file_path)
+
+        if store_key is not None:
+            self.submitJob(file_path, write_file, file_path, self.mesh_store.add, store_key, file_path, write_func, *args, **kwargs)
+
+        else:
+            self.submitJob(file_path, write_file, file_path, write_func, file_path, *args, **kwargs)
+
+    def submitJob(self, file_path, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) writing the file at file_path on the pipeline.
+        """
+
+        self.pipeline_files.append((file_path, self.pipeline.submit(fn, *args, **kwargs)))
+
+    def writeShape(self, obj, file_path, container, store_key, write_func, *args):
+        """
+        Queue the compression and writing of a serialized shape of obj through
+        write_func(file_path, container, *args, shape_index, compression_level),
+        see write_serialized_shape_numpy. Returns the shape index of the shape in its file.
+        """
+
+        if container is None:
+            self.submitFile(obj, file_path, store_key, write_func, None, *args, compression_level=self.compression_level)
+
+            return 0
+
+        # The shape index is taken now, so the file keeps the export order
+        shape_index = container.reserve_shape()
+
+        try:
+            self.pipeline.submit(get_profiler().wrap('write', obj.name, write_func), file_path, container, *args,
+                shape_index=shape_index, compression_level=self.compression_level)
+
+        except:
+            container.write_encoded(shape_index, None)
+            raise
+
+        return shape_index
+
+    def finish(self):
+        """
+        Complete all mesh files that are still open or being written. Must be
+        called before the scene is configured, so no shape references an
+        unfinished file.
+        """
+
+        try:
+            for file_path in list(self.MeshContainers.keys()):
+                self.closeMeshContainer(file_path)
+
+            self.pipeline.wait()
+
+        finally:
+            self.pipeline.shutdown()
+            self.ClosingContainers = []
+
+        if self.mesh_store is not None:
+            self.mesh_store.save()
+
+        if self.mesh_cache:
+            MtsLog('Evaluated mesh cache: %d hits, %d misses' % (self.EvaluatedMeshes.hits, self.EvaluatedMeshes.misses))
+
+        if self.hair_source_hits or self.hair_hits or self.hair_misses:
+            MtsLog('Hair cache: %d hits before extraction, %d hits, %d misses' % (self.hair_source_hits, self.hair_hits, self.hair_misses))
+
+    def abort(self):
+        """
+        Stop writing after a failed or cancelled export, leaving no file
+        handle open and no file partially written.
+        """
+
+        self.pipeline.cancel()
+
+        # Discarding the containers also releases the shapes waiting for the
+        # index of a cancelled job, so the running jobs can finish
+        for container in self.MeshContainers.values():
+            container.discard()
+
+        for container, future in self.ClosingContainers:
+            if not future.done() or future.cancelled() or future.exception() is not None:
+                container.discard()
+
+        self.MeshContainers = {}
+        self.ClosingContainers = []
+        self.pipeline.shutdown()
+
+        for file_path, future in self.pipeline_files:
+            if (future.cancelled() or future.exception() is not None) and os.path.exists(file_path):
+                os.remove(file_path)
+
+        self.pipeline_files = []
+
+    def meshCacheKey(self, obj):
+        # The evaluated mesh also changes with the objects its modifiers use,
+        # which the update handlers do not report while rendering animations
+        if is_data_animated(obj) or any(is_object_animated(used) for used in modifier_objects(obj)):
+            frame = (self.geometry_scene.frame_current, self.geometry_scene.frame_subframe)
+
+        else:
+            frame = None
+
+        return (self.geometry_scene.name, obj.name, obj.data.name, modifier_signature(obj), frame,
+                obj.data.mitsuba_mesh.extraction)
+
     def buildMesh(self, obj, seq=0.0):
         """
         Decide which mesh format to output.
         """
 
-        # Using a cache on object massively speeds up dupli instance export
-        obj_cache_key = (self.geometry_scene, obj)
+        with profile('buildMesh', obj.name):
+            # Using a cache on object massively speeds up dupli instance export
+            obj_cache_key = (self.geometry_scene, obj)
 
-        if self.ExportedObjects.have(obj_cache_key):
-            return self.ExportedObjects.get(obj_cache_key)
+            if self.ExportedObjects.have(obj_cache_key):
+                return self.ExportedObjects.get(obj_cache_key)
 
-        mesh_definitions = self.writeMesh(obj, seq=seq)
+            with profile('writeMesh', obj.name):
+                mesh_definitions = self.writeMesh(obj, seq=seq)
 
-        self.ExportedObjects.add(obj_cache_key, mesh_definitions)
+            self.ExportedObjects.add(obj_cache_key, mesh_definitions)
 
-        return mesh_definitions
+            return mesh_definitions
+
+    def meshBuffers(self, obj, mesh, file_format, mesh_container):
+        """
+        Read the attributes of mesh in bulk for the NumPy writers, from its
+        loop triangles or its tessfaces as set on the mesh data. Returns None
+        when the mesh is written by the Python writers or the Mitsuba serializer.
+        """
+
+        if not NUMPY_AVAILABLE:
+            return None
+
+        # The Mitsuba serializer reads tessfaces, and owns its container files
+        use_serializer = file_format == 'serialized' and self.fast_export
+
+        if obj.data.mitsuba_mesh.extraction == 'loop_triangles' and not (use_serializer and mesh_container != 'shape'):
+            return LoopTriangleBuffers(mesh)
+
+        if use_serializer:
+            return None
+
+        return MeshBuffers(mesh)
+
+    def usedLayers(self, obj, mat_index):
+        """
+        Whether the material of a sub-mesh reads UVs and vertex colors.
+        """
+
+        try:
+            material = obj.material_slots[mat_index].material
+
+        except IndexError:
+            material = None
+
+        if material is None:
+            return (False, False)
+
+        mat_params = export_material(self.export_ctx, material)
+        types = set(get_param_recursive(self.export_ctx.scene_data, mat_params, 'type', missing=True))
+
+        # Elements not in the scene data may read any layer
+        if MISSING_REFERENCE in types:
+            return (True, True)
+
+        anisotropic = any(True for p in get_param_recursive(self.export_ctx.scene_data, mat_params, 'alphaU'))
+
+        return (anisotropic or len(types & UV_PLUGINS) > 0, 'vertexcolors' in types)
+
+    def pruneBuffers(self, obj, mat_index, buffers):
+        """
+        Leave out of the buffers of a sub-mesh the normals that Mitsuba
+        ignores or recomputes in the normal mode of the mesh, and the layers
+        its material does not use when pruning is enabled.
+        """
+
+        normals = obj.data.mitsuba_mesh.normals == 'default'
+        uvs = colors = True
+
+        if self.prune_attributes:
+            uvs, colors = self.usedLayers(obj, mat_index)
+
+        uvs = uvs or buffers.uvs is None
+        colors = colors or buffers.colors is None
+
+        if normals and uvs and colors:
+            return buffers
+
+        return buffers.prune(normals, uvs, colors)
 
     def writeMesh(self, obj, file_format='auto', base_frame=None, seq=0.0):
         """
@@ -126,28 +593,54 @@ class GeometryExporter:
         if base_frame is None:
             base_frame = self.visibility_scene.frame_current
 
+        # Serialized sub-meshes can be grouped into one file per object or scene
+        if file_format == 'serialized':
+            mesh_container = self.visibility_scene.mitsuba_engine.mesh_container
+
+        else:
+            mesh_container = 'shape'
+
+        mesh = None
+
         try:
             mesh_definitions = []
-            mesh = obj.to_mesh(self.geometry_scene, True, 'RENDER')
 
-            if mesh is None:
-                raise UnexportableObjectException('Cannot create render/export mesh')
+            if self.mesh_cache:
+                mesh_cache_key = self.meshCacheKey(obj)
+                mesh_cache_entry = self.EvaluatedMeshes.get(mesh_cache_key)
+
+            else:
+                mesh_cache_entry = None
+
+            if mesh_cache_entry is not None:
+                MtsLog('Reusing evaluated mesh: %s' % obj.name)
+                mesh = None
+                buffers, material_faces, number_of_mats, double_sided = mesh_cache_entry
+
+            else:
+                with profile('to_mesh', obj.name):
+                    mesh = obj.to_mesh(self.geometry_scene, True, 'RENDER')
 
-            # collate faces by mat index
-            ffaces_mats = {}
-            mesh_faces = mesh.tessfaces
+                if mesh is None:
+                    raise UnexportableObjectException('Cannot create render/export mesh')
 
-            for f in mesh_faces:
-                mi = f.material_index
+                # Bulk attribute buffers shared by the NumPy writers of every
+                # material sub-mesh. The Mitsuba serializer reads the mesh directly.
+                with profile('extraction', obj.name):
+                    buffers = self.meshBuffers(obj, mesh, file_format, mesh_container)
 
-                if mi not in ffaces_mats.keys():
-                    ffaces_mats[mi] = []
+                    if buffers is not None:
+                        material_faces = split_material_faces(buffers.material_index)
 
-                ffaces_mats[mi].append(f)
+                    else:
+                        material_faces = read_material_faces(mesh)
 
-            material_indices = ffaces_mats.keys()
+                number_of_mats = len(mesh.materials)
+                double_sided = mesh.show_double_sided
 
-            number_of_mats = len(mesh.materials)
+                if self.mesh_cache:
+                    self.EvaluatedMeshes.add(mesh_cache_key,
+                        (buffers, material_faces, number_of_mats, double_sided), buffers.nbytes)
 
             if number_of_mats > 0:
                 iterator_range = range(number_of_mats)
@@ -155,9 +648,19 @@ class GeometryExporter:
             else:
                 iterator_range = [0]
 
+            # Files holding a single shape can be taken from the mesh store
+            use_store = self.mesh_store is not None and mesh_container == 'shape'
+
+            container = None
+            container_path = None
+            container_shapes = 0
+            mesh_buffers = None
+
             for i in iterator_range:
+                self.progress.check()
+
                 try:
-                    if i not in material_indices:
+                    if i not in material_faces:
                         continue
 
                     # If this mesh/mat-index combo has already been processed, get it from the cache
@@ -167,6 +670,12 @@ class GeometryExporter:
                         mesh_definitions.append(self.ExportedMeshes.get(mesh_cache_key))
                         continue
 
+                    if buffers is not None:
+                        mesh_buffers = self.pruneBuffers(obj, i, buffers)
+
+                    else:
+                        mesh_buffers = None
+
                     # Put files in frame-numbered subfolders to avoid
                     # clobbering when rendering animations
                     sc_fr = get_output_subdir(self.geometry_scene, base_frame)
@@ -188,34 +697,115 @@ class GeometryExporter:
 
                     # skip writing the file if the box is checked
                     skip_exporting = obj in self.KnownExportedObjects and not obj in self.KnownModifiedObjects
+                    skip_exporting = self.visibility_scene.mitsuba_engine.partial_export and skip_exporting
+                    store_key = None
+
+                    if mesh_container == 'scene':
+                        # The scene file is rewritten as a whole on every export
+                        container_path = '/'.join([sc_fr, '%s_shapes.serialized' % bpy.path.clean_name(self.geometry_scene.name)])
+                        container = self.openMeshContainer(container_path)
+                        file_path = container_path
+                        write_file = True
+
+                    elif mesh_container == 'object':
+                        if container_path is None:
+                            def make_container_path():
+                                file_serial = self.ExportedFiles.serial((self.geometry_scene, obj.data, seq))
+                                file_name = '%s_%04d_%f' % (obj.data.name, file_serial, seq)
+                                return '/'.join([sc_fr, '%s.serialized' % bpy.path.clean_name(file_name)])
+
+                            container_path = make_container_path()
+
+                            while self.ExportedFiles.have(container_path):
+                                container_path = make_container_path()
+
+                            self.ExportedFiles.add(container_path, None)
 
-                    if not os.path.exists(file_path) or not (self.visibility_scene.mitsuba_engine.partial_export and skip_exporting):
+                            if not os.path.exists(container_path) or not skip_exporting:
+                                container = self.openMeshContainer(container_path)
+
+                        file_path = container_path
+                        write_file = container is not None
+
+                    elif use_store:
+                        # Identical geometry shares one file in the mesh store
+                        store_key = shape_key(mesh_buffers.digest(), i, file_format, self.single_precision, self.compression_level)
+                        file_path, write_file = self.mesh_store.reserve(store_key, file_format)
+                        self.store_files[self.export_ctx.get_export_path(file_path, relative=True)] = store_key
+
+                    else:
+                        write_file = not os.path.exists(file_path) or not skip_exporting
+
+                    # Shape index within an object file that is not rewritten
+                    shape_index = container_shapes
+                    container_shapes += 1
+
+                    if write_file:
 
                         GeometryExporter.NewExportedObjects.add(obj)
 
+                        # Very large meshes are streamed in chunks of faces
+                        chunked = mesh_buffers is not None and 0 < self.chunk_size < len(material_faces[i])
+
                         if file_format == 'ply':
-                            write_ply_mesh(file_path, mesh_name, mesh, ffaces_mats[i])
+                            if chunked:
+                                self.submitFile(obj, file_path, store_key, write_ply_mesh_chunked,
+                                    mesh_name, mesh_buffers, material_faces[i], self.chunk_size)
+
+                            elif mesh_buffers is not None:
+                                self.submitFile(obj, file_path, store_key, write_ply_mesh_numpy,
+                                    mesh_name, mesh_buffers, material_faces[i])
+
+                            else:
+                                get_profiler().wrap('write', obj.name, write_ply_mesh, file_path)(
+                                    file_path, mesh_name, mesh, material_faces[i])
+                                MtsLog('Mesh file written: %s' % (file_path))
 
                         else:
-                            if self.fast_export:
-                                self.serializer.serialize(file_path, mesh_name, mesh, i)
+                            if self.fast_export and mesh_buffers is None:
+                                if container is not None:
+                                    with profile('write', obj.name):
+                                        shape_index = container.serialize(mesh_name, mesh, i)
+
+                                else:
+                                    get_profiler().wrap('write', obj.name, self.serializer.serialize, file_path)(
+                                        file_path, mesh_name, mesh, i)
+                                    MtsLog('Mesh file written: %s' % (file_path))
+
+                            elif chunked:
+                                shape_index = self.writeShape(obj, file_path, container, store_key, write_serialized_mesh_chunked,
+                                    mesh_name, mesh_buffers, material_faces[i], self.chunk_size, self.single_precision)
+
+                            elif mesh_buffers is not None:
+                                shape_index = self.writeShape(obj, file_path, container, store_key, write_serialized_shape_numpy,
+                                    mesh_name, mesh_buffers, material_faces[i], self.single_precision)
 
                             else:
-                                write_serialized_mesh(file_path, mesh_name, mesh, ffaces_mats[i])
+                                shape_index = get_profiler().wrap('write', obj.name, write_serialized_mesh,
+                                    file_path if container is None else None)(
+                                    file_path, mesh_name, mesh, material_faces[i], container,
+                                    self.single_precision, self.compression_level)
 
-                        MtsLog('Mesh file written: %s' % (file_path))
+                                if container is None:
+                                    MtsLog('Mesh file written: %s' % (file_path))
 
                     else:
                         MtsLog('Skipping already exported mesh: %s' % mesh_name)
 
                     shape_params = {
                         'filename': self.export_ctx.get_export_path(file_path, relative = True),
-                        'doubleSided': mesh.show_double_sided
+                        'doubleSided': double_sided
                     }
 
+                    if mesh_container != 'shape':
+                        shape_params.update({'shapeIndex': shape_index})
+
                     if obj.data.mitsuba_mesh.normals == 'facenormals':
                         shape_params.update({'faceNormals': 'true'})
 
+                    elif obj.data.mitsuba_mesh.normals == 'dihedralangle':
+                        shape_params.update({'maxSmoothAngle': obj.data.mitsuba_mesh.max_smooth_angle})
+
                     mesh_definition = (
                         mesh_name,
                         i,
@@ -242,21 +832,30 @@ class GeometryExporter:
                 except InvalidGeometryException as err:
                     MtsLog('Mesh export failed, skipping this mesh: %s' % err)
 
-            del ffaces_mats
-            bpy.data.meshes.remove(mesh)
+            if mesh_container == 'object' and container is not None:
+                self.closeMeshContainer(container_path)
+
+            del material_faces
+            del buffers
+            del mesh_buffers
 
         except UnexportableObjectException as err:
             MtsLog('Object export failed, skipping this object: %s' % err)
 
+        finally:
+            if mesh is not None:
+                bpy.data.meshes.remove(mesh)
+
         return mesh_definitions
 
     is_preview = False
 
     def allowDoubleSided(self, mat_params):
-        types = get_param_recursive(self.export_ctx.scene_data, mat_params, 'type')
+        types = get_param_recursive(self.export_ctx.scene_data, mat_params, 'type', missing=True)
 
         for t in types:
-            if t in {'null', 'dielectric', 'thindielectric', 'roughdielectric', 'difftrans', 'hk', 'mask', 'twosided'}:
+            if t is MISSING_REFERENCE or \
+                    t in {'null', 'dielectric', 'thindielectric', 'roughdielectric', 'difftrans', 'hk', 'mask', 'twosided'}:
                 return False
 
         return True
@@ -465,70 +1064,167 @@ class GeometryExporter:
 
                 self.export_ctx.data_add(deformable)
 
-    def BSpline(self, points, dimension, degree, u):
-        controlpoints = []
+    def extractStrands(self, obj, psys, count, steps, det):
+        """
+        Points of count strands of a hair system, in object space, leaving
+        out points at the origin of the world as Blender gives for missing
+        steps. Returns StrandBuffers with NumPy, lists of points without.
+        """
 
-        def Basispolynom(controlpoints, i, u, degree):
-            if degree == 0:
-                temp = 0
+        transform = obj.matrix_world.inverted()
 
-                if (controlpoints[i] <= u) and (u < controlpoints[i + 1]):
-                    temp = 1
+        if not NUMPY_AVAILABLE:
+            strands = []
 
-            else:
-                N0 = Basispolynom(controlpoints, i, u, degree - 1)
-                N1 = Basispolynom(controlpoints, i + 1, u, degree - 1)
+            for pindex in range(count):
+                self.progress.check()
+                det.exported_objects += 1
+                points = []
 
-                if N0 == 0:
-                    sum1 = 0
+                for step in range(0, steps + 1):
+                    co = psys.co_hair(obj, pindex, step)
+                    if not co.length_squared == 0:
+                        points.append(transform * co)
 
-                else:
-                    sum1 = (u - controlpoints[i]) / (controlpoints[i + degree] - controlpoints[i]) * N0
+                strands.append(points)
 
-                if N1 == 0:
-                    sum2 = 0
+            return strands
 
-                else:
-                    sum2 = (controlpoints[i + 1 + degree] - u) / (controlpoints[i + 1 + degree] - controlpoints[i + 1]) * N1
+        co_hair = psys.co_hair
+        coords = numpy.empty((count, steps + 1, 3), dtype=numpy.float64)
 
-                temp = sum1 + sum2
+        for pindex in range(count):
+            self.progress.check()
+            det.exported_objects += 1
+            strand = coords[pindex]
+
+            for step in range(0, steps + 1):
+                strand[step] = co_hair(obj, pindex, step)
+
+        mask = numpy.any(coords != 0.0, axis=2)
+        points = transform_points(transform, coords[mask])
+
+        return StrandBuffers(points, mask.sum(axis=1))
+
+    def hairSourceKey(self, obj, psys, steps, hair_format, hair_chunks):
+        """
+        Key of everything the strands of a hair system are made from, known
+        before they are extracted: the particle settings, the modifiers and
+        mesh of the emitter, the parent hair and the frame when animated.
+        """
+
+        settings = psys.settings
+        emitter = obj.data
+        options = (rna_signature(settings), rna_signature(settings.mitsuba_hair), rna_signature(psys),
+                   modifier_signature(obj), steps, hair_format, hair_chunks)
+
+        if is_object_animated(obj) or psys.use_hair_dynamics:
+            options += (self.visibility_scene.frame_current,)
+
+        key = hashlib.sha1(repr(options).encode())
+        vertices = foreach_get_array(emitter.vertices, 'co', len(emitter.vertices), 3, numpy.float32)
+        key.update(vertices.tobytes())
+
+        for particle in psys.particles:
+            hair_keys = particle.hair_keys
+            key.update(foreach_get_array(hair_keys, 'co', len(hair_keys), 3, numpy.float32).tobytes())
+
+        return key.hexdigest()
+
+    def writeHair(self, obj, psys, strands, hair_file_path, steps, hair_format):
+        """
+        Queue the writing of the hair file of strands, going through the
+        mesh store when in use. Returns the path of the file and its store
+        key, None without the store.
+        """
 
-            return temp
+        # Hair files are stored under the hash of the strands and of
+        # the settings turning them into the file
+        if self.mesh_store is not None:
+            with profile('hash', obj.name):
+                store_key = shape_key(strands.digest(), 'hair', steps, psys.settings.use_hair_bspline, hair_format)
 
-        for i in range(len(points) + degree + 1):
-            if i <= degree:
-                controlpoints.append(0)
+            hair_file_path, write_file = self.mesh_store.reserve(store_key, 'hair')
+            self.store_files[self.export_ctx.get_export_path(hair_file_path)] = store_key
 
-            elif i >= len(points):
-                controlpoints.append(len(points) - degree)
+            if write_file:
+                self.hair_misses += 1
 
             else:
-                controlpoints.append(i - degree)
+                self.hair_hits += 1
+                return hair_file_path, store_key
+
+        else:
+            store_key = None
+
+        if psys.settings.use_hair_bspline:
+            with profile('bspline', obj.name):
+                strands = resample_bspline_strands(strands, 2, steps)
 
-        if dimension == 2:
-            temp = mathutils.Vector((0.0, 0.0))
+        write_hair = write_binary_hair_file if hair_format == 'binary' else write_hair_file
 
-        elif dimension == 3:
-            temp = mathutils.Vector((0.0, 0.0, 0.0))
+        if store_key is not None:
+            self.submitJob(hair_file_path, get_profiler().wrap('write', obj.name, self.mesh_store.add, hair_file_path),
+                store_key, hair_file_path, write_hair, strands)
 
-        for i in range(len(points)):
-            temp = temp + Basispolynom(controlpoints, i, u, degree) * points[i]
+        else:
+            self.submitJob(hair_file_path, get_profiler().wrap('write', obj.name, write_hair, hair_file_path),
+                hair_file_path, strands)
 
-        return temp
+        return hair_file_path, store_key
 
     def handler_Duplis_PATH(self, obj, psys):
+        """
+        Queue the writing of the hair files of a hair particle system of obj,
+        returning their paths, none when the system is not rendered.
+        """
+
         if not psys.settings.type == 'HAIR':
             MtsLog('ERROR: handler_Duplis_PATH can only handle Hair particle systems ("%s")' % psys.name)
-            return ''
+            return []
 
         for mod in obj.modifiers:
             if mod.type == 'PARTICLE_SYSTEM' and mod.show_render is False:
-                return ''
+                return []
 
         MtsLog('Exporting Hair system "%s"...' % psys.name)
 
-        psys.set_resolution(self.geometry_scene, obj, 'RENDER')
         steps = 2 ** psys.settings.render_step
+        hair_format = psys.settings.mitsuba_hair.hair_format
+
+        if hair_format == 'default':
+            hair_format = self.hair_format
+
+        hair_chunks = psys.settings.mitsuba_hair.hair_chunks
+
+        if hair_chunks <= 1 or not NUMPY_AVAILABLE:
+            hair_chunks = 1
+
+        # The files written for the same settings and emitter are reused
+        # without extracting the strands, their hash only dedupes the rest
+        if self.mesh_store is not None:
+            with profile('hash', obj.name):
+                source_key = self.hairSourceKey(obj, psys, steps, hair_format, hair_chunks)
+
+            store_keys = self.mesh_store.lookup(source_key)
+
+            if store_keys is not None:
+                filenames = []
+
+                for store_key in store_keys:
+                    filename = self.export_ctx.get_export_path(self.mesh_store.file_path(store_key, 'hair'))
+                    self.store_files[filename] = store_key
+                    filenames.append(filename)
+
+                self.hair_source_hits += 1
+                MtsLog('... done, reused %d stored files' % len(filenames))
+
+                return filenames
+
+        else:
+            source_key = None
+
+        psys.set_resolution(self.geometry_scene, obj, 'RENDER')
         num_parents = len(psys.particles)
         num_children = len(psys.child_particles)
 
@@ -536,52 +1232,56 @@ class GeometryExporter:
         det = DupliExportProgressThread()
         det.start(num_parents + num_children)
 
-        # Put Hair files in frame-numbered subfolders to avoid
-        # clobbering when rendering animations
-        sc_fr = get_output_subdir(self.geometry_scene, self.visibility_scene.frame_current)
-
-        hair_filename = '%s.hair' % bpy.path.clean_name(partsys_name)
-        hair_file_path = '/'.join([sc_fr, hair_filename])
+        try:
+            # Put Hair files in frame-numbered subfolders to avoid
+            # clobbering when rendering animations
+            if self.shared_dir is not None and not is_object_animated(obj) and not psys.use_hair_dynamics:
+                sc_fr = self.shared_dir
 
-        hair_file = open(hair_file_path, 'w')
+            else:
+                sc_fr = get_output_subdir(self.geometry_scene, self.visibility_scene.frame_current)
 
-        transform = obj.matrix_world.inverted()
+            hair_filename = '%s.hair' % bpy.path.clean_name(partsys_name)
+            hair_file_path = '/'.join([sc_fr, hair_filename])
 
-        for pindex in range(num_parents + num_children):
-            det.exported_objects += 1
-            points = []
+            # Only the strand points are read here, the file is written by the pipeline
+            with profile('hair_extract', obj.name) as span:
+                strands = self.extractStrands(obj, psys, num_parents + num_children, steps, det)
 
-            for step in range(0, steps + 1):
-                co = psys.co_hair(obj, pindex, step)
-                if not co.length_squared == 0:
-                    points.append(transform * co)
+                if NUMPY_AVAILABLE:
+                    span.nbytes = strands.points.nbytes
 
-            if psys.settings.use_hair_bspline:
-                temp = []
-                degree = 2
-                dimension = 3
+            # Large systems are split into chunks of strands close in space,
+            # written in parallel and exported as shapes of their own
+            if hair_chunks > 1:
+                with profile('hair_chunks', obj.name):
+                    chunks = strands.split(hair_chunks)
 
-                for i in range(math.trunc(math.pow(2, psys.settings.render_step))):
-                    if i > 0:
-                        u = i * (len(points) - degree) / math.trunc(math.pow(2, psys.settings.render_step) - 1) - 0.0000000000001
+            else:
+                chunks = [strands]
 
-                    else:
-                        u = i * (len(points) - degree) / math.trunc(math.pow(2, psys.settings.render_step) - 1)
-                    temp.append(self.BSpline(points, dimension, degree, u))
+            filenames = []
+            store_keys = []
 
-                points = temp
+            for index, chunk in enumerate(chunks):
+                if len(chunks) > 1:
+                    chunk_file_path = '/'.join([sc_fr, '%s_%d.hair' % (bpy.path.clean_name(partsys_name), index)])
 
-            for p in points:
-                hair_file.write('%f %f %f\n' % (p[0], p[1], p[2]))
+                else:
+                    chunk_file_path = hair_file_path
 
-            hair_file.write('\n')
+                chunk_file_path, store_key = self.writeHair(obj, psys, chunk, chunk_file_path, steps, hair_format)
+                filenames.append(self.export_ctx.get_export_path(chunk_file_path))
+                store_keys.append(store_key)
 
-        hair_file.close()
+            if source_key is not None:
+                self.mesh_store.link(source_key, store_keys)
 
-        psys.set_resolution(self.geometry_scene, obj, 'PREVIEW')
-        det.stop()
-        det.join()
+        finally:
+            psys.set_resolution(self.geometry_scene, obj, 'PREVIEW')
+            det.stop()
+            det.join()
 
-        MtsLog('... done, exported %s hairs' % det.exported_objects)
+        MtsLog('... done, exported %s hairs in %d files' % (det.exported_objects, len(filenames)))
 
-        return self.export_ctx.get_export_path(hair_file_path)
+        return filenames
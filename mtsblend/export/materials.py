@@ -27,9 +27,13 @@ import os
 import tempfile
 import math
 
+import bpy
+
 from ..export.cycles import cycles_material_to_dict
+from ..export.dependencies import DependencyGraph, copy_params
 from ..outputs.file_api import FileExportContext
 from ..outputs import MtsLog
+from ..outputs.profiler import profile
 
 
 class MaterialCounter:
@@ -135,7 +139,34 @@ def export_image(export_ctx, image):
     return tex_image
 
 
-def export_textures(export_ctx, params):
+def texture_signature(texture):
+    '''
+    Texture parameters with the image replaced by its name
+    '''
+
+    signature = dict(texture)
+
+    if 'image' in signature:
+        signature['image'] = signature['image'].name
+
+    return signature
+
+
+def signature_texture(signature):
+    texture = dict(signature)
+
+    if 'image' in texture:
+        texture['image'] = bpy.data.images.get(texture['image'])
+
+    return texture
+
+
+def export_textures(export_ctx, params, used=None):
+    '''
+    Export the bitmaps of params as textures referenced by id, appending
+    the (id, texture) pairs to used if given
+    '''
+
     if not isinstance(params, (dict)):
         return
 
@@ -146,6 +177,9 @@ def export_textures(export_ctx, params):
         if 'type' in elem and elem['type'] in {'bitmap'}:
             tex_id = get_texture_id(elem)
 
+            if used is not None:
+                used.append((tex_id, elem))
+
             if tex_id not in ExportedTextures.exported_textures_dict:
                 tex_params = elem.copy()
                 tex_params['id'] = tex_id
@@ -170,7 +204,7 @@ def export_textures(export_ctx, params):
             params[key] = {'type': 'ref', 'id': tex_id}
 
         else:
-            export_textures(export_ctx, elem)
+            export_textures(export_ctx, elem, used)
 
 
 def get_instance_materials(ob):
@@ -364,16 +398,104 @@ def export_material(export_ctx, material):
     else:
         name = "%s-bl_mat" % material.name
 
+    dependencies = export_ctx.dependencies
+    node_key = ('export_material', name)
+
+    if dependencies is not None:
+        dependencies.depend(node_key)
+
     if name in ExportedMaterials.exported_materials_dict:
         return ExportedMaterials.exported_materials_dict[name]
 
-    if ntree:
-        mat_params = ntree.get_nodetree_dict(export_ctx, ntree)
+    if dependencies is None:
+        return export_material_params(export_ctx, material, ntree, name)
 
-    else:
-        mat_params = blender_material_to_dict(export_ctx, material)
+    if dependencies.is_clean(node_key) and can_replay_material(dependencies.nodes[node_key]):
+        dependencies.replay(node_key)
+
+        return ExportedMaterials.exported_materials_dict[name]
+
+    with dependencies.build(node_key) as node:
+        dependencies.depend(('material', material.name))
+
+        if ntree:
+            dependencies.depend(('node_tree', ntree.name))
+
+        textures = []
+        mat_params = export_material_params(export_ctx, material, ntree, name, textures)
+
+        for tex_id, texture in textures:
+            if 'image' in texture:
+                dependencies.depend(('image', texture['image'].name))
+
+        node.data['name'] = name
+        node.data['params'] = copy_params(mat_params)
+        node.data['textures'] = [
+            (tex_id, texture_signature(texture), copy_params(export_ctx.scene_data.get(tex_id)))
+            for tex_id, texture in textures
+        ]
+
+    return mat_params
+
+
+def can_replay_material(node):
+    '''
+    Whether the textures of a material exported before can be registered
+    again under the same ids
+    '''
+
+    exported_textures = ExportedTextures.exported_textures_dict
+
+    for tex_id, signature, tex_params in node.data['textures']:
+        texture = signature_texture(signature)
+
+        if 'image' in texture and texture['image'] is None:
+            return False
+
+        if tex_id in exported_textures and exported_textures[tex_id] != texture:
+            return False
+
+    return True
+
+
+def replay_textures(export_ctx, node, add_elements=True):
+    '''
+    Register the textures of a material exported before, adding their
+    elements unless they are written to a file of their own
+    '''
+
+    for tex_id, signature, tex_params in node.data['textures']:
+        if tex_id in ExportedTextures.exported_textures_dict:
+            continue
+
+        if add_elements:
+            if tex_params is not None:
+                export_ctx.data_add(copy_params(tex_params))
+
+            else:
+                ExportedTextures.ensureWarningTexture(export_ctx, tex_id)
+
+        ExportedTextures.addExportedTexture(tex_id, signature_texture(signature))
+
+
+def replay_material(export_ctx, node, add_elements=True):
+    replay_textures(export_ctx, node, add_elements)
+    ExportedMaterials.addExportedMaterial(node.data['name'], copy_params(node.data['params']))
+
+
+DependencyGraph.replay_hooks['export_material'] = replay_material
+
+
+def export_material_params(export_ctx, material, ntree, name, textures=None):
+    with profile('export_material', material.name):
+        if ntree:
+            mat_params = ntree.get_nodetree_dict(export_ctx, ntree)
+
+        else:
+            mat_params = blender_material_to_dict(export_ctx, material)
 
-    export_textures(export_ctx, mat_params)
+    with profile('export_textures', material.name):
+        export_textures(export_ctx, mat_params, textures)
 
     if 'emitter' in mat_params:
         try:
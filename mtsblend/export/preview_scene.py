@@ -147,6 +147,8 @@ def preview_scene(scene, export_ctx, obj=None, mat=None, tex=None):
 
                     export_ctx.data_add(shape)
 
+            GE.finish()
+
         if emitter:
             return
 
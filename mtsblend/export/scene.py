@@ -22,19 +22,41 @@
 # ***** END GPL LICENSE BLOCK *****
 
 # System Libs
+from collections import OrderedDict
+
 import os
 
 # Extensions_Framework Libs
 from ..extensions_framework import util as efutil
 
 # Mitsuba libs
-from ..export.environment import get_environment_trafo, export_world_environment
+from ..export.environment import get_environment_trafo, is_environment_animated, export_world_environment
 from ..export.cameras import export_camera_instance
 from ..export.lamps import export_lamp_instance
 from ..export.materials import ExportedMaterials, ExportedTextures
 from ..export.geometry import GeometryExporter
-from ..export import Instance, is_object_visible, is_light, is_mesh, is_deforming, object_render_hide, object_render_hide_duplis
+from ..export.dependencies import DependencyGraph
+from ..export import ExportProgress, ExportCancelled
+from ..export import Instance, is_object_visible, is_light, is_mesh, is_deforming, is_object_animated, object_render_hide, object_render_hide_duplis
 from ..outputs import MtsManager, MtsLog
+from ..outputs.profiler import ExportProfiler, set_profiler, profile
+
+
+# Engine settings changing the exported elements of every object
+SIGNATURE_SETTINGS = (
+    'mesh_type',
+    'mesh_container',
+    'mesh_precision',
+    'mesh_compression',
+    'mesh_chunk_size',
+    'prune_attributes',
+    'mesh_store',
+    'hair_format',
+)
+
+
+def matrix_fingerprint(matrix):
+    return tuple(tuple(row) for row in matrix)
 
 
 def get_subframes(segs, shutter):
@@ -45,10 +67,15 @@ def get_subframes(segs, shutter):
 
 
 def get_obj_unique_id(b_ob, duplicator):
+    '''
+    Object of b_ob and the key of its instance: the object name, or a
+    (duplicator name, object name, persistent id) tuple for duplis. The
+    readable name of the key is only built on export, see instance_name().
+    '''
+
     if duplicator is not None:
         obj = b_ob.object
-        persistent_id = ['%X' % i for i in b_ob.persistent_id if i < 0x7fffffff]
-        unique_id = '%s_%s_Dupli(%s)' % (duplicator.name, obj.name, 'x'.join(persistent_id))
+        unique_id = (duplicator.name, obj.name, tuple(b_ob.persistent_id))
 
     else:
         obj = b_ob
@@ -57,6 +84,24 @@ def get_obj_unique_id(b_ob, duplicator):
     return (obj, unique_id)
 
 
+def instance_name(unique_id):
+    '''
+    Name of an instance key, used in the ids of its elements. Hair keys are
+    (instance key, particle system name) tuples.
+    '''
+
+    if isinstance(unique_id, str):
+        return unique_id
+
+    if len(unique_id) == 2:
+        return '%s_%s' % (instance_name(unique_id[0]), unique_id[1])
+
+    duplicator_name, obj_name, persistent_id = unique_id
+    persistent_id = ['%X' % i for i in persistent_id if i < 0x7fffffff]
+
+    return '%s_%s_Dupli(%s)' % (duplicator_name, obj_name, 'x'.join(persistent_id))
+
+
 class SceneExporterProperties:
     """
     Mimics the properties member contained within EXPORT_OT_Mitsuba operator
@@ -74,6 +119,21 @@ class SceneExporter:
     properties = SceneExporterProperties()
     shape_instances = {}
 
+    # Elements exported for each object, material and world, reused by
+    # the next incremental export when their datablocks did not change
+    Dependencies = DependencyGraph()
+    dependencies = None
+
+    # AnimationExportSession exporting the current frame, if any
+    session = None
+
+    # render engine showing the progress and cancelling the export, if any
+    engine = None
+    progress = None
+
+    # dependency graph node of the object being synced, see sync_object_node()
+    instance_node = None
+
     def set_properties(self, properties):
         self.properties = properties
         return self
@@ -86,20 +146,31 @@ class SceneExporter:
         self.report = report
         return self
 
+    def set_engine(self, engine):
+        self.engine = engine
+        return self
+
     def report(self, type, message):
         MtsLog('%s: %s' % ('|'.join([('%s' % i).upper() for i in type]), message))
 
     def sync_light(self, instances, b_ob, duplicator=None, trafo=None, base_frame=0, seq=0.0):
         (obj, unique_id) = get_obj_unique_id(b_ob, duplicator)
+        instance = instances.get(unique_id)
 
-        try:
-            instances[unique_id].append_motion(trafo, seq)
+        if instance is not None:
+            instance.append_motion(trafo, seq)
 
-        except:
-            instances[unique_id] = Instance(
+        else:
+            self.add_instance(instances, unique_id, Instance(
                 obj,
                 trafo,
-            )
+            ))
+
+    def add_instance(self, instances, unique_id, instance):
+        instances[unique_id] = instance
+
+        if self.instance_node is not None:
+            self.instance_nodes[unique_id] = self.instance_node
 
     def sync_object(self, instances, b_ob, duplicator=None, trafo=None, hide_mesh=False, base_frame=0, seq=0.0):
         (obj, unique_id) = get_obj_unique_id(b_ob, duplicator)
@@ -117,41 +188,45 @@ class SceneExporter:
             if duplicator is not None:
                 self.GE.objects_used_as_duplis.add(obj)
 
-            if unique_id in instances:
-                instance = instances[unique_id]
+            instance = instances.get(unique_id)
+
+            if instance is not None:
                 is_deform = is_deforming(obj)
 
                 instance.append_motion(trafo, seq, is_deform)
 
                 if is_deform:
-                    instance.mesh.append(self.GE.writeMesh(obj, base_frame=base_frame, seq=seq))
+                    with profile('writeMesh', obj.name):
+                        instance.mesh.append(self.GE.writeMesh(obj, base_frame=base_frame, seq=seq))
 
             else:
-                instances[unique_id] = Instance(
+                self.add_instance(instances, unique_id, Instance(
                     obj,
                     trafo,
                     mesh=self.GE.buildMesh(obj, seq=seq),
-                )
+                ))
 
         number_psystems = len(obj.particle_systems)
 
         if number_psystems > 0:
             for psys in obj.particle_systems:
                 if psys.settings.render_type in 'PATH':
-                    hair_id = '%s_%s' % (unique_id, psys.name)
+                    hair_id = (unique_id, psys.name)
+                    instance = instances.get(hair_id)
 
-                    if hair_id in instances:
-                        instances[hair_id].append_motion(trafo, seq)
+                    if instance is not None:
+                        instance.append_motion(trafo, seq)
 
                     else:
-                        filename = self.GE.handler_Duplis_PATH(obj, psys)
+                        filenames = self.GE.handler_Duplis_PATH(obj, psys)
 
-                        if filename:
-                            instances[hair_id] = Instance(
+                        if filenames:
+                            # one shape per chunk of the system, see hair_chunks
+                            self.add_instance(instances, hair_id, Instance(
                                 obj,
                                 trafo,
                                 mesh=[(
-                                    'hair',
+                                    'hair' if len(filenames) == 1 else 'hair_%d' % index,
                                     psys.settings.material - 1,
                                     'hair',
                                     {
@@ -159,8 +234,74 @@ class SceneExporter:
                                         'radius': psys.settings.mitsuba_hair.hair_width / 2.0
                                     },
                                     seq
-                                )],
-                            )
+                                ) for index, filename in enumerate(filenames)],
+                            ))
+
+    def object_node(self, b_ob):
+        '''
+        Dependency graph node of an object, None if the object is exported
+        on every export
+        '''
+
+        if self.dependencies is None or b_ob.is_duplicator or is_deforming(b_ob):
+            return None
+
+        if is_mesh(b_ob):
+            # A scene container is rewritten with the meshes exported, and
+            # meshes with several users are written under shared names
+            if self.scene.mitsuba_engine.mesh_container == 'scene' or b_ob.data.users > 1:
+                return None
+
+        elif not is_light(b_ob):
+            return None
+
+        return ('export_object', b_ob.name)
+
+    def sync_object_node(self, instances, node_key, b_ob, trafo, hide_mesh, base_frame, seq):
+        '''
+        Sync an object of the dependency graph, leaving clean objects to be
+        replayed by export()
+        '''
+
+        reused_objects = self.reused_objects[self.GE.geometry_scene.name]
+
+        if node_key in reused_objects:
+            return
+
+        dependencies = self.dependencies
+
+        if node_key not in dependencies.built:
+            fingerprint = (
+                hide_mesh,
+                matrix_fingerprint(trafo),
+                tuple(slot.material.name if slot.material else None for slot in b_ob.material_slots),
+            )
+
+            # the files of the object must still be in the mesh store
+            if dependencies.is_clean(node_key, fingerprint) and self.GE.useStoredFiles(dependencies.nodes[node_key]):
+                reused_objects[node_key] = b_ob
+                return
+
+        else:
+            fingerprint = None
+
+        self.instance_node = node_key
+
+        with dependencies.build(node_key, fingerprint):
+            dependencies.depend(('object', b_ob.name))
+            dependencies.depend(('data', b_ob.data.name))
+
+            if is_light(b_ob):
+                ntree = b_ob.data.mitsuba_nodes.get_node_tree()
+
+                if ntree:
+                    dependencies.depend(('node_tree', ntree.name))
+
+            try:
+                self.sync_object(instances, b_ob, None, trafo, hide_mesh, base_frame, seq)
+
+            finally:
+                self.instance_node = None
 
     # Create two lists, one of data blocks to export and one of instances to export
     # Collect and store motion blur transformation data in a pre-process.
@@ -169,28 +310,45 @@ class SceneExporter:
         origframe = scene.frame_current
         scene_motion_segments = scene.render.motion_blur_samples if scene.render.use_motion_blur else 0
         segs = {}
+        all_segs = {scene_motion_segments}
+        animated_objects = 0
+        static_objects = 0
         b_sce = scene
 
+        # The camera and environment are sampled at the scene subframes
+        # only when they move, static objects only at the frame itself
+        camera_animated = scene_motion_segments > 0 and \
+            (is_object_animated(scene.camera) or is_environment_animated(scene.world))
+
         while b_sce is not None:
             # get a de-duplicated set of all possible numbers of motion segments
             # from renderable objects in the scene, and global scene settings
-            segs[b_sce.name] = {}
-            segs[b_sce.name][scene_motion_segments] = []
+            segs[b_sce.name] = {0: []}
             self.shape_instances[b_sce.name] = {}
+            self.reused_objects[b_sce.name] = OrderedDict()
+
+            if camera_animated and b_sce is scene:
+                segs[b_sce.name][scene_motion_segments] = []
 
             for b_ob in b_sce.objects:
                 if is_object_visible(scene, b_ob):
                     if scene.render.use_motion_blur and b_ob.mitsuba_object.motion_samples_override:
                         ob_segments = b_ob.mitsuba_object.motion_blur_samples
 
-                        try:
-                            segs[b_sce.name][ob_segments].append(b_ob)
+                    else:
+                        ob_segments = scene_motion_segments
 
-                        except:
-                            segs[b_sce.name][ob_segments] = [b_ob]
+                    all_segs.add(ob_segments)
 
-                    else:
-                        segs[b_sce.name][scene_motion_segments].append(b_ob)
+                    if ob_segments > 0:
+                        if is_object_animated(b_ob):
+                            animated_objects += 1
+
+                        else:
+                            static_objects += 1
+                            ob_segments = 0
+
+                    segs[b_sce.name].setdefault(ob_segments, []).append(b_ob)
 
             b_sce = b_sce.background_set
 
@@ -199,94 +357,195 @@ class SceneExporter:
         for scene_segs in segs.values():
             for num_segs in scene_segs.keys():
                 for sub in get_subframes(num_segs, scene.render.motion_blur_shutter):
-                    try:
-                        subframes[sub].append(num_segs)
+                    subframes.setdefault(sub, set()).add(num_segs)
+
+        # frame updates of sampling every object at every subframe
+        all_subframes = set()
+
+        for num_segs in all_segs:
+            all_subframes.update(get_subframes(num_segs, scene.render.motion_blur_shutter))
 
-                    except:
-                        subframes[sub] = [num_segs]
+        frame_sets = 0
+        current_frame = (origframe, scene.frame_subframe)
+
+        self.progress.start('Syncing objects', sum(
+            len(scene_segs.get(num_segs, ())) for seq_groups in subframes.values()
+            for num_segs in seq_groups for scene_segs in segs.values()))
 
         # the aim here is to do only a minimal number of scene updates,
         # so we go through all subframes and process objects pertaining to
         # segment groups included in the subframe
-        while subframes:
-            sub = min(subframes.keys())
-            seq = sub / scene.render.motion_blur_shutter
-            seq_groups = subframes.pop(sub)
-            isub, fsub = int(sub), sub - int(sub)
-            scene.frame_set(origframe + isub, fsub)
+        try:
+            while subframes:
+                sub = min(subframes.keys())
+                seq = sub / scene.render.motion_blur_shutter
+                seq_groups = subframes.pop(sub)
+                isub, fsub = int(sub), sub - int(sub)
 
-            cam = scene.camera.data
-            cam_trafo = (scene.camera.matrix_world.copy(),
-                cam.ortho_scale / 2.0 if cam.type == 'ORTHO' else None)
+                if (origframe + isub, fsub) != current_frame:
+                    with profile('frame_set'):
+                        scene.frame_set(origframe + isub, fsub)
 
-            self.scene_camera.append_motion(cam_trafo, seq)
+                    current_frame = (origframe + isub, fsub)
+                    frame_sets += 1
 
-            env_trafo = get_environment_trafo(scene.world)
+                cam = scene.camera.data
+                cam_trafo = (scene.camera.matrix_world.copy(),
+                    cam.ortho_scale / 2.0 if cam.type == 'ORTHO' else None)
 
-            if env_trafo is not None:
-                self.world_environment.append_motion(env_trafo, seq)
+                self.scene_camera.append_motion(cam_trafo, seq)
 
-            b_sce = scene
+                env_trafo = get_environment_trafo(scene.world)
 
-            while b_sce is not None:
-                self.GE.geometry_scene = b_sce
-                instances = self.shape_instances[b_sce.name]
+                if env_trafo is not None:
+                    self.world_environment.append_motion(env_trafo, seq)
+
+                b_sce = scene
+
+                while b_sce is not None:
+                    self.GE.geometry_scene = b_sce
+                    instances = self.shape_instances[b_sce.name]
 
-                while seq_groups:
-                    try:
-                        num_segs = seq_groups.pop()
-                        scene_obs = segs[b_sce.name][num_segs]
+                    for num_segs in seq_groups:
+                        try:
+                            scene_obs = segs[b_sce.name][num_segs]
 
-                    except:
-                        continue
+                        except:
+                            continue
 
-                    for b_ob in scene_obs:
-                        if scene.mitsuba_testing.object_analysis:
-                            MtsLog('Analysing object %s : %s' % (b_ob, b_ob.type))
+                        for b_ob in scene_obs:
+                            self.progress.step()
 
-                        if b_ob.is_duplicator and not object_render_hide_duplis(b_ob):
                             if scene.mitsuba_testing.object_analysis:
-                                MtsLog("Dupli object", b_ob.name)
+                                MtsLog('Analysing object %s : %s' % (b_ob, b_ob.type))
 
-                            # dupli objects
-                            b_ob.dupli_list_create(scene, 'RENDER')
+                            if b_ob.is_duplicator and not object_render_hide_duplis(b_ob):
+                                if scene.mitsuba_testing.object_analysis:
+                                    MtsLog("Dupli object", b_ob.name)
 
-                            for b_dup in b_ob.dupli_list:
-                                b_dup_ob = b_dup.object
-                                dup_hide = b_dup_ob.hide_render
-                                in_dupli_group = b_dup.type == 'GROUP'
-                                (hide_obj, hide_mesh) = object_render_hide(b_dup_ob, False, in_dupli_group)
+                                # dupli objects
+                                b_ob.dupli_list_create(scene, 'RENDER')
 
-                                if not (b_dup.hide or dup_hide or hide_obj):
-                                    # /* sync object and mesh or light data */
-                                    trafo = b_dup.matrix.copy()
-                                    self.sync_object(instances, b_dup, b_ob, trafo, hide_mesh, origframe, seq)
+                                try:
+                                    for b_dup in b_ob.dupli_list:
+                                        self.progress.check()
+                                        b_dup_ob = b_dup.object
+                                        dup_hide = b_dup_ob.hide_render
+                                        in_dupli_group = b_dup.type == 'GROUP'
+                                        (hide_obj, hide_mesh) = object_render_hide(b_dup_ob, False, in_dupli_group)
 
-                            b_ob.dupli_list_clear()
+                                        if not (b_dup.hide or dup_hide or hide_obj):
+                                            # /* sync object and mesh or light data */
+                                            trafo = b_dup.matrix.copy()
+                                            self.sync_object(instances, b_dup, b_ob, trafo, hide_mesh, origframe, seq)
 
-                        (hide_obj, hide_mesh) = object_render_hide(b_ob, True, True)
+                                finally:
+                                    b_ob.dupli_list_clear()
 
-                        if not hide_obj:
-                            if scene.mitsuba_testing.object_analysis:
-                                MtsLog("Synchronizing object", b_ob.name)
+                            (hide_obj, hide_mesh) = object_render_hide(b_ob, True, True)
 
-                            # object itself
-                            trafo = b_ob.matrix_world.copy()
-                            self.sync_object(instances, b_ob, None, trafo, hide_mesh, origframe, seq)
+                            if not hide_obj:
+                                if scene.mitsuba_testing.object_analysis:
+                                    MtsLog("Synchronizing object", b_ob.name)
 
-                b_sce = b_sce.background_set
+                                # object itself
+                                trafo = b_ob.matrix_world.copy()
+                                node_key = self.object_node(b_ob)
+
+                                if node_key is not None:
+                                    self.sync_object_node(instances, node_key, b_ob, trafo, hide_mesh, origframe, seq)
+
+                                else:
+                                    self.sync_object(instances, b_ob, None, trafo, hide_mesh, origframe, seq)
+
+                    b_sce = b_sce.background_set
+
+        finally:
+            # restore the frame, also when the export is cancelled
+            if current_frame != (origframe, 0):
+                with profile('frame_set'):
+                    scene.frame_set(origframe, 0)
+
+                frame_sets += 1
+
+        MtsLog('Motion: %d animated and %d static objects, %d frame_set calls, %d saved' % (
+            animated_objects, static_objects, frame_sets, len(all_subframes) + 1 - frame_sets))
 
-        scene.frame_set(origframe, 0)
         return True
 
+    def export_signature(self, scene):
+        '''
+        Settings shared by every exported element, a change of which
+        invalidates all elements kept for incremental export.
+        '''
+
+        engine = scene.mitsuba_engine
+
+        return (
+            scene.name,
+            scene.frame_current,
+            self.properties.directory,
+            self.properties.filename,
+            self.properties.api_type,
+            repr(scene.mitsuba_integrator.api_output()),
+            tuple(getattr(engine, setting) for setting in SIGNATURE_SETTINGS),
+        )
+
+    def export_world(self, export_ctx):
+        world = self.world_environment.obj
+        dependencies = self.dependencies
+
+        if dependencies is None or world is None:
+            export_world_environment(export_ctx, self.world_environment)
+            return
+
+        node_key = ('export_world', world.name)
+        fingerprint = tuple((t, matrix_fingerprint(m)) for t, m in self.world_environment.motion)
+
+        if dependencies.is_clean(node_key, fingerprint):
+            dependencies.replay(node_key)
+            return
+
+        with dependencies.build(node_key, fingerprint):
+            dependencies.depend(('world', world.name))
+            ntree = world.mitsuba_nodes.get_node_tree()
+
+            if ntree:
+                dependencies.depend(('node_tree', ntree.name))
+
+            export_world_environment(export_ctx, self.world_environment)
+
+    def export_instance(self, export_ctx, instance, name):
+        if instance.mesh is not None:
+            with profile('shape_instances', instance.obj.name):
+                self.GE.exportShapeInstances(instance, name)
+
+        elif instance.obj.type == 'LAMP':
+            with profile('lamp', instance.obj.name):
+                export_lamp_instance(export_ctx, instance, name)
+
     def export(self):
         scene = self.scene
         self.shape_instances = {}
+        self.reused_objects = {}
+        self.instance_nodes = {}
+        self.dependencies = None
+        self.GE = None
+        self.progress = ExportProgress(self.engine)
+        export_ctx = None
 
         try:
             if scene is None:
                 raise Exception('Scene is not valid for export to %s' % self.properties.filename)
 
+            # Timing report written next to the scene file
+            if scene.mitsuba_testing.profile_export:
+                profiler = ExportProfiler()
+                set_profiler(profiler)
+
+            else:
+                profiler = None
+
             # Set up the rendering context
             self.report({'INFO'}, 'Creating Mitsuba context')
             created_mts_manager = False
@@ -323,43 +582,89 @@ class SceneExporter:
 
             export_ctx.data_add(scene.mitsuba_integrator.api_output(), 'integrator')
 
-            self.GE = GeometryExporter(export_ctx, scene)
+            if self.session is not None:
+                self.dependencies = self.session.begin_frame(export_ctx)
+
+            elif scene.mitsuba_engine.incremental_export:
+                self.dependencies = SceneExporter.Dependencies
+                self.dependencies.begin(export_ctx, self.export_signature(scene))
+
+            self.GE = GeometryExporter(export_ctx, scene, self.progress)
+
+            if self.session is not None:
+                self.GE.useSharedStore(self.session.mesh_store, self.session.shared_dir)
             self.world_environment = Instance(scene.world, None)
             self.scene_camera = Instance(scene.camera, None)
-            self.cache_motion(scene)
+
+            with profile('cache_motion'):
+                self.cache_motion(scene)
 
             # Export world environment
-            export_world_environment(export_ctx, self.world_environment)
+            with profile('world'):
+                self.export_world(export_ctx)
 
-            export_camera_instance(export_ctx, self.scene_camera, scene)
+            with profile('camera'):
+                export_camera_instance(export_ctx, self.scene_camera, scene)
 
-            cancel = False
+            self.progress.start('Exporting objects', sum(len(instances) for instances in self.shape_instances.values()))
             b_sce = scene
 
-            while b_sce is not None and not cancel:
+            while b_sce is not None:
                 self.GE.geometry_scene = b_sce
 
-                for name, instance in self.shape_instances[b_sce.name].items():
-                    if cancel:
-                        break
+                for unique_id, instance in self.shape_instances[b_sce.name].items():
+                    self.progress.step()
+                    node_key = self.instance_nodes.get(unique_id)
 
-                    if instance.mesh is not None:
-                        self.GE.exportShapeInstances(instance, name)
+                    if node_key is not None:
+                        with self.dependencies.build(node_key):
+                            self.export_instance(export_ctx, instance, instance_name(unique_id))
 
-                    elif instance.obj.type == 'LAMP':
-                        export_lamp_instance(export_ctx, instance, name)
+                    else:
+                        self.export_instance(export_ctx, instance, instance_name(unique_id))
+
+                # objects unchanged since the last export
+                for node_key, b_ob in self.reused_objects[b_sce.name].items():
+                    self.progress.check()
+
+                    with profile('reuse', b_ob.name):
+                        self.dependencies.replay(node_key)
 
-                    # cancel = progress.get_cancel();
                 b_sce = b_sce.background_set
 
             self.GE.objects_used_as_duplis.clear()
 
+            if self.dependencies is not None:
+                self.GE.recordStoredFiles(self.dependencies)
+
+            # complete mesh files shared by several shapes and wait for
+            # the mesh files still being written in the background
+            self.progress.start('Writing files')
+
+            with profile('finish'):
+                self.GE.finish()
+
             # update known exported objects for partial export
             GeometryExporter.KnownModifiedObjects -= GeometryExporter.NewExportedObjects
             GeometryExporter.KnownExportedObjects |= GeometryExporter.NewExportedObjects
             GeometryExporter.NewExportedObjects = set()
 
-            export_ctx.configure()
+            # move the elements shared by several frames to their own files
+            if self.session is not None:
+                self.session.end_frame(export_ctx)
+
+            self.progress.start('Writing scene file')
+
+            with profile('configure'):
+                export_ctx.configure()
+
+            if self.dependencies is not None:
+                MtsLog('Incremental export: %d objects reused, %d objects, materials and worlds rebuilt' % (
+                    sum(len(reused) for reused in self.reused_objects.values()), len(self.dependencies.built)))
+                self.dependencies.commit()
+
+            if profiler is not None:
+                profiler.save('%s_profile.json' % os.path.splitext(mts_filename)[0])
 
             if created_mts_manager:
                 MM.reset()
@@ -369,6 +674,22 @@ class SceneExporter:
             return {'FINISHED'}
 
         except Exception as err:
+            if self.GE is not None:
+                self.GE.abort()
+
+            if self.dependencies is not None:
+                self.dependencies.abort()
+
+            # objects of this export are written again by the next one
+            GeometryExporter.NewExportedObjects = set()
+
+            if export_ctx is not None and export_ctx.EXPORT_API_TYPE == 'FILE':
+                export_ctx.discard()
+
+            if isinstance(err, ExportCancelled):
+                self.report({'WARNING'}, 'Export cancelled')
+                return {'CANCELLED'}
+
             self.report({'ERROR'}, 'Export aborted: %s' % err)
 
             import traceback
@@ -378,3 +699,6 @@ class SceneExporter:
                 raise err
 
             return {'CANCELLED'}
+
+        finally:
+            set_profiler(None)
@@ -29,12 +29,13 @@ import traceback
 # Blender Libs
 import bpy
 from bpy.types import Operator
-from bpy.props import BoolProperty, StringProperty
+from bpy.props import BoolProperty, IntProperty, StringProperty
 from bl_operators.presets import AddPresetBase
 
 from .. import MitsubaAddon
 from ..outputs import MtsLog
 from ..export.scene import SceneExporter
+from ..export.animation import AnimationExportSession
 
 
 @MitsubaAddon.addon_register_class
@@ -102,8 +103,64 @@ class EXPORT_OT_mitsuba(Operator):
             return {'CANCELLED'}
 
 
+@MitsubaAddon.addon_register_class
+class EXPORT_OT_mitsuba_animation(Operator):
+    '''Export a range of frames, sharing the static elements between frames'''
+    bl_idname = 'export.mitsuba_animation'
+    bl_label = 'Export Mitsuba Animation (.xml)'
+
+    directory = StringProperty(name='Target directory', subtype='DIR_PATH')
+    frame_start = IntProperty(name='Start Frame', min=0, default=1)
+    frame_end = IntProperty(name='End Frame', min=0, default=250)
+    frame_step = IntProperty(name='Frame Step', min=1, default=1)
+
+    scene = StringProperty(options={'HIDDEN'}, default='')
+
+    def get_scene(self, context):
+        if self.properties.scene == '':
+            return context.scene
+
+        return bpy.data.scenes[self.properties.scene]
+
+    def invoke(self, context, event):
+        scene = self.get_scene(context)
+        self.properties.frame_start = scene.frame_start
+        self.properties.frame_end = scene.frame_end
+        self.properties.frame_step = scene.frame_step
+
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        try:
+            session = AnimationExportSession(
+                self.get_scene(context),
+                self.properties.directory,
+                self.properties.frame_start,
+                self.properties.frame_end,
+                self.properties.frame_step,
+            )
+
+            export_result = session.export()
+
+            if not export_result or 'CANCELLED' in export_result:
+                self.report({'ERROR'}, "Unsucessful export!")
+                return {'CANCELLED'}
+
+            return {'FINISHED'}
+
+        except:
+            typ, value, tb = sys.exc_info()
+            elist = traceback.format_exception(typ, value, tb)
+            MtsLog("Caught exception: %s" % ''.join(elist))
+            self.report({'ERROR'}, "Unsucessful export!")
+
+            return {'CANCELLED'}
+
+
 def menu_func(self, context):
     default_path = os.path.splitext(os.path.basename(bpy.data.filepath))[0] + ".xml"
     self.layout.operator("export.mitsuba", text="Export Mitsuba scene...").filename = default_path
+    self.layout.operator("export.mitsuba_animation", text="Export Mitsuba animation...")
 
 bpy.types.INFO_MT_file_export.append(menu_func)
@@ -29,6 +29,8 @@ import bpy
 from ..extensions_framework import log
 from ..extensions_framework.util import TimerThread
 
+from .profiler import profile
+
 
 def MtsLog(*args, popup=False):
     '''
@@ -47,56 +49,57 @@ class MtsFilmDisplay(TimerThread):
     STARTUP_DELAY = 2  # Add additional time to first KICK PERIOD
 
     def kick(self, render_end=False):
-        if 'RE' in self.LocalStorage.keys():
-            direct_transfer = False
+        with profile('film_kick'):
+            if 'RE' in self.LocalStorage.keys():
+                direct_transfer = False
 
-            if not bpy.app.background or render_end:
+                if not bpy.app.background or render_end:
 
-                xres = yres = -1
+                    xres = yres = -1
 
-                if 'resolution' in self.LocalStorage.keys():
-                    xres, yres = self.LocalStorage['resolution']
+                    if 'resolution' in self.LocalStorage.keys():
+                        xres, yres = self.LocalStorage['resolution']
 
-                if xres == -1 or yres == -1:
-                    err_msg = 'ERROR: Cannot not load render result: resolution unknown. MtsFilmThread will terminate'
-                    MtsLog(err_msg)
-                    self.stop()
-                    return
+                    if xres == -1 or yres == -1:
+                        err_msg = 'ERROR: Cannot not load render result: resolution unknown. MtsFilmThread will terminate'
+                        MtsLog(err_msg)
+                        self.stop()
+                        return
 
-                if render_end:
-                    MtsLog('Final render result (%ix%i)' % (xres, yres))
+                    if render_end:
+                        MtsLog('Final render result (%ix%i)' % (xres, yres))
 
-                elif self.LocalStorage['render_ctx'].RENDER_API_TYPE == 'EXT':
-                    MtsLog('Updating render result (%ix%i)' % (xres, yres))
+                    elif self.LocalStorage['render_ctx'].RENDER_API_TYPE == 'EXT':
+                        MtsLog('Updating render result (%ix%i)' % (xres, yres))
 
-                result = self.LocalStorage['RE'].begin_result(0, 0, xres, yres)
+                    result = self.LocalStorage['RE'].begin_result(0, 0, xres, yres)
 
-                if result is None:
-                    err_msg = 'ERROR: Cannot not load render result: begin_result() returned None. MtsFilmThread will terminate'
-                    MtsLog(err_msg)
-                    self.stop()
-                    return
+                    if result is None:
+                        err_msg = 'ERROR: Cannot not load render result: begin_result() returned None. MtsFilmThread will terminate'
+                        MtsLog(err_msg)
+                        self.stop()
+                        return
 
-                lay = result.layers[0]
+                    lay = result.layers[0]
 
-                if self.LocalStorage['render_ctx'].RENDER_API_TYPE == 'INT':
-                    bitmap_buffer = self.LocalStorage['render_ctx'].get_bitmap_buffer()
-                    lay.passes.foreach_set('rect', bitmap_buffer)
+                    if self.LocalStorage['render_ctx'].RENDER_API_TYPE == 'INT':
+                        bitmap_buffer = self.LocalStorage['render_ctx'].get_bitmap_buffer()
+                        lay.passes.foreach_set('rect', bitmap_buffer)
 
-                elif os.path.exists(self.LocalStorage['RE'].output_file):
-                    lay.load_from_file(self.LocalStorage['RE'].output_file)
+                    elif os.path.exists(self.LocalStorage['RE'].output_file):
+                        lay.load_from_file(self.LocalStorage['RE'].output_file)
 
-                else:
-                    err_msg = 'ERROR: Could not load render result from %s' % self.LocalStorage['RE'].output_file
-                    MtsLog(err_msg)
+                    else:
+                        err_msg = 'ERROR: Could not load render result from %s' % self.LocalStorage['RE'].output_file
+                        MtsLog(err_msg)
 
-                self.LocalStorage['RE'].end_result(result, 0)
+                    self.LocalStorage['RE'].end_result(result, 0)
 
-        else:
-            err_msg = 'ERROR: MtsFilmThread started with insufficient parameters. MtsFilmThread will terminate'
-            MtsLog(err_msg)
-            self.stop()
-            return
+            else:
+                err_msg = 'ERROR: MtsFilmThread started with insufficient parameters. MtsFilmThread will terminate'
+                MtsLog(err_msg)
+                self.stop()
+                return
 
 FBACK_API = None
 PYMTS_API = None
@@ -202,18 +205,19 @@ class MtsManager:
         self.reset()
 
     def create_render_context(self, render_type='INT'):
-        if MtsManager.RenderEngine is None:
-            raise Exception('Error creating MtsManager: Render Engine is not set.')
+        with profile('create_render_context'):
+            if MtsManager.RenderEngine is None:
+                raise Exception('Error creating MtsManager: Render Engine is not set.')
 
-        self.render_engine = MtsManager.RenderEngine
+            self.render_engine = MtsManager.RenderEngine
 
-        if render_type == 'INT' and self.pymts_api.PYMTS_AVAILABLE:
-            Renderer = self.pymts_api.InternalRenderContext
+            if render_type == 'INT' and self.pymts_api.PYMTS_AVAILABLE:
+                Renderer = self.pymts_api.InternalRenderContext
 
-        else:
-            Renderer = self.fback_api.ExternalRenderContext
+            else:
+                Renderer = self.fback_api.ExternalRenderContext
 
-        self.render_ctx = Renderer()
+            self.render_ctx = Renderer()
 
     def start(self):
         '''
@@ -229,10 +233,11 @@ class MtsManager:
         self.started = True
 
     def stop(self):
-        # If we exit the wait loop (user cancelled) and mitsuba is still running, then send SIGINT
-        if self.render_ctx.is_running():
-            MtsLog("MtsBlend: Stopping..")
-            self.render_ctx.render_stop()
+        with profile('render_stop'):
+            # If we exit the wait loop (user cancelled) and mitsuba is still running, then send SIGINT
+            if self.render_ctx.is_running():
+                MtsLog("MtsBlend: Stopping..")
+                self.render_ctx.render_stop()
 
     def start_framebuffer_thread(self):
         '''
@@ -259,31 +264,32 @@ class MtsManager:
         Returns None
         '''
 
-        # Firstly stop the renderer
-        if self.export_ctx is not None:
-            self.export_ctx.exit()
+        with profile('render_reset'):
+            # Firstly stop the renderer
+            if self.export_ctx is not None:
+                self.export_ctx.exit()
 
-        if not self.started:
-            return
+            if not self.started:
+                return
 
-        self.started = False
+            self.started = False
 
-        # Stop the framebuffer update thread
-        if self.fb_thread is not None and self.fb_thread.isAlive():
-            self.fb_thread.stop()
-            self.fb_thread.join()
-            # Get the last image
-            self.fb_thread.kick(render_end=True)
+            # Stop the framebuffer update thread
+            if self.fb_thread is not None and self.fb_thread.isAlive():
+                self.fb_thread.stop()
+                self.fb_thread.join()
+                # Get the last image
+                self.fb_thread.kick(render_end=True)
 
-        # Clean up after last framebuffer update
-        if self.export_ctx is not None:
-            # cleanup() destroys the Context
-            self.export_ctx.cleanup()
+            # Clean up after last framebuffer update
+            if self.export_ctx is not None:
+                # cleanup() destroys the Context
+                self.export_ctx.cleanup()
 
-        self.fb_thread = MtsFilmDisplay()
+            self.fb_thread = MtsFilmDisplay()
 
-        self.ClearActive()
-        self.ClearCurrentScene()
+            self.ClearActive()
+            self.ClearCurrentScene()
 
     def __del__(self):
         '''
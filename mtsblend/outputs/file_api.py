@@ -37,10 +37,12 @@ from ..export import ExportContextBase
 from ..export import matrix_to_list
 from ..export import get_output_subdir
 from ..outputs import MtsLog, MtsManager
+from ..outputs.profiler import profile
 from ..properties import ExportedVolumes
 
 
 mitsuba_props = {
+    'include',
     'ref',
     'lookat',
     'scale',
@@ -409,7 +411,7 @@ class FileExportContext(ExportContextBase):
                 MtsLog('************** Reference ID - %s - exported before referencing **************' % (args['id']))
                 #return
 
-            elif plugin in {'matrix', 'lookat', 'scale'}:
+            elif plugin in {'matrix', 'lookat', 'scale', 'include'}:
                 del args['name']
 
         else:
@@ -640,7 +642,8 @@ class FileExportContext(ExportContextBase):
         Special handling of configure API.
         '''
 
-        self.pmgr_create(self.scene_data)
+        with profile('pmgr_create'):
+            self.pmgr_create(self.scene_data)
 
         # Close files
         MtsLog('Wrote scene files')
@@ -652,6 +655,17 @@ class FileExportContext(ExportContextBase):
         # Reset the volume redundancy check
         ExportedVolumes.reset_vol_list()
 
+    def discard(self):
+        '''
+        Close and delete the files of an export that did not complete.
+        '''
+
+        self.exit()
+
+        for file_name in self.file_names:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
     def cleanup(self):
         self.exit()
 
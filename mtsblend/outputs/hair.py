@@ -0,0 +1,252 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+import sys
+import array
+import struct
+import hashlib
+
+from .mesh_buffers import NUMPY_AVAILABLE
+from .profiler import profile
+
+if NUMPY_AVAILABLE:
+    import numpy
+
+
+# strands packed and written at once by write_binary_hair_file
+HAIR_BATCH_SIZE = 4096
+
+BINARY_HAIR_HEADER = b'BINARY_HAIR'
+
+
+def spread_bits(values):
+    '''
+    Values with two zero bits inserted between each of their 10 low bits
+    '''
+
+    values = values & 0x3ff
+    values = (values | (values << 16)) & 0x30000ff
+    values = (values | (values << 8)) & 0x300f00f
+    values = (values | (values << 4)) & 0x30c30c3
+    values = (values | (values << 2)) & 0x9249249
+
+    return values
+
+
+def morton_order(points):
+    '''
+    Order of points along a Z-order curve through their bounding box, so
+    points close in the order are close in space
+    '''
+
+    low = points.min(axis=0)
+    extent = points.max(axis=0) - low
+    extent[extent == 0] = 1
+    cells = ((points - low) / extent * 1023).astype(numpy.int64)
+    codes = numpy.zeros(len(points), dtype=numpy.int64)
+
+    for axis in range(3):
+        codes |= spread_bits(cells[:, axis]) << axis
+
+    return numpy.argsort(codes, kind='mergesort')
+
+
+class StrandBuffers:
+    '''
+    Points of the strands of a hair system in one (points, 3) NumPy array,
+    strand after strand, with the number of points of each strand. Iterating
+    gives the points of each strand.
+    '''
+
+    def __init__(self, points, counts):
+        self.points = points
+        self.counts = counts
+        self.offsets = numpy.concatenate(([0], numpy.cumsum(counts)))
+
+    @classmethod
+    def from_strands(cls, strands):
+        counts = numpy.array([len(points) for points in strands], dtype=numpy.int64)
+        points = numpy.array([tuple(p) for points in strands for p in points], dtype=numpy.float64).reshape(-1, 3)
+
+        return cls(points, counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def digest(self):
+        '''
+        Hash of the points of every strand, identifying the hair content
+        '''
+
+        digest = hashlib.sha1(numpy.ascontiguousarray(self.counts, dtype='<i8').tobytes())
+        digest.update(numpy.ascontiguousarray(self.points, dtype='<f8').tobytes())
+
+        return digest.hexdigest()
+
+    def __iter__(self):
+        for start, end in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.points[start:end]
+
+    def batch(self, start, end):
+        return StrandBuffers(self.points[self.offsets[start]:self.offsets[end]], self.counts[start:end])
+
+    def take(self, indices):
+        '''
+        Strands at the given indices, in their order
+        '''
+
+        counts = self.counts[indices]
+        offsets = numpy.concatenate(([0], numpy.cumsum(counts)))
+        point_indices = numpy.repeat(self.offsets[indices] - offsets[:-1], counts) + numpy.arange(offsets[-1])
+
+        return StrandBuffers(self.points[point_indices], counts)
+
+    def split(self, chunks):
+        '''
+        Split the strands into at most chunks parts of about as many strands,
+        each holding strands with roots close in space, by Morton order of
+        the roots. Empty strands are left out.
+        '''
+
+        strands = self.remove_empty()
+
+        if len(strands) == 0:
+            return [strands]
+
+        order = morton_order(strands.points[strands.offsets[:-1]])
+
+        return [strands.take(indices) for indices in numpy.array_split(order, min(chunks, len(order)))]
+
+    def strand_ids(self):
+        '''
+        Index of the strand of every point
+        '''
+
+        return numpy.repeat(numpy.arange(len(self.counts)), self.counts)
+
+    def remove_empty(self):
+        if numpy.all(self.counts > 0):
+            return self
+
+        return StrandBuffers(self.points, self.counts[self.counts > 0])
+
+
+def write_hair_file(hair_file_path, strands):
+    '''
+    Write the points of every strand as lines of coordinates, with an empty
+    line after each strand
+    '''
+
+    with open(hair_file_path, 'w') as hair_file:
+        if isinstance(strands, StrandBuffers):
+            for start in range(0, len(strands), HAIR_BATCH_SIZE):
+                batch = strands.batch(start, min(start + HAIR_BATCH_SIZE, len(strands)))
+
+                with profile('encode'):
+                    lines = ''.join('%f %f %f\n' * count + '\n' for count in batch.counts.tolist())
+                    data = lines % tuple(batch.points.ravel().tolist())
+
+                hair_file.write(data)
+
+            return
+
+        for points in strands:
+            for p in points:
+                hair_file.write('%f %f %f\n' % (p[0], p[1], p[2]))
+
+            hair_file.write('\n')
+
+
+def pack_hair_strands(strands, first):
+    '''
+    Little endian float32 coordinates of the points of strands, each strand
+    but the very first of the file starting with a +inf marker
+    '''
+
+    if isinstance(strands, StrandBuffers):
+        # each strand but the first is shifted by the markers before it
+        markers = numpy.arange(len(strands)) + 3 * strands.offsets[:-1]
+
+        if first:
+            markers = markers[1:] - 1
+
+        data = numpy.empty(3 * len(strands.points) + len(markers), dtype='<f4')
+        is_marker = numpy.zeros(len(data), dtype=bool)
+        is_marker[markers] = True
+        data[is_marker] = numpy.inf
+        data[~is_marker] = strands.points.ravel()
+
+        return data.tobytes()
+
+    data = array.array('f')
+
+    for points in strands:
+        if not first:
+            data.append(float('inf'))
+
+        for p in points:
+            data.extend((p[0], p[1], p[2]))
+
+        first = False
+
+    if sys.byteorder != 'little':
+        data.byteswap()
+
+    return data.tobytes()
+
+
+def write_binary_hair_file(hair_file_path, strands):
+    '''
+    Write the strands in the binary hair format of Mitsuba: a BINARY_HAIR
+    header, the vertex count as uint32 and the float32 coordinates of every
+    point, a +inf value starting each new strand. Strands are packed and
+    written by batches.
+    '''
+
+    if NUMPY_AVAILABLE and not isinstance(strands, StrandBuffers):
+        strands = StrandBuffers.from_strands(strands)
+
+    # an empty strand would give two markers in a row
+    if isinstance(strands, StrandBuffers):
+        strands = strands.remove_empty()
+        vertex_count = len(strands.points)
+
+    else:
+        strands = [points for points in strands if len(points) > 0]
+        vertex_count = sum(len(points) for points in strands)
+
+    with open(hair_file_path, 'wb') as hair_file:
+        hair_file.write(BINARY_HAIR_HEADER)
+        hair_file.write(struct.pack('<I', vertex_count))
+
+        for start in range(0, len(strands), HAIR_BATCH_SIZE):
+            end = min(start + HAIR_BATCH_SIZE, len(strands))
+
+            with profile('encode'):
+                if isinstance(strands, StrandBuffers):
+                    data = pack_hair_strands(strands.batch(start, end), start == 0)
+
+                else:
+                    data = pack_hair_strands(strands[start:end], start == 0)
+
+            hair_file.write(data)
@@ -0,0 +1,633 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+import copy
+import array
+import hashlib
+
+try:
+    import numpy
+    NUMPY_AVAILABLE = True
+
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+def get_uv_layer(mesh):
+    uv_textures = mesh.tessface_uv_textures
+
+    if len(uv_textures) > 0 and mesh.uv_textures.active and uv_textures.active.data:
+        return uv_textures.active.data
+
+    return None
+
+
+def get_vertex_color_layer(mesh):
+    vertex_color = mesh.tessface_vertex_colors.active
+
+    if vertex_color:
+        return vertex_color.data
+
+    return None
+
+
+def foreach_get_array(collection, attr, count, size, dtype):
+    '''
+    Read attr of every item in collection into a new (count, size) array
+    '''
+
+    data = numpy.empty(count * size, dtype=dtype)
+
+    if count > 0:
+        collection.foreach_get(attr, data)
+
+    if size == 1:
+        return data
+
+    return data.reshape((count, size))
+
+
+def split_material_faces(material_index):
+    '''
+    Bucket face indices by material index in a single pass, using a stable
+    argsort and the split points between runs of equal material indices.
+
+    Returns a dict mapping each used material index to the array of its
+    face indices, in face order.
+    '''
+
+    if not NUMPY_AVAILABLE:
+        material_faces = {}
+
+        for face_index, mi in enumerate(material_index):
+            if mi not in material_faces:
+                material_faces[mi] = array.array('I')
+
+            material_faces[mi].append(face_index)
+
+        return material_faces
+
+    order = numpy.argsort(material_index, kind='mergesort')
+    sorted_index = material_index[order]
+    splits = numpy.flatnonzero(sorted_index[1:] != sorted_index[:-1]) + 1
+    starts = numpy.concatenate(([0], splits)) if len(order) > 0 else splits
+
+    return dict(zip(sorted_index[starts].tolist(), numpy.split(order, splits)))
+
+
+def read_material_faces(mesh):
+    '''
+    Read the material index of every tessface in bulk and split the faces
+    by material, see split_material_faces.
+    '''
+
+    faces = mesh.tessfaces
+
+    if NUMPY_AVAILABLE:
+        material_index = foreach_get_array(faces, 'material_index', len(faces), 1, numpy.int32)
+
+    else:
+        material_index = array.array('i', [0]) * len(faces)
+        faces.foreach_get('material_index', material_index)
+
+    return split_material_faces(material_index)
+
+
+def row_keys(columns):
+    '''
+    Pack the given (n, k) float64 columns into one opaque value per row,
+    suitable for numpy.unique. Negative zeros are folded into positive
+    zeros first, matching the tuple comparison used by the Python writers.
+    '''
+
+    rows = numpy.ascontiguousarray(numpy.hstack(columns) + 0.0)
+
+    return rows.view(numpy.dtype((numpy.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+
+
+class MeshBuffers:
+    '''
+    Bulk copy of the tessellated mesh attributes used by the mesh writers.
+
+    All attributes are read with foreach_get, so building the buffers costs
+    a handful of RNA calls regardless of the mesh size.
+    '''
+
+    # see prune()
+    use_normals = True
+    pruned_from = None
+
+    def __init__(self, mesh):
+        vertices = mesh.vertices
+        faces = mesh.tessfaces
+        self.hexdigest = None
+        num_vertices = len(vertices)
+        num_faces = len(faces)
+
+        self.co = foreach_get_array(vertices, 'co', num_vertices, 3, numpy.float32)
+        self.vertex_normals = foreach_get_array(vertices, 'normal', num_vertices, 3, numpy.float32)
+
+        self.face_vertices = foreach_get_array(faces, 'vertices_raw', num_faces, 4, numpy.int32)
+        self.face_normals = foreach_get_array(faces, 'normal', num_faces, 3, numpy.float32)
+        self.face_smooth = foreach_get_array(faces, 'use_smooth', num_faces, 1, numpy.bool_)
+        self.material_index = foreach_get_array(faces, 'material_index', num_faces, 1, numpy.int32)
+
+        # Blender stores triangles with a zero fourth vertex index
+        self.face_sides = numpy.where(self.face_vertices[:, 3] != 0, 4, 3)
+
+        uv_layer = get_uv_layer(mesh)
+
+        if uv_layer is not None:
+            self.uvs = foreach_get_array(uv_layer, 'uv_raw', num_faces, 8, numpy.float32).reshape((num_faces, 4, 2))
+
+        else:
+            self.uvs = None
+
+        vertex_color_layer = get_vertex_color_layer(mesh)
+
+        if vertex_color_layer is not None:
+            self.colors = numpy.empty((num_faces, 4, 3), dtype=numpy.float32)
+
+            for j in range(4):
+                self.colors[:, j] = foreach_get_array(vertex_color_layer, 'color%d' % (j + 1), num_faces, 3, numpy.float32)
+
+        else:
+            self.colors = None
+
+    def arrays(self):
+        return (self.co, self.vertex_normals, self.face_vertices, self.face_normals,
+                self.face_smooth, self.material_index, self.uvs, self.colors)
+
+    @property
+    def nbytes(self):
+        return sum(data.nbytes for data in self.arrays() if data is not None)
+
+    def prune(self, normals=True, uvs=True, colors=True):
+        '''
+        Copy of the buffers exporting only the given attributes, sharing
+        their arrays. Without normals, Mitsuba computes them itself, so
+        flat and smooth corners alike share the vertex of the corners with
+        the same remaining attributes.
+        '''
+
+        pruned = copy.copy(self)
+        pruned.hexdigest = None
+        pruned.pruned_from = self
+        pruned.use_normals = self.use_normals and normals
+
+        if not uvs:
+            pruned.uvs = None
+
+        if not colors:
+            pruned.colors = None
+
+        return pruned
+
+    def digest(self):
+        '''
+        Hash of every attribute read from the mesh, identifying its content.
+        The buffers are never modified, so the hash is computed only once.
+        '''
+
+        if self.hexdigest is not None:
+            return self.hexdigest
+
+        if self.pruned_from is not None:
+            digest = hashlib.sha1(self.pruned_from.digest().encode())
+            digest.update(str((self.use_normals, self.uvs is not None, self.colors is not None)).encode())
+            self.hexdigest = digest.hexdigest()
+
+            return self.hexdigest
+
+        digest = hashlib.sha1()
+
+        for data in self.arrays():
+            if data is None:
+                digest.update(b'-')
+
+            else:
+                digest.update(str(data.shape).encode())
+                digest.update(numpy.ascontiguousarray(data).data)
+
+        self.hexdigest = digest.hexdigest()
+
+        return self.hexdigest
+
+    def corners(self, face_indices, use_colors=True, flip_flat_uvs=True):
+        '''
+        Expand the given faces into their corners, with the exported
+        attributes of every corner as float64 columns.
+
+        Returns (sides, starts, smooth, points, normals, uvs, colors,
+        corner_ids), corner_ids being None as every flat corner is distinct.
+        '''
+
+        face_indices = numpy.asarray(face_indices, dtype=numpy.int64)
+        sides = self.face_sides[face_indices]
+
+        # Expand faces into corners
+        starts = numpy.cumsum(sides) - sides
+        corner_face = numpy.repeat(face_indices, sides)
+        corner_slot = numpy.arange(int(sides.sum())) - numpy.repeat(starts, sides)
+        corner_vertex = self.face_vertices[corner_face, corner_slot]
+        smooth = self.face_smooth[corner_face]
+
+        points = self.co[corner_vertex].astype(numpy.float64)
+
+        if self.use_normals:
+            normals = numpy.where(smooth[:, None],
+                                  self.vertex_normals[corner_vertex],
+                                  self.face_normals[corner_face]).astype(numpy.float64)
+
+        else:
+            normals = None
+
+        if self.uvs is not None:
+            uvs = self.uvs[corner_face, corner_slot].astype(numpy.float64)
+            # Flip UV Y axis. Blender UV coord is bottom-left, Mitsuba is top-left.
+            flipped = 1.0 - uvs[:, 1]
+
+            if flip_flat_uvs:
+                uvs[:, 1] = flipped
+
+            else:
+                uvs[:, 1] = numpy.where(smooth, flipped, uvs[:, 1])
+
+        else:
+            uvs = None
+
+        if use_colors and self.colors is not None:
+            colors = self.colors[corner_face, corner_slot].astype(numpy.float64)
+
+        else:
+            colors = None
+
+        return (sides, starts, smooth, points, normals, uvs, colors, None)
+
+    def shared(self, smooth):
+        '''
+        Mask of the corners sharing vertices on their attribute values
+        '''
+
+        if self.use_normals:
+            return smooth
+
+        return numpy.ones(len(smooth), dtype=numpy.bool_)
+
+    def build(self, face_indices, use_colors=True, flip_flat_uvs=True):
+        '''
+        Produce the exported vertex attributes and triangle list for the
+        given faces, in exactly the order the Python writers emit them:
+        smooth face corners are de-duplicated on their attribute values,
+        flat face corners always create a new vertex, and quads are split
+        into (0, 1, 2), (0, 2, 3).
+
+        Returns (points, normals, uvs, colors, triangles), with normals, uvs
+        and colors set to None when they are not exported.
+        '''
+
+        sides, starts, smooth, points, normals, uvs, colors, corner_ids = self.corners(face_indices, use_colors, flip_flat_uvs)
+        columns = [c for c in (points, normals, uvs, colors) if c is not None]
+        vertex_index, new_vertex = share_vertices(self.shared(smooth), columns, corner_ids)
+
+        return (
+            points[new_vertex],
+            normals[new_vertex] if normals is not None else None,
+            uvs[new_vertex] if uvs is not None else None,
+            colors[new_vertex] if colors is not None else None,
+            triangulate(sides, starts, vertex_index)
+        )
+
+    def build_chunks(self, face_indices, chunk_size, use_colors=True, flip_flat_uvs=True):
+        '''
+        Same as build(), but processing at most chunk_size faces at a time.
+        Yields (points, normals, uvs, colors, triangles) for every chunk;
+        concatenating the chunks gives the result of build().
+
+        Shared vertices are de-duplicated across chunks through a
+        VertexTable, so the working memory is bounded by the chunk size
+        plus the keys of the distinct shared vertices.
+        '''
+
+        face_indices = numpy.asarray(face_indices, dtype=numpy.int64)
+        tables = (VertexTable(), VertexTable())
+        vertex_count = 0
+
+        for first in range(0, max(len(face_indices), 1), chunk_size):
+            chunk = face_indices[first:first + chunk_size]
+            sides, starts, smooth, points, normals, uvs, colors, corner_ids = self.corners(chunk, use_colors, flip_flat_uvs)
+            columns = [c for c in (points, normals, uvs, colors) if c is not None]
+
+            vertex_index, new_vertex = share_vertices(self.shared(smooth), columns, corner_ids, tables, vertex_count)
+            vertex_count += int(new_vertex.sum())
+
+            yield (
+                points[new_vertex],
+                normals[new_vertex] if normals is not None else None,
+                uvs[new_vertex] if uvs is not None else None,
+                colors[new_vertex] if colors is not None else None,
+                triangulate(sides, starts, vertex_index)
+            )
+
+
+def share_vertices(smooth, columns, corner_ids=None, tables=None, vertex_count=0):
+    '''
+    Assign a vertex to every corner. Smooth corners share the vertex of the
+    first corner with the same attribute values, flat corners share the
+    vertex of the first corner with the same id when corner_ids is given,
+    and create a new vertex otherwise.
+
+    With tables, a pair of VertexTable for the smooth and flat corners,
+    vertices exported by previous chunks are reused, and the vertices of
+    this chunk numbered from vertex_count are added.
+
+    Returns the vertex index of every corner, and the mask of the corners
+    creating a new vertex.
+    '''
+
+    representative = numpy.arange(len(smooth))
+    groups = []
+
+    smooth_corners = numpy.flatnonzero(smooth)
+
+    if len(smooth_corners) > 0:
+        groups.append((smooth_corners, row_keys([c[smooth_corners] for c in columns])))
+
+    else:
+        groups.append(None)
+
+    if corner_ids is not None:
+        flat_corners = numpy.flatnonzero(~smooth)
+        groups.append((flat_corners, corner_ids[flat_corners]) if len(flat_corners) > 0 else None)
+
+    known_vertices = []
+
+    for group, table in zip(groups, tables or (None, None)):
+        if group is None:
+            continue
+
+        corners, keys = group
+        unique_first, unique_inverse = numpy.unique(keys, return_index=True, return_inverse=True)[1:]
+        unique_inverse = unique_inverse.ravel()
+        representative[corners] = corners[unique_first][unique_inverse]
+
+        if table is not None:
+            # Vertices already exported by a previous chunk
+            known = table.lookup(keys[unique_first])[unique_inverse]
+            known_vertices.append((corners, keys, known, table))
+
+    new_vertex = representative == numpy.arange(len(smooth))
+
+    for corners, keys, known, table in known_vertices:
+        new_vertex[corners[known >= 0]] = False
+
+    vertex_index = (vertex_count + numpy.cumsum(new_vertex) - 1)[representative]
+
+    for corners, keys, known, table in known_vertices:
+        vertex_index[corners[known >= 0]] = known[known >= 0]
+        added = new_vertex[corners]
+        table.insert(keys[added], vertex_index[corners[added]])
+
+    return (vertex_index, new_vertex)
+
+
+def bmesh_loop_triangles(mesh):
+    '''
+    Loop and polygon indices of the triangles of mesh, through the bmesh
+    tessellation, for Blender versions without Mesh.loop_triangles
+    '''
+
+    import bmesh
+
+    bm = bmesh.new()
+
+    try:
+        bm.from_mesh(mesh)
+        bm.faces.index_update()
+        triangles = bm.calc_tessface()
+
+        # from_mesh creates the loops in mesh order, so their indices match
+        tri_loops = numpy.fromiter((loop.index for tri in triangles for loop in tri),
+                                   dtype=numpy.int32, count=3 * len(triangles))
+        tri_polygons = numpy.fromiter((tri[0].face.index for tri in triangles),
+                                      dtype=numpy.int32, count=len(triangles))
+
+    finally:
+        bm.free()
+
+    return (tri_loops.reshape((-1, 3)), tri_polygons)
+
+
+def read_loop_triangles(mesh):
+    '''
+    Loop and polygon indices of the triangles of mesh, as (n, 3) and (n,)
+    arrays
+    '''
+
+    if not hasattr(mesh, 'loop_triangles'):
+        return bmesh_loop_triangles(mesh)
+
+    mesh.calc_loop_triangles()
+    triangles = mesh.loop_triangles
+    num_triangles = len(triangles)
+
+    return (
+        foreach_get_array(triangles, 'loops', num_triangles, 3, numpy.int32),
+        foreach_get_array(triangles, 'polygon_index', num_triangles, 1, numpy.int32)
+    )
+
+
+class LoopTriangleBuffers(MeshBuffers):
+    '''
+    Bulk copy of the triangulated loop data of a mesh, used by the mesh
+    writers in place of MeshBuffers.
+
+    Every triangle is a face of three corners, with the split normals and
+    UVs of its loops, so custom normals are kept and polygons are split the
+    way Blender displays them. The material index is that of the triangle.
+    '''
+
+    def __init__(self, mesh):
+        vertices = mesh.vertices
+        loops = mesh.loops
+        polygons = mesh.polygons
+        self.hexdigest = None
+        num_vertices = len(vertices)
+        num_loops = len(loops)
+        num_polygons = len(polygons)
+
+        mesh.calc_normals_split()
+
+        self.co = foreach_get_array(vertices, 'co', num_vertices, 3, numpy.float32)
+        self.loop_vertices = foreach_get_array(loops, 'vertex_index', num_loops, 1, numpy.int32)
+        self.loop_normals = foreach_get_array(loops, 'normal', num_loops, 3, numpy.float32)
+
+        self.triangle_loops, triangle_polygons = read_loop_triangles(mesh)
+        self.face_smooth = foreach_get_array(polygons, 'use_smooth', num_polygons, 1, numpy.bool_)[triangle_polygons]
+        self.material_index = foreach_get_array(polygons, 'material_index', num_polygons, 1, numpy.int32)[triangle_polygons]
+
+        uv_layer = mesh.uv_layers.active
+
+        if uv_layer is not None and num_loops > 0:
+            self.uvs = foreach_get_array(uv_layer.data, 'uv', num_loops, 2, numpy.float32)
+
+        else:
+            self.uvs = None
+
+        vertex_color_layer = mesh.vertex_colors.active
+
+        if vertex_color_layer is not None and num_loops > 0:
+            # RGB before Blender 2.80, RGBA after
+            size = len(vertex_color_layer.data[0].color)
+            self.colors = foreach_get_array(vertex_color_layer.data, 'color', num_loops, size, numpy.float32)[:, :3]
+
+        else:
+            self.colors = None
+
+    def arrays(self):
+        return (self.co, self.loop_vertices, self.loop_normals, self.triangle_loops,
+                self.face_smooth, self.material_index, self.uvs, self.colors)
+
+    def corners(self, face_indices, use_colors=True, flip_flat_uvs=True):
+        face_indices = numpy.asarray(face_indices, dtype=numpy.int64)
+        sides = numpy.full(len(face_indices), 3, dtype=numpy.int64)
+        starts = numpy.arange(len(face_indices), dtype=numpy.int64) * 3
+
+        corner_loop = self.triangle_loops[face_indices].ravel()
+        smooth = numpy.repeat(self.face_smooth[face_indices], 3)
+
+        points = self.co[self.loop_vertices[corner_loop]].astype(numpy.float64)
+        normals = self.loop_normals[corner_loop].astype(numpy.float64) if self.use_normals else None
+
+        if self.uvs is not None:
+            uvs = self.uvs[corner_loop].astype(numpy.float64)
+            # Flip UV Y axis. Blender UV coord is bottom-left, Mitsuba is top-left.
+            flipped = 1.0 - uvs[:, 1]
+
+            if flip_flat_uvs:
+                uvs[:, 1] = flipped
+
+            else:
+                uvs[:, 1] = numpy.where(smooth, flipped, uvs[:, 1])
+
+        else:
+            uvs = None
+
+        if use_colors and self.colors is not None:
+            colors = self.colors[corner_loop].astype(numpy.float64)
+
+        else:
+            colors = None
+
+        # The corners of a flat polygon share the vertices of its loops
+        return (sides, starts, smooth, points, normals, uvs, colors, corner_loop.astype(numpy.int64))
+
+
+def triangulate(sides, starts, vertex_index):
+    '''
+    Triangle list of faces with the given number of sides and first corner,
+    quads being split into (0, 1, 2), (0, 2, 3).
+    '''
+
+    # For Mitsuba, we need to triangulate quad faces
+    num_faces = len(sides)
+    quads = sides == 4
+    first_tri = numpy.arange(num_faces) + numpy.cumsum(quads) - quads
+    triangles = numpy.empty((num_faces + int(quads.sum()), 3), dtype=numpy.int64)
+    triangles[first_tri] = starts[:, None] + (0, 1, 2)
+    triangles[first_tri[quads] + 1] = starts[quads][:, None] + (0, 2, 3)
+
+    return vertex_index[triangles].astype(numpy.uint32)
+
+
+def merge_sorted_runs(older, newer):
+    '''
+    Merge two sorted (keys, indices) runs holding distinct keys
+    '''
+
+    older_keys, older_indices = older
+    newer_keys, newer_indices = newer
+    count = len(older_keys) + len(newer_keys)
+
+    # Position of every newer key in the merged run, the older keys fill the rest
+    newer_pos = numpy.searchsorted(older_keys, newer_keys) + numpy.arange(len(newer_keys))
+    older_mask = numpy.ones(count, dtype=numpy.bool_)
+    older_mask[newer_pos] = False
+
+    keys = numpy.empty(count, dtype=older_keys.dtype)
+    keys[newer_pos] = newer_keys
+    keys[older_mask] = older_keys
+
+    indices = numpy.empty(count, dtype=numpy.int64)
+    indices[newer_pos] = newer_indices
+    indices[older_mask] = older_indices
+
+    return (keys, indices)
+
+
+class VertexTable:
+    '''
+    Compact hash table of exported vertices, mapping the row keys of
+    row_keys() to vertex indices. The keys are kept in sorted arrays and
+    searched with numpy.searchsorted, which costs a few bytes per vertex
+    instead of the Python tuples and dicts of the Python writers.
+
+    Every insert adds a sorted run, merged with the run before it as long as
+    that one is not larger. The table holds a logarithmic number of runs,
+    and every key is copied a logarithmic number of times, rather than the
+    whole table being copied on every insert.
+    '''
+
+    def __init__(self):
+        # sorted (keys, indices) runs, from the oldest and largest
+        self.runs = []
+
+    def lookup(self, keys):
+        '''
+        Vertex index of every key, or -1 for unknown keys
+        '''
+
+        result = numpy.full(len(keys), -1, dtype=numpy.int64)
+
+        for run_keys, run_indices in self.runs:
+            pos = numpy.searchsorted(run_keys, keys)
+            pos[pos == len(run_keys)] = 0
+            found = run_keys[pos] == keys
+            result[found] = run_indices[pos[found]]
+
+        return result
+
+    def insert(self, keys, indices):
+        '''
+        Add keys that are not in the table yet
+        '''
+
+        if len(keys) == 0:
+            return
+
+        order = numpy.argsort(keys, kind='mergesort')
+        self.runs.append((keys[order], numpy.asarray(indices, dtype=numpy.int64)[order]))
+
+        while len(self.runs) > 1 and len(self.runs[-2][0]) <= len(self.runs[-1][0]):
+            newer = self.runs.pop()
+            self.runs.append(merge_sorted_runs(self.runs.pop(), newer))
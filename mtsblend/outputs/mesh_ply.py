@@ -21,10 +21,19 @@
 #
 # ***** END GPL LICENSE BLOCK *****
 
+import os
 import struct
+import shutil
+import tempfile
 
+from .mesh_buffers import NUMPY_AVAILABLE
+from .profiler import profile
 
-def write_ply_mesh(ply_path, mesh_name, mesh, ffaces_mats):
+if NUMPY_AVAILABLE:
+    import numpy
+
+
+def write_ply_mesh(ply_path, mesh_name, mesh, face_indices):
     uv_textures = mesh.tessface_uv_textures
 
     if len(uv_textures) > 0:
@@ -51,7 +60,10 @@ def write_ply_mesh(ply_path, mesh_name, mesh, ffaces_mats):
 
     vert_index = 0              # exported vert index
 
-    for face in ffaces_mats:
+    mesh_faces = mesh.tessfaces
+
+    for face_index in face_indices:
+        face = mesh_faces[face_index]
         fvi = []
 
         for j, vertex in enumerate(face.vertices):
@@ -152,3 +164,131 @@ def write_ply_mesh(ply_path, mesh_name, mesh, ffaces_mats):
 
         del co_no_uv_cache
         del face_vert_indices
+
+
+def ply_header(vertex_count, face_count, has_uvs, has_normals=True):
+    header = [
+        b'ply\n',
+        b'format binary_little_endian 1.0\n',
+        b'comment Created by MtsBlend 2.5 exporter for Mitsuba - www.mitsuba.net\n',
+        ('element vertex %d\n' % vertex_count).encode(),
+        b'property float x\n',
+        b'property float y\n',
+        b'property float z\n',
+    ]
+
+    if has_normals:
+        header.append(b'property float nx\n')
+        header.append(b'property float ny\n')
+        header.append(b'property float nz\n')
+
+    if has_uvs:
+        header.append(b'property float s\n')
+        header.append(b'property float t\n')
+
+    header.append(('element face %d\n' % face_count).encode())
+    header.append(b'property list uchar uint vertex_indices\n')
+    header.append(b'end_header\n')
+
+    return b''.join(header)
+
+
+def ply_vertex_records(points, normals, uvs):
+    vertex_fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+
+    if normals is not None:
+        vertex_fields.extend([('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4')])
+
+    if uvs is not None:
+        vertex_fields.extend([('s', '<f4'), ('t', '<f4')])
+
+    vertices = numpy.empty(len(points), dtype=vertex_fields)
+
+    for i, axis in enumerate('xyz'):
+        vertices[axis] = points[:, i]
+
+        if normals is not None:
+            vertices['n' + axis] = normals[:, i]
+
+    if uvs is not None:
+        vertices['s'] = uvs[:, 0]
+        vertices['t'] = uvs[:, 1]
+
+    return vertices
+
+
+def ply_face_records(triangles):
+    faces = numpy.empty(len(triangles), dtype=[('count', 'u1'), ('vertex_indices', '<u4', (3,))])
+    faces['count'] = 3
+    faces['vertex_indices'] = triangles
+
+    return faces
+
+
+def prepare_ply_mesh_numpy(buffers, face_indices):
+    """
+    Build the header, vertex block and face block of the binary PLY file
+    for the given faces of the MeshBuffers, ready for write_ply_blocks.
+    """
+
+    # write_ply_mesh leaves the UVs of flat faces unflipped
+    points, normals, uvs, colors, triangles = buffers.build(face_indices, use_colors=False, flip_flat_uvs=False)
+
+    vertices = ply_vertex_records(points, normals, uvs)
+    faces = ply_face_records(triangles)
+
+    return (ply_header(len(vertices), len(faces), uvs is not None, normals is not None), vertices, faces)
+
+
+def write_ply_blocks(ply_path, header, vertices, faces):
+    with open(ply_path, 'wb') as ply:
+        ply.write(header)
+        ply.write(vertices.data)
+        ply.write(faces.data)
+
+
+def write_ply_mesh_numpy(ply_path, mesh_name, buffers, face_indices):
+    """
+    Vectorized counterpart of write_ply_mesh, working on the MeshBuffers
+    of the mesh. The vertex and face blocks are each assembled as one
+    packed record array and written with a single call. Produces
+    byte-identical files.
+    """
+
+    with profile('encode'):
+        blocks = prepare_ply_mesh_numpy(buffers, face_indices)
+
+    write_ply_blocks(ply_path, *blocks)
+
+
+def write_ply_mesh_chunked(ply_path, mesh_name, buffers, face_indices, chunk_size):
+    """
+    Streaming counterpart of write_ply_mesh_numpy for very large meshes.
+    Faces are processed chunk_size at a time and the records of every
+    chunk are spilled to temporary files next to ply_path, which are copied
+    behind the header once the counts are known. Produces byte-identical
+    files.
+    """
+
+    spill_dir = os.path.dirname(ply_path) or None
+    vertex_count = 0
+    face_count = 0
+    has_uvs = False
+    has_normals = True
+
+    with tempfile.TemporaryFile(dir=spill_dir) as vertex_spill, tempfile.TemporaryFile(dir=spill_dir) as face_spill:
+        # write_ply_mesh leaves the UVs of flat faces unflipped
+        for points, normals, uvs, colors, triangles in buffers.build_chunks(face_indices, chunk_size, use_colors=False, flip_flat_uvs=False):
+            vertex_spill.write(ply_vertex_records(points, normals, uvs).data)
+            face_spill.write(ply_face_records(triangles).data)
+            vertex_count += len(points)
+            face_count += len(triangles)
+            has_uvs = uvs is not None
+            has_normals = normals is not None
+
+        with open(ply_path, 'wb') as ply:
+            ply.write(ply_header(vertex_count, face_count, has_uvs, has_normals))
+
+            for spill in (vertex_spill, face_spill):
+                spill.seek(0)
+                shutil.copyfileobj(spill, ply)
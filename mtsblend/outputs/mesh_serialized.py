@@ -21,12 +21,168 @@
 #
 # ***** END GPL LICENSE BLOCK *****
 
+import os
 import struct
 import array
+import shutil
+import tempfile
+import threading
 import zlib
 
+from .profiler import profile
 
-def write_serialized_mesh(ser_path, mesh_name, mesh, ffaces_mats):
+
+def encode_serialized_shape(mesh_name, flags, vertex_count, triangle_count, sections, compression_level=6):
+    '''
+    Compress one shape, sections being the attribute buffers in file order.
+    Returns the bytes of the shape as stored in a serialized file.
+    compression_level goes from 0 (stored) to 9, 6 being the zlib default.
+    '''
+
+    # begin serialized mesh data
+    data = [struct.pack('<HH', 0x041C, 0x0004)]
+
+    # encode serialized mesh
+    encoder = zlib.compressobj(compression_level)
+    data.append(encoder.compress(struct.pack('<I', flags)))
+    data.append(encoder.compress(bytes(mesh_name + "_serialized\0", 'latin-1')))
+    data.append(encoder.compress(struct.pack('<QQ', vertex_count, triangle_count)))
+
+    for section in sections:
+        data.append(encoder.compress(section))
+
+    data.append(encoder.flush())
+
+    return b''.join(data)
+
+
+class SerializedContainer:
+    '''
+    A Mitsuba serialized file holding one or more shapes. The file ends
+    with the offset of every shape followed by the number of shapes, which
+    Mitsuba uses to find the shape selected by the shapeIndex parameter.
+
+    Shape indices are handed out by reserve_shape(), and the encoded shapes
+    may then be written from any thread; they are stored in index order.
+    discard() gives up every index not written yet, so no thread is left
+    waiting for a shape whose job was cancelled.
+    '''
+
+    def __init__(self, ser_path):
+        self.path = ser_path
+        self.file = open(ser_path, 'wb')
+        self.offsets = []
+        self.reserved = 0
+        self.written = 0
+        self.discarded = False
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+        else:
+            self.discard()
+
+    def reserve_shape(self):
+        with self.condition:
+            self.reserved += 1
+            return self.reserved - 1
+
+    def write_encoded(self, shape_index, data):
+        '''
+        Store the encoded shape once all shapes before it have been stored.
+        data is either bytes or a file positioned at the start of the shape.
+        A data of None gives up the reserved index without writing anything.
+        Nothing is written either once the container is discarded.
+        '''
+
+        with self.condition:
+            while self.written != shape_index and not self.discarded:
+                self.condition.wait()
+
+            if self.discarded:
+                return
+
+            try:
+                if data is not None:
+                    self.offsets.append(self.file.tell())
+
+                    if isinstance(data, bytes):
+                        self.file.write(data)
+
+                    else:
+                        shutil.copyfileobj(data, self.file)
+
+            finally:
+                self.written += 1
+                self.condition.notify_all()
+
+    def write_shape(self, mesh_name, flags, vertex_count, triangle_count, sections, shape_index=None, compression_level=6):
+        '''
+        Append one compressed shape. Returns the shape index of the new shape.
+        '''
+
+        if shape_index is None:
+            shape_index = self.reserve_shape()
+
+        data = None
+
+        try:
+            data = encode_serialized_shape(mesh_name, flags, vertex_count, triangle_count, sections, compression_level)
+
+        finally:
+            self.write_encoded(shape_index, data)
+
+        return shape_index
+
+    def discard(self):
+        '''
+        Close and delete the file without completing it, after a failed or
+        cancelled export. The shapes still waiting for their turn are dropped.
+        '''
+
+        with self.condition:
+            self.discarded = True
+            self.condition.notify_all()
+            self.file.close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        # Wait for the shapes still being encoded
+        with self.condition:
+            while self.written != self.reserved and not self.discarded:
+                self.condition.wait()
+
+            if self.discarded:
+                return
+
+            for offset in self.offsets:
+                self.file.write(struct.pack('<Q', offset))
+
+            self.file.write(struct.pack('<I', len(self.offsets)))
+            self.file.close()
+
+
+def write_serialized_shape(ser_path, container, mesh_name, flags, vertex_count, triangle_count, sections, shape_index=None, compression_level=6):
+    '''
+    Append the shape to container, or write it as the only shape of a new
+    file at ser_path when no container is given. Returns the shape index.
+    '''
+
+    if container is not None:
+        return container.write_shape(mesh_name, flags, vertex_count, triangle_count, sections, shape_index, compression_level)
+
+    with SerializedContainer(ser_path) as container:
+        return container.write_shape(mesh_name, flags, vertex_count, triangle_count, sections, None, compression_level)
+
+
+def write_serialized_mesh(ser_path, mesh_name, mesh, face_indices, container=None, single_precision=False, compression_level=6):
     uv_textures = mesh.tessface_uv_textures
 
     if len(uv_textures) > 0:
@@ -45,10 +201,11 @@ def write_serialized_mesh(ser_path, mesh_name, mesh, ffaces_mats):
         vertex_color_layer = None
 
     # Export data
-    points = array.array('d', [])
-    normals = array.array('d', [])
-    uvs = array.array('d', [])
-    vtx_colors = array.array('d', [])
+    float_type = 'f' if single_precision else 'd'
+    points = array.array(float_type, [])
+    normals = array.array(float_type, [])
+    uvs = array.array(float_type, [])
+    vtx_colors = array.array(float_type, [])
     ntris = 0
     face_vert_indices = array.array('I', [])  # list of face vert indices
 
@@ -57,7 +214,10 @@ def write_serialized_mesh(ser_path, mesh_name, mesh, ffaces_mats):
     vert_use_vno = set()        # Set of vert indices that use vert normals
 
     vert_index = 0              # exported vert index
-    for face in ffaces_mats:
+    mesh_faces = mesh.tessfaces
+
+    for face_index in face_indices:
+        face = mesh_faces[face_index]
         fvi = []
         for j, vertex in enumerate(face.vertices):
             v = mesh.vertices[vertex]
@@ -146,41 +306,204 @@ def write_serialized_mesh(ser_path, mesh_name, mesh, ffaces_mats):
     del vert_vno_indices
     del vert_use_vno
 
-    with open(ser_path, 'wb') as ser:
-        # create mesh flags
-        flags = 0
+    # create mesh flags
+    flags = 0
+
+    if single_precision:
+        # turn on single precision
+        flags = flags | 0x1000
+
+    else:
         # turn on double precision
         flags = flags | 0x2000
-        # turn on vertex normals
+
+    # turn on vertex normals
+    flags = flags | 0x0001
+    sections = [points, normals]
+
+    # turn on uv layer
+    if uv_layer:
+        flags = flags | 0x0002
+        sections.append(uvs)
+
+    if vertex_color_layer:
+        flags = flags | 0x0008
+        sections.append(vtx_colors)
+
+    sections.append(face_vert_indices)
+
+    return write_serialized_shape(ser_path, container, mesh_name, flags, vert_index, int(ntris / 3), sections,
+                                  compression_level=compression_level)
+
+
+def prepare_serialized_mesh_numpy(buffers, face_indices, single_precision=False):
+    """
+    Build the flags, counts and attribute sections of the serialized shape
+    for the given faces of the MeshBuffers, ready for write_serialized_shape.
+    """
+
+    points, normals, uvs, vtx_colors, face_vert_indices = buffers.build(face_indices)
+
+    # create mesh flags
+    flags = 0
+
+    if single_precision:
+        # turn on single precision
+        flags = flags | 0x1000
+        float_type = '<f4'
+
+    else:
+        # turn on double precision
+        flags = flags | 0x2000
+        float_type = '<f8'
+
+    sections = [points.astype(float_type, copy=False)]
+
+    # turn on vertex normals, unless Mitsuba computes them
+    if normals is not None:
         flags = flags | 0x0001
+        sections.append(normals.astype(float_type, copy=False))
+
+    # turn on uv layer
+    if uvs is not None:
+        flags = flags | 0x0002
+        sections.append(uvs.astype(float_type, copy=False))
+
+    if vtx_colors is not None:
+        flags = flags | 0x0008
+        sections.append(vtx_colors.astype(float_type, copy=False))
+
+    sections.append(face_vert_indices.astype('<u4', copy=False))
+
+    return (flags, len(points), len(face_vert_indices), sections)
+
+
+def write_serialized_mesh_numpy(ser_path, mesh_name, buffers, face_indices, container=None, single_precision=False, compression_level=6):
+    """
+    Vectorized counterpart of write_serialized_mesh, working on the
+    MeshBuffers of the mesh. Produces byte-identical files.
+    """
+
+    flags, vertex_count, triangle_count, sections = prepare_serialized_mesh_numpy(buffers, face_indices, single_precision)
+
+    return write_serialized_shape(ser_path, container, mesh_name, flags, vertex_count, triangle_count, sections,
+                                  compression_level=compression_level)
+
 
-        # turn on uv layer
-        if uv_layer:
+def write_serialized_shape_numpy(ser_path, container, mesh_name, buffers, face_indices, single_precision=False,
+                                 shape_index=None, compression_level=6):
+    """
+    Counterpart of write_serialized_mesh_numpy with the arguments of
+    write_serialized_mesh_chunked, so the vertex de-duplication runs on the
+    export pipeline along with the compression. Returns the shape index.
+    """
+
+    try:
+        with profile('encode'):
+            flags, vertex_count, triangle_count, sections = prepare_serialized_mesh_numpy(buffers, face_indices, single_precision)
+
+    except:
+        # give up the reserved index, or the shapes after it wait forever
+        if container is not None and shape_index is not None:
+            container.write_encoded(shape_index, None)
+
+        raise
+
+    # write_shape stores the shape or gives up its index on failure
+    return write_serialized_shape(ser_path, container, mesh_name, flags, vertex_count, triangle_count, sections,
+                                  shape_index, compression_level)
+
+
+def write_serialized_mesh_chunked(ser_path, container, mesh_name, buffers, face_indices, chunk_size,
+                                  single_precision=False, shape_index=None, compression_level=6):
+    """
+    Streaming counterpart of write_serialized_mesh_numpy for very large
+    meshes. Faces are processed chunk_size at a time and every attribute
+    section is spilled to a temporary file next to ser_path. The sections
+    are then compressed block by block once the counts are known. Produces
+    byte-identical files. Returns the shape index.
+    """
+
+    spill_dir = os.path.dirname(ser_path) or None
+    float_type = '<f4' if single_precision else '<f8'
+    spills = [tempfile.TemporaryFile(dir=spill_dir) for _ in range(5)]
+    shape = None
+
+    try:
+        vertex_count = 0
+        triangle_count = 0
+        has_normals = has_uvs = has_colors = False
+
+        for chunk in buffers.build_chunks(face_indices, chunk_size):
+            points, normals, uvs, vtx_colors, face_vert_indices = chunk
+
+            for spill, section in zip(spills, chunk):
+                if section is not None:
+                    dtype = '<u4' if section is face_vert_indices else float_type
+                    spill.write(section.astype(dtype, copy=False).data)
+
+            vertex_count += len(points)
+            triangle_count += len(face_vert_indices)
+            has_normals = normals is not None
+            has_uvs = uvs is not None
+            has_colors = vtx_colors is not None
+
+        # create mesh flags, see prepare_serialized_mesh_numpy
+        flags = 0x1000 if single_precision else 0x2000
+
+        if has_normals:
+            flags = flags | 0x0001
+
+        if has_uvs:
             flags = flags | 0x0002
 
-        if vertex_color_layer:
+        if has_colors:
             flags = flags | 0x0008
 
-        # begin serialized mesh data
-        ser.write(struct.pack('<HH', 0x041C, 0x0004))
+        shape = tempfile.TemporaryFile(dir=spill_dir)
+        shape.write(struct.pack('<HH', 0x041C, 0x0004))
+
+        encoder = zlib.compressobj(compression_level)
+        shape.write(encoder.compress(struct.pack('<I', flags)))
+        shape.write(encoder.compress(bytes(mesh_name + "_serialized\0", 'latin-1')))
+        shape.write(encoder.compress(struct.pack('<QQ', vertex_count, triangle_count)))
+
+        for spill in spills:
+            spill.seek(0)
+
+            for block in iter(lambda: spill.read(1 << 20), b''):
+                shape.write(encoder.compress(block))
+
+        shape.write(encoder.flush())
+        shape.seek(0)
+
+    except:
+        if shape is not None:
+            shape.close()
+            shape = None
+
+        if container is not None and shape_index is not None:
+            container.write_encoded(shape_index, None)
+
+        raise
+
+    finally:
+        for spill in spills:
+            spill.close()
+
+    try:
+        if container is not None:
+            if shape_index is None:
+                shape_index = container.reserve_shape()
 
-        # encode serialized mesh
-        encoder = zlib.compressobj()
-        ser.write(encoder.compress(struct.pack('<I', flags)))
-        ser.write(encoder.compress(bytes(mesh_name + "_serialized\0", 'latin-1')))
-        ser.write(encoder.compress(struct.pack('<QQ', vert_index, int(ntris / 3))))
-        ser.write(encoder.compress(points.tostring()))
-        ser.write(encoder.compress(normals.tostring()))
+            container.write_encoded(shape_index, shape)
 
-        if uv_layer:
-            ser.write(encoder.compress(uvs.tostring()))
+            return shape_index
 
-        if vertex_color_layer:
-            ser.write(encoder.compress(vtx_colors.tostring()))
+        with SerializedContainer(ser_path) as container:
+            container.write_encoded(container.reserve_shape(), shape)
 
-        ser.write(encoder.compress(face_vert_indices.tostring()))
-        ser.write(encoder.flush())
+        return 0
 
-        ser.write(struct.pack('<Q', 0))
-        ser.write(struct.pack('<I', 1))
-        ser.close()
+    finally:
+        shape.close()
@@ -0,0 +1,226 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+from ..outputs import MtsLog
+
+
+def shape_key(mesh_digest, *options):
+    '''
+    Store key of one shape of a mesh, given the digest of the mesh buffers
+    and every option that changes the bytes of the written file.
+    '''
+
+    key = hashlib.sha1(mesh_digest.encode())
+
+    for option in options:
+        key.update(b'|' + str(option).encode())
+
+    return key.hexdigest()
+
+
+class MeshStore:
+    '''
+    Content-addressed directory of mesh and hair files shared by all frames
+    and exports of a blend file. Each file is named after the key of its
+    content, so identical geometry is only ever written once.
+
+    The manifest records the size of every file and when it was last used.
+    On save, the least recently used files not referenced by the current
+    export are deleted until the store fits in max_size bytes.
+    '''
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.entries = {}
+        # keys of the files made from a source, by source key, see link()
+        self.aliases = {}
+        self.used = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        try:
+            with open(os.path.join(path, self.MANIFEST), 'r') as manifest:
+                data = json.load(manifest)
+                self.entries = data['entries']
+                self.aliases = data.get('aliases', {})
+
+        except (OSError, ValueError, KeyError):
+            self.entries = {}
+            self.aliases = {}
+
+    def file_path(self, key, file_format):
+        return '/'.join([self.path, '%s.%s' % (key, file_format)])
+
+    def reserve(self, key, file_format):
+        '''
+        Mark the file of key as used by this export. Returns its path and
+        whether it still has to be written, see add().
+        '''
+
+        file_path = self.file_path(key, file_format)
+
+        with self.lock:
+            self.used.add(key)
+
+            if key in self.entries and (self.entries[key].get('pending') or os.path.exists(file_path)):
+                self.entries[key]['used'] = time.time()
+                self.hits += 1
+
+                return (file_path, False)
+
+            self.entries[key] = {
+                'file': os.path.basename(file_path),
+                'size': 0,
+                'used': time.time(),
+                'pending': True
+            }
+            self.misses += 1
+
+        return (file_path, True)
+
+    def use(self, key):
+        '''
+        Mark the file of key, referenced by elements reused from a previous
+        export, as used by this export. Returns False when the file is no
+        longer in the store.
+        '''
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or not (entry.get('pending') or os.path.exists('/'.join([self.path, entry['file']]))):
+                return False
+
+            self.used.add(key)
+            entry['used'] = time.time()
+
+        return True
+
+    def link(self, alias, keys):
+        '''
+        Record that the files of keys are made from the source of alias, a
+        key computed before the content of the files is known.
+        '''
+
+        with self.lock:
+            self.aliases[alias] = list(keys)
+
+    def lookup(self, alias):
+        '''
+        Keys linked to alias when all their files are still stored, marking
+        them used, or None.
+        '''
+
+        with self.lock:
+            keys = self.aliases.get(alias)
+
+        if keys is None or not all([self.use(key) for key in keys]):
+            return None
+
+        return keys
+
+    def add(self, key, file_path, write_func, *args, **kwargs):
+        '''
+        Write a reserved file through write_func(path, *args, **kwargs).
+        The file is written under a temporary name and renamed once
+        complete, so the store never holds a partial file under a valid key.
+        '''
+
+        temp_path = '%s.%d_%d.tmp' % (file_path, os.getpid(), threading.get_ident())
+
+        try:
+            write_func(temp_path, *args, **kwargs)
+            os.replace(temp_path, file_path)
+
+        except:
+            with self.lock:
+                self.entries.pop(key, None)
+
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+            raise
+
+        with self.lock:
+            entry = self.entries[key]
+            entry['size'] = os.path.getsize(file_path)
+            entry.pop('pending', None)
+
+    def cleanup(self):
+        '''
+        Delete unused files, least recently used first, until the store
+        fits in max_size bytes.
+        '''
+
+        total = sum(entry['size'] for entry in self.entries.values())
+
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['used']):
+            if total <= self.max_size:
+                break
+
+            if key in self.used:
+                continue
+
+            try:
+                os.remove('/'.join([self.path, entry['file']]))
+
+            except OSError:
+                pass
+
+            total -= entry['size']
+            del self.entries[key]
+
+    def save(self):
+        '''
+        Apply the size cap and write the manifest.
+        '''
+
+        with self.lock:
+            # Drop the files that failed to be written
+            self.entries = {k: e for k, e in self.entries.items() if not e.get('pending')}
+            self.cleanup()
+            self.aliases = {alias: keys for alias, keys in self.aliases.items()
+                            if all(key in self.entries for key in keys)}
+
+            manifest_path = os.path.join(self.path, self.MANIFEST)
+            temp_path = '%s.%d.tmp' % (manifest_path, os.getpid())
+
+            with open(temp_path, 'w') as manifest:
+                json.dump({'version': 1, 'entries': self.entries, 'aliases': self.aliases}, manifest, indent=1, sort_keys=True)
+
+            os.replace(temp_path, manifest_path)
+
+        MtsLog('Mesh store: %d files reused, %d files written' % (self.hits, self.misses))
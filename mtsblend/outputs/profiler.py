@@ -0,0 +1,252 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+import os
+import json
+import time
+import threading
+
+
+class ProfileSpan:
+    '''
+    Times one call of a phase. Set nbytes to record bytes written.
+    '''
+
+    def __init__(self, profiler, phase, name):
+        self.profiler = profiler
+        self.phase = phase
+        self.name = name
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.record(self.phase, self.name, time.perf_counter() - self.start, self.nbytes)
+
+
+class NullSpan:
+    nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class NullProfiler:
+    '''
+    Profiler used when profiling is off, doing nothing.
+    '''
+
+    enabled = False
+    null_span = NullSpan()
+
+    def span(self, phase, name=None):
+        return self.null_span
+
+    def record(self, phase, name, seconds, nbytes=0):
+        pass
+
+    def wrap(self, phase, name, func, path=None):
+        return func
+
+
+class ExportProfiler:
+    '''
+    Aggregates the timed spans of an export by phase, and by object and
+    phase. Spans may nest and may run on the export worker threads, so the
+    times of a phase are inclusive and can add up to more than the export.
+    '''
+
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.objects = {}
+        self.start = time.perf_counter()
+
+    def span(self, phase, name=None):
+        return ProfileSpan(self, phase, name)
+
+    def record(self, phase, name, seconds, nbytes=0):
+        with self.lock:
+            stats = [self.phases.setdefault(phase, [0, 0.0, 0.0, 0])]
+
+            if name is not None:
+                stats.append(self.objects.setdefault(name, {}).setdefault(phase, [0, 0.0, 0.0, 0]))
+
+            for entry in stats:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+                entry[3] += nbytes
+
+    def wrap(self, phase, name, func, path=None):
+        '''
+        Wrap func in a span, recording the size of path once func returns.
+        '''
+
+        def timed(*args, **kwargs):
+            with self.span(phase, name) as span:
+                result = func(*args, **kwargs)
+
+                if path is not None and os.path.exists(path):
+                    span.nbytes = os.path.getsize(path)
+
+            return result
+
+        return timed
+
+    def report(self):
+        def entries(phases):
+            return {
+                phase: {'count': count, 'total': total, 'max': longest, 'bytes': nbytes}
+                for phase, (count, total, longest, nbytes) in phases.items()
+            }
+
+        with self.lock:
+            return {
+                'version': 1,
+                'seconds': time.perf_counter() - self.start,
+                'phases': entries(self.phases),
+                'objects': {name: entries(phases) for name, phases in self.objects.items()},
+            }
+
+    def save(self, path):
+        '''
+        Write the JSON report to path and a summary of the phases to the log.
+        '''
+
+        from ..outputs import MtsLog
+
+        report = self.report()
+
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=1, sort_keys=True)
+
+        MtsLog('Export profile: %.3fs, report written to %s' % (report['seconds'], path))
+
+        for phase, entry in sorted(report['phases'].items(), key=lambda item: -item[1]['total']):
+            line = '  %-16s %6d calls %9.3fs total %8.3fs max %12d bytes' % (
+                phase, entry['count'], entry['total'], entry['max'], entry['bytes'])
+
+            if entry['bytes'] and entry['total'] > 0:
+                line += ' %9.1f MB/s' % (entry['bytes'] / entry['total'] / 1e6)
+
+            MtsLog(line)
+
+
+class SpanGroup:
+    def __init__(self, spans):
+        self.spans = spans
+
+    @property
+    def nbytes(self):
+        return self.spans[0].nbytes
+
+    @nbytes.setter
+    def nbytes(self, value):
+        for span in self.spans:
+            span.nbytes = value
+
+    def __enter__(self):
+        for span in self.spans:
+            span.__enter__()
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for span in reversed(self.spans):
+            span.__exit__(exc_type, exc_val, exc_tb)
+
+
+class ProfilerGroup:
+    '''
+    Forwards spans to several profilers, such as a report and a trace.
+    '''
+
+    enabled = True
+
+    def __init__(self, profilers):
+        self.profilers = profilers
+
+    def span(self, phase, name=None):
+        return SpanGroup([profiler.span(phase, name) for profiler in self.profilers])
+
+    def record(self, phase, name, seconds, nbytes=0):
+        for profiler in self.profilers:
+            profiler.record(phase, name, seconds, nbytes)
+
+    def wrap(self, phase, name, func, path=None):
+        for profiler in self.profilers:
+            func = profiler.wrap(phase, name, func, path)
+
+        return func
+
+
+# profilers by slot, see set_profiler()
+profilers = {}
+active_profiler = NullProfiler()
+
+
+def get_profiler():
+    return active_profiler
+
+
+def set_profiler(profiler, slot='report'):
+    '''
+    Make profiler receive the spans of profile() under the given slot, a
+    profiler of None removing the slot. Profiling is off with no slot left.
+    '''
+
+    global active_profiler
+
+    if profiler is not None:
+        profilers[slot] = profiler
+
+    else:
+        profilers.pop(slot, None)
+
+    if len(profilers) == 0:
+        active_profiler = NullProfiler()
+
+    elif len(profilers) == 1:
+        active_profiler = list(profilers.values())[0]
+
+    else:
+        active_profiler = ProfilerGroup([profilers[key] for key in sorted(profilers)])
+
+
+def profile(phase, name=None):
+    '''
+    Span of the active profiler, for use as a context manager:
+
+        with profile('to_mesh', obj.name):
+            mesh = obj.to_mesh(...)
+    '''
+
+    return active_profiler.span(phase, name)
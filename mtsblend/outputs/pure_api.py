@@ -40,6 +40,7 @@ from ..export import matrix_to_list
 from ..properties import ExportedVolumes
 
 from ..outputs import MtsLog, MtsManager
+from ..outputs.profiler import profile
 
 addon_prefs = MitsubaAddon.get_prefs()
 oldflags = None
@@ -300,7 +301,8 @@ if not 'PYMTS_AVAILABLE' in locals() and addon_prefs is not None:
                 Call Scene configure
                 '''
 
-                self.scene.addChild(self.pmgr.create(self.scene_data))
+                with profile('pmgr_create'):
+                    self.scene.addChild(self.pmgr.create(self.scene_data))
                 self.scene.configure()
 
                 # Reset the volume redundancy check
@@ -394,36 +396,37 @@ if not 'PYMTS_AVAILABLE' in locals() and addon_prefs is not None:
                 if self.ctx.test_break():
                     return
 
-                try:
-                    render_result = self.ctx.render_engine.begin_result(0, 0, self.size[0], self.size[1])
+                with profile('update_result'):
+                    try:
+                        render_result = self.ctx.render_engine.begin_result(0, 0, self.size[0], self.size[1])
 
-                    if render_result is None:
-                        err_msg = 'ERROR: Cannot not load render result: begin_result() returned None.'
-                        self.do_cancel = True
-                        raise Exception(err_msg)
+                        if render_result is None:
+                            err_msg = 'ERROR: Cannot not load render result: begin_result() returned None.'
+                            self.do_cancel = True
+                            raise Exception(err_msg)
 
-                    if self.fast_buffer:
-                        passes = len(render_result.layers[0].passes)
-                        bitmap_buffer = self.get_bitmap_buffer(passes)
-                        render_result.layers[0].passes.foreach_set('rect', bitmap_buffer)
+                        if self.fast_buffer:
+                            passes = len(render_result.layers[0].passes)
+                            bitmap_buffer = self.get_bitmap_buffer(passes)
+                            render_result.layers[0].passes.foreach_set('rect', bitmap_buffer)
 
-                    else:
-                        bitmap_buffer = self.get_bitmap_list()
-                        render_result.layers[0].passes[0].rect = bitmap_buffer
+                        else:
+                            bitmap_buffer = self.get_bitmap_list()
+                            render_result.layers[0].passes[0].rect = bitmap_buffer
 
-                    self.ctx.render_engine.end_result(render_result, 0)
+                        self.ctx.render_engine.end_result(render_result, 0)
 
-                except Exception as err:
-                    MtsLog('%s' % err)
+                    except Exception as err:
+                        MtsLog('%s' % err)
 
-                    if self.fast_buffer:
-                        self.fast_buffer = False
+                        if self.fast_buffer:
+                            self.fast_buffer = False
 
-                    else:
-                        self.do_cancel = True
+                        else:
+                            self.do_cancel = True
 
-                    if self.do_cancel:
-                        self.ctx.render_cancel()
+                        if self.do_cancel:
+                            self.ctx.render_cancel()
 
         class InternalRenderContext:
             '''
@@ -513,7 +516,7 @@ if not 'PYMTS_AVAILABLE' in locals() and addon_prefs is not None:
                 self.thread.setFileResolver(main_fresolver)
                 self.thread.setLogger(main_logger)
 
-            def serialize(self, fileName, name, mesh, materialID):
+            def trimesh(self, mesh, materialID):
                 faces = mesh.tessfaces[0].as_pointer()
                 vertices = mesh.vertices[0].as_pointer()
 
@@ -533,15 +536,52 @@ if not 'PYMTS_AVAILABLE' in locals() and addon_prefs is not None:
                 else:
                     vertexColors = 0
 
-                trimesh = TriMesh.fromBlender(mesh.name, len(mesh.tessfaces),
+                return TriMesh.fromBlender(mesh.name, len(mesh.tessfaces),
                     faces, len(mesh.vertices), vertices, texCoords, vertexColors, materialID)
 
+            def serialize(self, fileName, name, mesh, materialID):
+                trimesh = self.trimesh(mesh, materialID)
+
                 fstream = FileStream(fileName, FileStream.ETruncReadWrite)
                 trimesh.serialize(fstream)
                 fstream.writeULong(0)
                 fstream.writeUInt(1)
                 fstream.close()
 
+            def open_container(self, fileName):
+                return SerializerContainer(self, fileName)
+
+        class SerializerContainer:
+            '''
+            Serialized file holding several shapes written by the Serializer,
+            see mesh_serialized.SerializedContainer
+            '''
+
+            def __init__(self, serializer, fileName):
+                self.serializer = serializer
+                self.path = fileName
+                self.fstream = FileStream(fileName, FileStream.ETruncReadWrite)
+                self.offsets = []
+
+            def serialize(self, name, mesh, materialID):
+                self.offsets.append(self.fstream.getPos())
+                self.serializer.trimesh(mesh, materialID).serialize(self.fstream)
+
+                return len(self.offsets) - 1
+
+            def discard(self):
+                self.fstream.close()
+
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+
+            def close(self):
+                for offset in self.offsets:
+                    self.fstream.writeULong(offset)
+
+                self.fstream.writeUInt(len(self.offsets))
+                self.fstream.close()
+
         PYMTS_AVAILABLE = True
         MtsLog('Using Mitsuba python extension')
 
@@ -0,0 +1,136 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+import os
+import json
+import time
+import threading
+
+
+class TraceSpan:
+    '''
+    Times one call of a phase on the current thread.
+    '''
+
+    def __init__(self, tracer, phase, name):
+        self.tracer = tracer
+        self.phase = phase
+        self.name = name
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = time.perf_counter()
+        self.tracer.add(self.phase, self.name, self.start, end, self.nbytes)
+
+
+class ExportTracer:
+    '''
+    Records every span of the export and render as a complete event of the
+    Chrome trace format, loadable in chrome://tracing or Perfetto.
+
+    Events are appended to a list as plain tuples and only converted when
+    saving, appending being atomic under the GIL, so tracing needs no lock.
+    Used as a profiler, see set_profiler().
+    '''
+
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+        self.threads = {}
+        self.origin = time.perf_counter()
+
+    def span(self, phase, name=None):
+        return TraceSpan(self, phase, name)
+
+    def add(self, phase, name, start, end, nbytes=0):
+        thread_id = threading.get_ident()
+
+        if thread_id not in self.threads:
+            self.threads[thread_id] = threading.current_thread().name
+
+        self.events.append((phase, name, start, end, thread_id, nbytes))
+
+    def record(self, phase, name, seconds, nbytes=0):
+        end = time.perf_counter()
+        self.add(phase, name, end - seconds, end, nbytes)
+
+    def wrap(self, phase, name, func, path=None):
+        '''
+        Wrap func in a span, recording the size of path once func returns.
+        '''
+
+        def traced(*args, **kwargs):
+            with self.span(phase, name) as span:
+                result = func(*args, **kwargs)
+
+                if path is not None and os.path.exists(path):
+                    span.nbytes = os.path.getsize(path)
+
+            return result
+
+        return traced
+
+    def trace(self):
+        pid = os.getpid()
+        trace_events = [
+            {'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': thread_id, 'args': {'name': thread_name}}
+            for thread_id, thread_name in self.threads.items()
+        ]
+
+        for phase, name, start, end, thread_id, nbytes in list(self.events):
+            event = {
+                'ph': 'X',
+                'name': phase,
+                'cat': 'mtsblend',
+                'pid': pid,
+                'tid': thread_id,
+                'ts': (start - self.origin) * 1e6,
+                'dur': (end - start) * 1e6,
+            }
+            args = {}
+
+            if name is not None:
+                args['object'] = name
+
+            if nbytes:
+                args['bytes'] = nbytes
+
+            if args:
+                event['args'] = args
+
+            trace_events.append(event)
+
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        from ..outputs import MtsLog
+
+        with open(path, 'w') as trace_file:
+            json.dump(self.trace(), trace_file)
+
+        MtsLog('Trace of %d events written to %s' % (len(self.events), path))
@@ -75,8 +75,16 @@ class mitsuba_engine(declarative_property_group):
         #'binary_name',
         #'write_files',
         ['export_particles', 'export_hair'],
+        'hair_format',
         'mesh_type',
+        'mesh_container',
+        ['mesh_precision', 'mesh_compression'],
+        'mesh_chunk_size',
+        'prune_attributes',
         'partial_export',
+        'incremental_export',
+        ['mesh_store', 'mesh_store_size'],
+        'mesh_cache',
         'render',
         'refresh_interval',
         'threads_auto',
@@ -87,6 +95,15 @@ class mitsuba_engine(declarative_property_group):
     visibility = {
         'write_files': {'export_type': 'INT'},
         'mesh_type': O([{'export_type':'EXT'}, A([{'export_type':'INT'}, {'write_files': True}])]),
+        'mesh_container': A([{'mesh_type': 'serialized'}, O([{'export_type':'EXT'}, A([{'export_type':'INT'}, {'write_files': True}])])]),
+        'mesh_precision': A([{'mesh_type': 'serialized'}, O([{'export_type':'EXT'}, A([{'export_type':'INT'}, {'write_files': True}])])]),
+        'mesh_compression': A([{'mesh_type': 'serialized'}, O([{'export_type':'EXT'}, A([{'export_type':'INT'}, {'write_files': True}])])]),
+        'hair_format': A([{'export_hair': True}, O([{'export_type':'EXT'}, A([{'export_type':'INT'}, {'write_files': True}])])]),
+        'mesh_chunk_size': O([{'export_type':'EXT'}, A([{'export_type':'INT'}, {'write_files': True}])]),
+        'mesh_cache': O([{'export_type':'EXT'}, A([{'export_type':'INT'}, {'write_files': True}])]),
+        'prune_attributes': O([{'export_type':'EXT'}, A([{'export_type':'INT'}, {'write_files': True}])]),
+        'mesh_store': O([{'export_type':'EXT'}, A([{'export_type':'INT'}, {'write_files': True}])]),
+        'mesh_store_size': A([{'mesh_store': True}, O([{'export_type':'EXT'}, A([{'export_type':'INT'}, {'write_files': True}])])]),
         'binary_name': {'export_type': 'EXT'},
         'render': O([{'write_files': True}, {'export_type': 'EXT'}]),  # We need run renderer unless we are set for internal-pipe mode, which is the only time both of these are false
         'threads': {'threads_auto': False},
@@ -135,6 +152,58 @@ class mitsuba_engine(declarative_property_group):
             'default': False,
             'save_in_preset': True
         },
+        {
+            'type': 'bool',
+            'attr': 'incremental_export',
+            'name': 'Incremental Export',
+            'description': 'Reuse the exported objects, materials and world that did not change since the last export. Try disabling this if changes do not show up in renders',
+            'default': False,
+            'save_in_preset': True
+        },
+        {
+            'type': 'int',
+            'attr': 'mesh_chunk_size',
+            'name': 'Streaming Chunk Size',
+            'description': 'Meshes with more faces than this are written in chunks of this many faces, which bounds the memory used by very large meshes. 0 disables streaming. Requires NumPy',
+            'default': 1000000,
+            'min': 0,
+            'soft_min': 10000,
+            'save_in_preset': True
+        },
+        {
+            'type': 'bool',
+            'attr': 'mesh_cache',
+            'name': 'Cache Evaluated Meshes',
+            'description': 'Keep the evaluated geometry of objects in memory and reuse it in the next export when the object, its mesh and its modifiers did not change. Requires NumPy',
+            'default': False,
+            'save_in_preset': True
+        },
+        {
+            'type': 'bool',
+            'attr': 'prune_attributes',
+            'name': 'Prune Unused Layers',
+            'description': 'Leave out the UV and vertex color layers that the materials of a mesh do not use. Requires NumPy',
+            'default': False,
+            'save_in_preset': True
+        },
+        {
+            'type': 'bool',
+            'attr': 'mesh_store',
+            'name': 'Shared Mesh Store',
+            'description': 'Write meshes and hair once into a store shared by all frames and exports, and reuse them whenever the geometry is unchanged. Requires NumPy',
+            'default': False,
+            'save_in_preset': True
+        },
+        {
+            'type': 'int',
+            'attr': 'mesh_store_size',
+            'name': 'Store Size (MB)',
+            'description': 'Size above which the least recently used meshes and hair files are removed from the store',
+            'default': 4096,
+            'min': 1,
+            'soft_max': 65536,
+            'save_in_preset': True
+        },
         {
             'type': 'enum',
             'attr': 'binary_name',
@@ -169,6 +238,18 @@ class mitsuba_engine(declarative_property_group):
             'description': 'Export particle system dupli objects',
             'default': True
         },
+        {
+            'type': 'enum',
+            'attr': 'hair_format',
+            'name': 'Hair Format',
+            'description': 'Sets the format of hair files, unless set by the particle system. Binary files are smaller and faster to write and to load',
+            'items': [
+                ('ascii', 'Text', 'ascii'),
+                ('binary', 'Binary', 'binary')
+            ],
+            'default': 'ascii',
+            'save_in_preset': True
+        },
         {
             'type': 'enum',
             'attr': 'mesh_type',
@@ -181,6 +262,41 @@ class mitsuba_engine(declarative_property_group):
             'default': 'serialized',
             'save_in_preset': True
         },
+        {
+            'type': 'enum',
+            'attr': 'mesh_container',
+            'name': 'Mesh Files',
+            'description': 'Sets how Serialized meshes are grouped into files. Fewer, larger files are faster to write and to load for objects with many materials',
+            'items': [
+                ('shape', 'One file per shape', 'shape'),
+                ('object', 'One file per object', 'object'),
+                ('scene', 'One file per scene', 'scene')
+            ],
+            'default': 'shape',
+            'save_in_preset': True
+        },
+        {
+            'type': 'enum',
+            'attr': 'mesh_precision',
+            'name': 'Precision',
+            'description': 'Floating point precision of Serialized mesh vertex data. Single precision halves the file size',
+            'items': [
+                ('double', 'Double', 'double'),
+                ('single', 'Single', 'single')
+            ],
+            'default': 'double',
+            'save_in_preset': True
+        },
+        {
+            'type': 'int',
+            'attr': 'mesh_compression',
+            'name': 'Compression',
+            'description': 'Compression level of Serialized meshes, from 0 (no compression, fastest) to 9 (smallest files)',
+            'default': 6,
+            'min': 0,
+            'max': 9,
+            'save_in_preset': True
+        },
         {
             'type': 'enum',
             'attr': 'log_verbosity',
@@ -239,7 +355,9 @@ class mitsuba_testing(declarative_property_group):
 
     controls = [
         'object_analysis',
-        're_raise'
+        're_raise',
+        'profile_export',
+        'trace_render',
     ]
 
     visibility = {}
@@ -259,4 +377,18 @@ class mitsuba_testing(declarative_property_group):
             'description': 'Show export error messages in the UI as well as the console',
             'default': False
         },
+        {
+            'type': 'bool',
+            'attr': 'profile_export',
+            'name': 'Debug: Profile Export',
+            'description': 'Time every export phase and object, and write the report as JSON next to the scene file',
+            'default': False
+        },
+        {
+            'type': 'bool',
+            'attr': 'trace_render',
+            'name': 'Debug: Trace Render',
+            'description': 'Record the export and render timeline of every render as a Chrome trace (chrome://tracing), written next to the render output',
+            'default': False
+        },
     ]
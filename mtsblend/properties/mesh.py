@@ -32,10 +32,13 @@ class mitsuba_mesh(declarative_property_group):
 
     controls = [
         'mesh_type',
-        'normals'
+        'normals',
+        'max_smooth_angle',
+        'extraction'
     ]
 
     visibility = {
+        'max_smooth_angle': {'normals': 'dihedralangle'},
     }
 
     properties = [
@@ -62,5 +65,25 @@ class mitsuba_mesh(declarative_property_group):
                 ('default', 'Use normals from Blender', 'default')
             ],
             'default': 'default'
+        },
+        {
+            'type': 'float',
+            'attr': 'max_smooth_angle',
+            'name': 'Max Smooth Angle',
+            'description': 'Dihedral angle in degrees above which Mitsuba keeps an edge sharp',
+            'default': 30.0,
+            'min': 0.0,
+            'max': 180.0
+        },
+        {
+            'type': 'enum',
+            'attr': 'extraction',
+            'name': 'Triangulation',
+            'description': 'Mesh data the exported triangles are read from',
+            'items': [
+                ('tessfaces', 'Tessellated faces', 'Split quads along their first diagonal, using vertex normals'),
+                ('loop_triangles', 'Loop triangles', 'Use the triangulation and split normals of Blender, keeping custom normals (requires NumPy)')
+            ],
+            'default': 'tessfaces'
         }
     ]
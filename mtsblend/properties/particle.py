@@ -36,6 +36,8 @@ class mitsuba_hair(declarative_property_group):
 
     controls = [
         'hair_width',
+        'hair_format',
+        'hair_chunks',
     ]
 
     properties = [
@@ -51,4 +53,26 @@ class mitsuba_hair(declarative_property_group):
             'sub_type': 'DISTANCE',
             'unit': 'LENGTH',
         },
+        {
+            'type': 'enum',
+            'attr': 'hair_format',
+            'name': 'Hair Format',
+            'description': 'Format of the hair file of this particle system',
+            'items': [
+                ('default', 'Engine Default', 'default'),
+                ('ascii', 'Text', 'ascii'),
+                ('binary', 'Binary', 'binary'),
+            ],
+            'default': 'default',
+        },
+        {
+            'type': 'int',
+            'attr': 'hair_chunks',
+            'name': 'Chunks',
+            'description': 'Number of hair files and shapes the system is split into, each holding strands close in space. Chunks are written in parallel and loaded faster by Mitsuba. Requires NumPy',
+            'default': 1,
+            'min': 1,
+            'soft_max': 64,
+            'max': 1024,
+        },
     ]
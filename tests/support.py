@@ -0,0 +1,110 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+'''
+Test environment: the fake bpy of the benchmarks, and stand-ins for the
+add-on modules that need Blender to import.
+'''
+
+import os
+import sys
+import types
+import importlib.util
+
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks import fake_bpy
+
+installed = False
+
+
+def install():
+    '''
+    Install the fake modules once, so the export modules can be imported
+    '''
+
+    global installed
+
+    if installed:
+        return
+
+    installed = True
+    fake_bpy.install(ROOT)
+
+    bpy = sys.modules['bpy']
+    bpy.app.binary_path = ''
+    bpy.app.version = (2, 79, 0)
+    bpy.data.objects = {}
+    bpy.data.materials = {}
+    bpy.data.node_groups = {}
+    bpy.data.images = {}
+    bpy.data.worlds = {}
+
+    for name in ('bpy_extras', 'bpy_extras.io_utils'):
+        module = types.ModuleType(name)
+        module.axis_conversion = None
+        sys.modules[name] = module
+
+    lamps = types.ModuleType('mtsblend.export.lamps')
+    lamps.export_lamp_instance = None
+    sys.modules['mtsblend.export.lamps'] = lamps
+
+    cameras = types.ModuleType('mtsblend.export.cameras')
+    cameras.export_camera_instance = None
+    sys.modules['mtsblend.export.cameras'] = cameras
+
+    properties = types.ModuleType('mtsblend.properties')
+    properties.ExportedVolumes = types.SimpleNamespace(reset_vol_list=lambda: None)
+    sys.modules['mtsblend.properties'] = properties
+
+    sys.modules['mtsblend'].MitsubaAddon = types.SimpleNamespace(
+        get_prefs=lambda: types.SimpleNamespace(install_path=''))
+
+
+def load_pure_api():
+    '''
+    The real pure_api module, loaded against a mock of the Mitsuba python
+    bindings. The stub installed by fake_bpy stays in sys.modules, so the
+    other modules keep seeing PYMTS_AVAILABLE as False.
+    '''
+
+    install()
+
+    mitsuba = mock.MagicMock()
+    mitsuba.core.Appender = object
+    mitsuba.render.RenderListener = object
+    modules = {'mitsuba': mitsuba, 'mitsuba.core': mitsuba.core, 'mitsuba.render': mitsuba.render}
+
+    path = os.path.join(ROOT, 'mtsblend', 'outputs', 'pure_api.py')
+    spec = importlib.util.spec_from_file_location('mtsblend.outputs.pure_api', path)
+    module = importlib.util.module_from_spec(spec)
+
+    with mock.patch.dict(sys.modules, modules), mock.patch('sys.setdlopenflags', create=True):
+        spec.loader.exec_module(module)
+
+    return module
@@ -0,0 +1,148 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+import types
+import unittest
+
+from unittest import mock
+
+from tests import support
+
+support.install()
+
+from benchmarks.fake_bpy import FakeExportContext, fake_scene
+from mtsblend.export import geometry
+from mtsblend.export.geometry import GeometryExporter
+
+
+def material_object():
+    material = types.SimpleNamespace(name='Material')
+
+    return types.SimpleNamespace(
+        name='Object',
+        material_slots=[types.SimpleNamespace(material=material)],
+        data=types.SimpleNamespace(mitsuba_mesh=types.SimpleNamespace(normals='default')),
+    )
+
+
+class PruneBuffersTest(unittest.TestCase):
+    def setUp(self):
+        self.export_ctx = FakeExportContext()
+        self.export_ctx.scene_data = {}
+        self.exporter = GeometryExporter(self.export_ctx, fake_scene(prune_attributes=True))
+        self.buffers = mock.MagicMock(uvs=object(), colors=object())
+        self.mat_params = {
+            'bsdf': {
+                'type': 'diffuse',
+                'reflectance': {'type': 'ref', 'id': 'Texture-texture'},
+            },
+        }
+
+    def tearDown(self):
+        self.exporter.pipeline.shutdown()
+
+    def prune(self):
+        with mock.patch.object(geometry, 'export_material', return_value=self.mat_params):
+            return self.exporter.pruneBuffers(material_object(), 0, self.buffers)
+
+    def test_texture_in_scene_data(self):
+        self.export_ctx.scene_data['Texture-texture'] = {'type': 'bitmap', 'id': 'Texture-texture'}
+
+        self.prune()
+
+        self.buffers.prune.assert_called_once_with(True, True, False)
+
+    def test_texture_exported_in_previous_chunk(self):
+        # shared textures of an animation export are only referenced by id
+        self.export_ctx.exported_ids = {'Texture-texture'}
+
+        self.assertIs(self.prune(), self.buffers)
+        self.buffers.prune.assert_not_called()
+
+    def test_double_sided_with_missing_bsdf(self):
+        self.assertFalse(self.exporter.allowDoubleSided({'type': 'ref', 'id': 'Material-bsdf'}))
+        self.assertTrue(self.exporter.allowDoubleSided({'type': 'diffuse'}))
+
+
+def mesh_object(name, modifiers=(), animation_data=None):
+    return types.SimpleNamespace(
+        name=name,
+        type='MESH',
+        is_duplicator=False,
+        modifiers=list(modifiers),
+        animation_data=animation_data,
+        constraints=(),
+        parent=None,
+        data=types.SimpleNamespace(name=name, animation_data=None, shape_keys=None,
+                                   mitsuba_mesh=types.SimpleNamespace(extraction='tessfaces')),
+    )
+
+
+def boolean_modifier(target):
+    properties = [
+        types.SimpleNamespace(identifier='operation', type='ENUM'),
+        types.SimpleNamespace(identifier='object', type='POINTER', fixed_type=types.SimpleNamespace(identifier='Object')),
+    ]
+
+    return types.SimpleNamespace(type='BOOLEAN', operation='DIFFERENCE', object=target,
+                                 bl_rna=types.SimpleNamespace(properties=properties))
+
+
+class MeshCacheKeyTest(unittest.TestCase):
+    '''
+    Meshes evaluated with modifiers using animated objects are cached
+    per frame, as their geometry changes with them.
+    '''
+
+    def setUp(self):
+        self.exporter = GeometryExporter(FakeExportContext(), fake_scene())
+        self.exporter.geometry_scene = self.exporter.visibility_scene
+
+    def tearDown(self):
+        self.exporter.pipeline.shutdown()
+
+    def keys(self, obj):
+        keys = []
+
+        for frame in (1, 2):
+            self.exporter.geometry_scene.frame_current = frame
+            keys.append(self.exporter.meshCacheKey(obj))
+
+        return keys
+
+    def test_static_mesh(self):
+        first, second = self.keys(mesh_object('Cube'))
+        self.assertEqual(first, second)
+
+    def test_modifier_with_static_object(self):
+        first, second = self.keys(mesh_object('Cube', [boolean_modifier(mesh_object('Cutter'))]))
+        self.assertEqual(first, second)
+
+    def test_modifier_with_animated_object(self):
+        cutter = mesh_object('Cutter', animation_data=object())
+        first, second = self.keys(mesh_object('Cube', [boolean_modifier(cutter)]))
+        self.assertNotEqual(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
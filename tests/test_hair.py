@@ -0,0 +1,179 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+import random
+import types
+import unittest
+
+from unittest import mock
+
+import numpy
+
+from tests import support
+
+support.install()
+
+from mtsblend.export import ExportProgress
+from mtsblend.export import geometry
+from mtsblend.outputs.hair import StrandBuffers
+
+# The hair files hold float32 coordinates: results within a few float32
+# steps of unit coordinates are the same hair, even when not bit identical
+RTOL = 1e-6
+ATOL = 1e-6
+
+
+class Vector(tuple):
+    def __new__(cls, values):
+        return tuple.__new__(cls, [float(v) for v in values])
+
+    def __add__(self, other):
+        return Vector([a + b for a, b in zip(self, other)])
+
+    def __mul__(self, factor):
+        return Vector([a * factor for a in self])
+
+    __rmul__ = __mul__
+
+    @property
+    def length_squared(self):
+        return sum(a * a for a in self)
+
+
+class Matrix(list):
+    def inverted(self):
+        return Matrix(numpy.linalg.inv(numpy.array(self)).tolist())
+
+    def __mul__(self, vector):
+        matrix = numpy.array(self)
+
+        return Vector(matrix[:3, :3].dot(vector) + matrix[:3, 3])
+
+
+def basis_value(knots, i, u, degree):
+    # Cox-de Boor recursion, as evaluated point by point before the basis cache
+    if degree == 0:
+        return 1 if knots[i] <= u < knots[i + 1] else 0
+
+    N0 = basis_value(knots, i, u, degree - 1)
+    N1 = basis_value(knots, i + 1, u, degree - 1)
+    sum1 = 0 if N0 == 0 else (u - knots[i]) / (knots[i + degree] - knots[i]) * N0
+    sum2 = 0 if N1 == 0 else (knots[i + 1 + degree] - u) / (knots[i + 1 + degree] - knots[i + 1]) * N1
+
+    return sum1 + sum2
+
+
+def reference_bspline(points, degree, samples):
+    count = len(points)
+    knots = [0 if i <= degree else count - degree if i >= count else i - degree
+             for i in range(count + degree + 1)]
+    curve = []
+
+    for j in range(samples):
+        u = j * (count - degree) / (samples - 1)
+
+        if j > 0:
+            u -= 0.0000000000001
+
+        curve.append(sum(basis_value(knots, i, u, degree) * numpy.array(points[i]) for i in range(count)))
+
+    return numpy.array(curve)
+
+
+def random_strands(count, steps):
+    generator = random.Random(2)
+    strands = []
+
+    for index in range(count):
+        # strands of varying lengths, as when Blender leaves out steps
+        length = generator.randint(3, steps + 1)
+        strands.append([[generator.uniform(-1, 1) for axis in range(3)] for point in range(length)])
+
+    return strands
+
+
+class BSplineResampleTest(unittest.TestCase):
+    '''
+    The cached basis matrices resample strands to the points of the
+    per-point Cox-de Boor evaluation, within float32 precision.
+    '''
+
+    def setUp(self):
+        self.strands = random_strands(200, 8)
+        self.reference = [reference_bspline(points, 2, 8) for points in self.strands]
+
+    def test_numpy_matches_reference(self):
+        resampled = geometry.resample_bspline_strands(StrandBuffers.from_strands(self.strands), 2, 8)
+
+        self.assertEqual(resampled.counts.tolist(), [8] * len(self.strands))
+        self.assertTrue(numpy.allclose(resampled.points, numpy.concatenate(self.reference), rtol=RTOL, atol=ATOL))
+
+    def test_lists_match_reference(self):
+        strands = [[Vector(p) for p in points] for points in self.strands]
+
+        # the cached bases are lists without numpy
+        with mock.patch.object(geometry, 'NUMPY_AVAILABLE', False), \
+                mock.patch.dict(geometry.bspline_bases, clear=True), \
+                mock.patch.object(geometry.mathutils, 'Vector', Vector, create=True):
+            resampled = geometry.resample_bspline_strands(strands, 2, 8)
+
+        for curve, reference in zip(resampled, self.reference):
+            self.assertTrue(numpy.allclose(numpy.array(curve), reference, rtol=RTOL, atol=ATOL))
+
+
+class FakeHairSystem:
+    def __init__(self, strands, steps):
+        # missing steps are given at the origin of the world
+        self.points = [[Vector(p) for p in points] + [Vector((0.0, 0.0, 0.0))] * (steps + 1 - len(points))
+                       for points in strands]
+
+    def co_hair(self, obj, index, step):
+        return self.points[index][step]
+
+
+class ExtractStrandsTest(unittest.TestCase):
+    '''
+    Strands extracted into arrays and transformed by one matrix product
+    match the points transformed one by one, within float32 precision.
+    '''
+
+    def extract(self, use_numpy):
+        steps = 8
+        strands = random_strands(200, steps)
+        obj = types.SimpleNamespace(matrix_world=Matrix([[2, 0, 0, 1], [0, 1, 0.5, 2], [0, 0, 3, 3], [0, 0, 0, 1]]))
+        exporter = types.SimpleNamespace(progress=ExportProgress())
+        det = types.SimpleNamespace(exported_objects=0)
+
+        with mock.patch.object(geometry, 'NUMPY_AVAILABLE', use_numpy):
+            return geometry.GeometryExporter.extractStrands(
+                exporter, obj, FakeHairSystem(strands, steps), len(strands), steps, det)
+
+    def test_numpy_matches_lists(self):
+        buffers = self.extract(True)
+        strands = self.extract(False)
+
+        self.assertEqual(buffers.counts.tolist(), [len(points) for points in strands])
+        self.assertTrue(numpy.allclose(buffers.points, numpy.array([p for points in strands for p in points]),
+                                       rtol=RTOL, atol=ATOL))
+
+
+if __name__ == '__main__':
+    unittest.main()
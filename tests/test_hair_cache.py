@@ -0,0 +1,182 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+import numpy
+
+from tests import support
+
+support.install()
+
+from benchmarks.fake_bpy import FakeCollection, FakeID, fake_scene
+from mtsblend.extensions_framework import util as efutil
+from mtsblend.export import ExportContextBase
+from mtsblend.export.geometry import GeometryExporter
+
+
+class FakeStruct:
+    '''
+    RNA struct whose properties are its public attributes
+    '''
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+    @staticmethod
+    def rna_type(value):
+        if isinstance(value, list):
+            return 'COLLECTION'
+
+        if isinstance(value, (FakeStruct, FakeID)):
+            return 'POINTER'
+
+        return 'FLOAT'
+
+    @property
+    def bl_rna(self):
+        properties = [types.SimpleNamespace(identifier=name, type=self.rna_type(value))
+                      for name, value in sorted(self.__dict__.items()) if not name.startswith('_')]
+
+        return types.SimpleNamespace(properties=properties)
+
+
+class Matrix(list):
+    def inverted(self):
+        return self
+
+
+class FakeHairSystem(FakeStruct):
+    '''
+    Hair particle system counting the strand points read from it
+    '''
+
+    def __init__(self, parents, children, steps):
+        super().__init__(name='Hair', use_hair_dynamics=False)
+        self.settings = FakeStruct(
+            type='HAIR',
+            render_step=steps,
+            use_hair_bspline=False,
+            length=1.0,
+            mitsuba_hair=FakeStruct(hair_format='default', hair_chunks=1),
+        )
+        self.particles = [
+            types.SimpleNamespace(hair_keys=FakeCollection(2, {'co': numpy.array([[i, 0.0, 0.0], [i, 0.0, 1.0]])}))
+            for i in range(parents)
+        ]
+        self.child_particles = [None] * children
+        self._reads = 0
+
+    def set_resolution(self, scene, obj, resolution):
+        pass
+
+    def co_hair(self, obj, index, step):
+        self._reads += 1
+
+        return (float(index) + 1.0, 0.0, float(step))
+
+
+class HairSourceCacheTest(unittest.TestCase):
+    '''
+    Hair files in the mesh store are found from the hair settings and
+    emitter, before any strand is extracted.
+    '''
+
+    def setUp(self):
+        self.export_path = tempfile.mkdtemp()
+        self.saved_export_path = efutil.export_path
+        efutil.export_path = self.export_path + '/'
+        self.psys = FakeHairSystem(parents=10, children=20, steps=2)
+        vertices = numpy.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        self.obj = FakeStruct(
+            name='Emitter',
+            type='MESH',
+            modifiers=[],
+            matrix_world=Matrix(numpy.identity(4).tolist()),
+            is_duplicator=False,
+            animation_data=None,
+            constraints=(),
+            parent=None,
+            data=FakeID(name='Emitter', animation_data=None, shape_keys=None,
+                        vertices=FakeCollection(3, {'co': vertices})),
+        )
+
+    def tearDown(self):
+        efutil.export_path = self.saved_export_path
+        shutil.rmtree(self.export_path)
+
+    def export(self):
+        '''
+        Export the hair system through the mesh store. Returns its files
+        and the number of strand points read.
+        '''
+
+        reads = self.psys._reads
+        exporter = GeometryExporter(ExportContextBase(), fake_scene(mesh_store=True))
+        exporter.geometry_scene = exporter.visibility_scene
+
+        try:
+            filenames = exporter.handler_Duplis_PATH(self.obj, self.psys)
+
+        finally:
+            exporter.finish()
+
+        return filenames, self.psys._reads - reads
+
+    def test_stored_files_are_reused_without_extraction(self):
+        filenames, reads = self.export()
+        self.assertEqual(reads, 30 * 5)
+        self.assertTrue(all(os.path.exists(filename) for filename in filenames))
+
+        self.assertEqual(self.export(), (filenames, 0))
+
+    def test_settings_change_extracts_again(self):
+        filenames, reads = self.export()
+
+        self.psys.settings.length = 2.0
+        self.assertEqual(self.export()[1], reads)
+
+    def test_parent_hair_change_extracts_again(self):
+        filenames, reads = self.export()
+
+        self.psys.particles[3].hair_keys.attributes['co'][1] = (3.0, 1.0, 1.0)
+        self.assertEqual(self.export()[1], reads)
+
+    def test_emitter_change_extracts_again(self):
+        filenames, reads = self.export()
+
+        self.obj.data.vertices.attributes['co'][2] = (0.0, 2.0, 0.0)
+        self.assertEqual(self.export()[1], reads)
+
+    def test_missing_file_extracts_again(self):
+        filenames, reads = self.export()
+
+        os.remove(filenames[0])
+        self.assertEqual(self.export(), (filenames, reads))
+        self.assertTrue(os.path.exists(filenames[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
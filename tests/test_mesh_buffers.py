@@ -0,0 +1,95 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+import math
+import unittest
+
+import numpy
+
+from tests import support
+
+support.install()
+
+from benchmarks.meshes import soup, sphere
+from mtsblend.outputs.mesh_buffers import MeshBuffers, VertexTable, row_keys
+
+
+class VertexTableTest(unittest.TestCase):
+    def test_lookup_after_inserts(self):
+        rng = numpy.random.RandomState(0)
+        table = VertexTable()
+        expected = {}
+        chunks = 64
+
+        for chunk in range(chunks):
+            # values shared with previous chunks, and new ones
+            columns = rng.randint(0, 2000, (100, 3)).astype(numpy.float64)
+            keys = row_keys([columns])
+            found = table.lookup(keys)
+
+            for key, index in zip(keys.tolist(), found.tolist()):
+                self.assertEqual(index, expected.get(key, -1))
+
+            unique_keys = numpy.unique(keys)
+            new_keys = unique_keys[table.lookup(unique_keys) < 0]
+            indices = numpy.arange(len(expected), len(expected) + len(new_keys))
+            table.insert(new_keys, indices)
+            expected.update(zip(new_keys.tolist(), indices.tolist()))
+
+            self.assertLessEqual(len(table.runs), math.log2(chunk + 1) + 1)
+
+        self.assertEqual(sum(len(keys) for keys, indices in table.runs), len(expected))
+
+    def test_empty_table(self):
+        keys = row_keys([numpy.zeros((3, 3))])
+
+        self.assertEqual(VertexTable().lookup(keys).tolist(), [-1, -1, -1])
+
+
+class BuildChunksTest(unittest.TestCase):
+    '''
+    Meshes built chunk by chunk concatenate to the mesh built at once
+    '''
+
+    def check_chunks(self, mesh, chunk_size):
+        buffers = MeshBuffers(mesh)
+        faces = numpy.arange(len(mesh.tessfaces))
+        whole = buffers.build(faces)
+        chunks = list(buffers.build_chunks(faces, chunk_size))
+
+        for index, section in enumerate(whole):
+            if section is None:
+                self.assertTrue(all(chunk[index] is None for chunk in chunks))
+
+            else:
+                self.assertTrue(numpy.array_equal(section, numpy.concatenate([chunk[index] for chunk in chunks])))
+
+    def test_smooth_mesh(self):
+        for chunk_size in (7, 100, 10000):
+            self.check_chunks(sphere(2000), chunk_size)
+
+    def test_mixed_mesh(self):
+        for chunk_size in (7, 100, 10000):
+            self.check_chunks(soup(2000), chunk_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import support
+
+support.install()
+
+from benchmarks.meshes import soup, sphere
+from mtsblend.outputs.mesh_buffers import MeshBuffers, read_material_faces, split_material_faces
+from mtsblend.outputs.mesh_ply import write_ply_mesh, write_ply_mesh_numpy
+
+
+def read_file(path):
+    with open(path, 'rb') as data:
+        return data.read()
+
+
+class NumpyWriterTest(unittest.TestCase):
+    '''
+    The NumPy writer gives the bytes of the Python writer
+    '''
+
+    def setUp(self):
+        self.export_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.export_path)
+
+    def check_mesh(self, mesh):
+        python_path = os.path.join(self.export_path, 'python.ply')
+        numpy_path = os.path.join(self.export_path, 'numpy.ply')
+        buffers = MeshBuffers(mesh)
+        python_faces = read_material_faces(mesh)
+        numpy_faces = split_material_faces(buffers.material_index)
+        self.assertEqual(sorted(python_faces), sorted(numpy_faces))
+
+        for index, faces in python_faces.items():
+            write_ply_mesh(python_path, mesh.name, mesh, faces)
+            write_ply_mesh_numpy(numpy_path, mesh.name, buffers, numpy_faces[index])
+
+            self.assertEqual(read_file(python_path), read_file(numpy_path), 'material %d' % index)
+
+    def test_smooth_mesh(self):
+        self.check_mesh(sphere(500))
+
+    def test_mixed_mesh(self):
+        # flat and smooth faces, triangles and quads, with UVs
+        self.check_mesh(soup(500))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,351 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import types
+import unittest
+
+from concurrent.futures import wait as wait_futures
+
+import numpy
+
+from tests import support
+
+support.install()
+
+from benchmarks.fake_bpy import FakeExportContext, FakeObject, fake_scene
+from benchmarks.meshes import soup, sphere
+from mtsblend.extensions_framework import util as efutil
+from mtsblend.export import ExportPipeline
+from mtsblend.export.geometry import GeometryExporter
+from mtsblend.outputs.mesh_buffers import MeshBuffers, read_material_faces, split_material_faces
+from mtsblend.outputs.mesh_serialized import SerializedContainer, write_serialized_mesh, write_serialized_mesh_numpy, \
+    write_serialized_shape_numpy
+
+# longest time a test waits for a container before calling it stuck
+TIMEOUT = 10
+
+
+class TriangleBuffers:
+    '''
+    MeshBuffers of one triangle, failing to build when fail is set
+    '''
+
+    def __init__(self, fail=False, wait=None):
+        self.fail = fail
+        # building waits for this event when given
+        self.wait = wait
+
+    def build(self, face_indices):
+        if self.wait is not None:
+            self.wait.wait(TIMEOUT)
+
+        if self.fail:
+            raise ValueError('bad mesh')
+
+        points = numpy.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+
+        return points, None, None, None, numpy.array([[0, 1, 2]], dtype=numpy.uint32)
+
+
+def read_trailer(path):
+    '''
+    Offsets of the shapes listed at the end of a serialized file
+    '''
+
+    with open(path, 'rb') as ser_file:
+        data = ser_file.read()
+
+    count = struct.unpack('<I', data[-4:])[0]
+
+    return list(struct.unpack('<%dQ' % count, data[-4 - 8 * count:-4]))
+
+
+def run_with_timeout(test, fn):
+    '''
+    Run fn in a thread, failing test when it does not return in time.
+    Returns the exception raised by fn, if any.
+    '''
+
+    result = {}
+
+    def run():
+        try:
+            fn()
+
+        except Exception as error:
+            result['error'] = error
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(TIMEOUT)
+    test.assertFalse(thread.is_alive(), 'stuck waiting for a shape index')
+
+    return result.get('error')
+
+
+def read_file(path):
+    with open(path, 'rb') as data:
+        return data.read()
+
+
+class NumpyWriterTest(unittest.TestCase):
+    '''
+    The NumPy writer gives the bytes of the Python writer
+    '''
+
+    def setUp(self):
+        self.export_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.export_path)
+
+    def check_mesh(self, mesh, single_precision):
+        python_path = os.path.join(self.export_path, 'python.serialized')
+        numpy_path = os.path.join(self.export_path, 'numpy.serialized')
+        buffers = MeshBuffers(mesh)
+        python_faces = read_material_faces(mesh)
+        numpy_faces = split_material_faces(buffers.material_index)
+        self.assertEqual(sorted(python_faces), sorted(numpy_faces))
+
+        for index, faces in python_faces.items():
+            write_serialized_mesh(python_path, mesh.name, mesh, faces, single_precision=single_precision)
+            write_serialized_mesh_numpy(numpy_path, mesh.name, buffers, numpy_faces[index],
+                                        single_precision=single_precision)
+
+            self.assertEqual(read_file(python_path), read_file(numpy_path), 'material %d' % index)
+
+    def test_smooth_mesh(self):
+        for single_precision in (False, True):
+            self.check_mesh(sphere(500), single_precision)
+
+    def test_mixed_mesh(self):
+        # flat and smooth faces, triangles and quads, UVs and vertex colors
+        for single_precision in (False, True):
+            self.check_mesh(soup(500), single_precision)
+
+
+class ContainerTest(unittest.TestCase):
+    '''
+    Serialized files of several shapes end with the offset of every shape
+    and the number of shapes, each shape having the bytes it has alone.
+    '''
+
+    def setUp(self):
+        self.export_path = tempfile.mkdtemp()
+        self.saved_export_path = efutil.export_path
+        self.mesh = soup(500)
+        self.buffers = MeshBuffers(self.mesh)
+        self.material_faces = split_material_faces(self.buffers.material_index)
+
+    def tearDown(self):
+        efutil.export_path = self.saved_export_path
+        shutil.rmtree(self.export_path)
+
+    def shape_bytes(self, name, faces):
+        '''
+        Bytes of the shape written alone, without the trailer of its file
+        '''
+
+        path = os.path.join(self.export_path, 'single.serialized')
+        write_serialized_mesh_numpy(path, name, self.buffers, faces)
+        data = read_file(path)
+
+        self.assertEqual(data[-12:], struct.pack('<QI', 0, 1))
+
+        return data[:-12]
+
+    def test_offset_table(self):
+        path = os.path.join(self.export_path, 'container.serialized')
+        shapes = []
+
+        with SerializedContainer(path) as container:
+            for index, faces in sorted(self.material_faces.items()):
+                name = 'Mesh_%d' % index
+                shape_index = write_serialized_mesh_numpy(None, name, self.buffers, faces, container)
+                self.assertEqual(shape_index, len(shapes))
+                shapes.append(self.shape_bytes(name, faces))
+
+        data = read_file(path)
+        offsets = read_trailer(path)
+        ends = offsets[1:] + [len(data) - 4 - 8 * len(offsets)]
+
+        self.assertEqual(len(offsets), len(self.material_faces))
+        self.assertEqual(offsets[0], 0)
+
+        for shape, start, end in zip(shapes, offsets, ends):
+            self.assertEqual(data[start:end], shape)
+
+    def test_object_container(self):
+        efutil.export_path = self.export_path + '/'
+        scene = fake_scene(mesh_container='object')
+        exporter = GeometryExporter(FakeExportContext(), scene)
+        exporter.geometry_scene = scene
+
+        mesh_definitions = exporter.writeMesh(FakeObject(self.mesh), file_format='serialized')
+        exporter.finish()
+
+        # all materials in one file, referenced by shape index
+        filenames = set(definition[3]['filename'] for definition in mesh_definitions)
+        shape_indices = [definition[3]['shapeIndex'] for definition in mesh_definitions]
+
+        self.assertEqual(len(filenames), 1)
+        self.assertEqual(shape_indices, list(range(len(self.material_faces))))
+        self.assertEqual(len(read_trailer(filenames.pop())), len(self.material_faces))
+
+
+class FailedShapeTest(unittest.TestCase):
+    '''
+    A shape failing on the export pipeline gives up its index in the
+    container, so the shapes after it and the main thread are not blocked.
+    '''
+
+    def setUp(self):
+        self.export_path = tempfile.mkdtemp()
+        self.ser_path = os.path.join(self.export_path, 'Scene.serialized')
+        self.exporter = GeometryExporter(FakeExportContext(), fake_scene(mesh_container='object'))
+        self.obj = types.SimpleNamespace(name='Object')
+
+    def tearDown(self):
+        self.exporter.pipeline.shutdown()
+        shutil.rmtree(self.export_path)
+
+    def write_shape(self, container, buffers):
+        return self.exporter.writeShape(self.obj, self.ser_path, container, None, write_serialized_shape_numpy,
+                                        'Mesh', buffers, [0], False)
+
+    def test_failed_shape_is_reported(self):
+        container = SerializedContainer(self.ser_path)
+        self.exporter.MeshContainers[self.ser_path] = container
+
+        def export():
+            self.write_shape(container, TriangleBuffers(fail=True))
+            wait_futures(self.exporter.pipeline.futures)
+
+            # the error of the first shape is raised by the next one
+            self.write_shape(container, TriangleBuffers())
+
+        error = run_with_timeout(self, export)
+        self.assertIsInstance(error, ValueError)
+
+        self.assertIsNone(run_with_timeout(self, self.exporter.abort))
+        self.assertFalse(os.path.exists(self.ser_path))
+
+    def test_shapes_after_failed_shape(self):
+        container = SerializedContainer(self.ser_path)
+
+        def write(fail):
+            write_serialized_shape_numpy(self.ser_path, container, 'Mesh', TriangleBuffers(fail), [0],
+                                         shape_index=container.reserve_shape())
+
+        def export():
+            write(False)
+
+            with self.assertRaises(ValueError):
+                write(True)
+
+            write(False)
+            container.close()
+
+        self.assertIsNone(run_with_timeout(self, export))
+        self.assertEqual(len(read_trailer(self.ser_path)), 2)
+
+
+class AbortTest(unittest.TestCase):
+    '''
+    Aborting an export while the pipeline still has shapes, closes and
+    files to write leaves no serialized file open or partially written.
+    '''
+
+    def setUp(self):
+        self.export_path = tempfile.mkdtemp()
+        self.exporter = GeometryExporter(FakeExportContext(), fake_scene(mesh_container='object'))
+        self.exporter.pipeline.shutdown()
+        # one worker, so the jobs queued behind the first one are cancelled
+        self.exporter.pipeline = ExportPipeline(max_workers=1, max_pending=16)
+        self.obj = types.SimpleNamespace(name='Object')
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.exporter.pipeline.shutdown()
+        shutil.rmtree(self.export_path)
+
+    def path(self, name):
+        return os.path.join(self.export_path, name)
+
+    def write_shape(self, file_path, buffers):
+        container = self.exporter.openMeshContainer(file_path)
+
+        return self.exporter.writeShape(self.obj, file_path, container, None, write_serialized_shape_numpy,
+                                        'Mesh', buffers, [0], False)
+
+    def test_abort_with_queued_jobs(self):
+        # the first shape keeps the only worker busy until abort is called
+        self.write_shape(self.path('Open.serialized'), TriangleBuffers(wait=self.release))
+        self.write_shape(self.path('Open.serialized'), TriangleBuffers())
+
+        self.write_shape(self.path('Closing.serialized'), TriangleBuffers())
+        self.exporter.closeMeshContainer(self.path('Closing.serialized'))
+
+        # left over by a previous export, and overwritten by a cancelled job
+        with open(self.path('Mesh.serialized'), 'wb') as stale:
+            stale.write(b'stale')
+
+        self.exporter.submitJob(self.path('Mesh.serialized'), write_serialized_shape_numpy,
+                                self.path('Mesh.serialized'), None, 'Mesh', TriangleBuffers(), [0])
+
+        def abort():
+            threading.Timer(0.2, self.release.set).start()
+            self.exporter.abort()
+
+        self.assertIsNone(run_with_timeout(self, abort))
+        self.assertEqual(os.listdir(self.export_path), [])
+        self.assertEqual(self.exporter.ClosingContainers, [])
+
+    def test_discard_releases_waiting_shapes(self):
+        container = SerializedContainer(self.path('Mesh.serialized'))
+        container.reserve_shape()
+        waiting = threading.Thread(target=container.write_encoded, args=(container.reserve_shape(), b'shape'))
+        waiting.start()
+
+        # the job of the first shape was cancelled, and never gives up its index
+        container.discard()
+        waiting.join(TIMEOUT)
+
+        self.assertFalse(waiting.is_alive())
+        self.assertFalse(os.path.exists(self.path('Mesh.serialized')))
+
+    def test_abort_after_closed_container(self):
+        self.write_shape(self.path('Done.serialized'), TriangleBuffers())
+        self.exporter.closeMeshContainer(self.path('Done.serialized'))
+        wait_futures(self.exporter.pipeline.futures)
+
+        self.assertIsNone(run_with_timeout(self, self.exporter.abort))
+        self.assertEqual(len(read_trailer(self.path('Done.serialized'))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
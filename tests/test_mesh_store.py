@@ -0,0 +1,118 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import support
+
+support.install()
+
+from benchmarks.fake_bpy import FakeObject, fake_scene
+from benchmarks.meshes import sphere
+from mtsblend.extensions_framework import util as efutil
+from mtsblend.export import ExportContextBase
+from mtsblend.export.dependencies import DependencyGraph
+from mtsblend.export.geometry import GeometryExporter
+
+NODE = ('export_object', 'Sphere')
+
+
+class ReplayEvictionTest(unittest.TestCase):
+    '''
+    Objects replayed from the dependency graph reference mesh store files
+    that no exporter reserved in the current export.
+    '''
+
+    def setUp(self):
+        self.export_path = tempfile.mkdtemp()
+        self.saved_export_path = efutil.export_path
+        efutil.export_path = self.export_path + '/'
+        self.graph = DependencyGraph()
+        self.mesh = sphere(500)
+
+        # first export, writing the mesh to the store
+        export_ctx = ExportContextBase()
+        self.graph.begin(export_ctx, 'signature')
+        exporter = GeometryExporter(export_ctx, fake_scene(mesh_store=True))
+        exporter.geometry_scene = exporter.visibility_scene
+
+        with self.graph.build(NODE):
+            mesh_definitions = exporter.buildMesh(FakeObject(self.mesh))
+            export_ctx.data_add({'type': 'serialized', 'id': 'Sphere', 'filename': mesh_definitions[0][3]['filename']})
+
+        exporter.recordStoredFiles(self.graph)
+        exporter.finish()
+        self.graph.commit()
+
+        self.store_file = mesh_definitions[0][3]['filename']
+        self.assertTrue(os.path.exists(self.store_file))
+
+    def tearDown(self):
+        efutil.export_path = self.saved_export_path
+        shutil.rmtree(self.export_path)
+
+    def replay(self, use_stored_files=True):
+        '''
+        Second export with a store too small to keep any unused file,
+        replaying the object. Returns whether the object could be reused.
+        '''
+
+        export_ctx = ExportContextBase()
+        self.graph.begin(export_ctx, 'signature')
+        exporter = GeometryExporter(export_ctx, fake_scene(mesh_store=True, mesh_store_size=0))
+
+        try:
+            self.assertTrue(self.graph.is_clean(NODE))
+            reused = not use_stored_files or exporter.useStoredFiles(self.graph.nodes[NODE])
+
+            if reused:
+                self.graph.replay(NODE)
+
+        finally:
+            exporter.finish()
+            self.graph.commit()
+
+        return reused
+
+    def test_replayed_files_are_kept(self):
+        self.assertTrue(self.replay())
+        self.assertTrue(os.path.exists(self.store_file))
+
+        # and are still kept by the exports after
+        self.assertTrue(self.replay())
+        self.assertTrue(os.path.exists(self.store_file))
+
+    def test_unmarked_files_are_evicted(self):
+        self.replay(use_stored_files=False)
+        self.assertFalse(os.path.exists(self.store_file))
+
+    def test_missing_file_prevents_reuse(self):
+        os.remove(self.store_file)
+        self.assertFalse(self.replay())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+from tests import support
+
+support.install()
+
+from benchmarks.meshes import soup
+from mtsblend.export import ExportCancelled, ExportPipeline, ExportProgress
+from mtsblend.outputs.mesh_buffers import MeshBuffers, split_material_faces
+from mtsblend.outputs.mesh_serialized import SerializedContainer, prepare_serialized_mesh_numpy, \
+    write_serialized_mesh_numpy
+
+# longest time a test waits for a job before calling it stuck
+TIMEOUT = 10
+
+
+class ExportPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.pipeline = ExportPipeline(max_workers=1, max_pending=2)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.pipeline.shutdown()
+
+    def test_submit_blocks_when_full(self):
+        self.pipeline.submit(self.release.wait, TIMEOUT)
+        self.pipeline.submit(self.release.wait, TIMEOUT)
+
+        blocked = threading.Thread(target=self.pipeline.submit, args=(len, ()))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+
+        # a slot is freed once a job finishes
+        self.release.set()
+        blocked.join(TIMEOUT)
+        self.assertFalse(blocked.is_alive())
+
+        self.pipeline.wait()
+
+    def test_error_raised_by_next_submit(self):
+        self.pipeline.submit(int, 'not a number').exception(TIMEOUT)
+
+        with self.assertRaises(ValueError):
+            self.pipeline.submit(len, ())
+
+    def test_error_raised_by_wait(self):
+        self.pipeline.submit(int, 'not a number')
+
+        with self.assertRaises(ValueError):
+            self.pipeline.wait()
+
+
+class OrderedWritesTest(unittest.TestCase):
+    '''
+    Shapes written to a container by the pipeline are stored in the order
+    of their index, whatever order their jobs finish in.
+    '''
+
+    def setUp(self):
+        self.export_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.export_path)
+
+    def test_shapes_in_index_order(self):
+        buffers = MeshBuffers(soup(500))
+        material_faces = sorted(split_material_faces(buffers.material_index).items())
+        sequential_path = os.path.join(self.export_path, 'sequential.serialized')
+        pipeline_path = os.path.join(self.export_path, 'pipeline.serialized')
+
+        with SerializedContainer(sequential_path) as container:
+            for index, faces in material_faces:
+                write_serialized_mesh_numpy(None, 'Mesh_%d' % index, buffers, faces, container)
+
+        def write_shape(container, shape_index, delay, *shape):
+            # the first shapes finish last
+            time.sleep(delay)
+            container.write_shape(*shape, shape_index=shape_index)
+
+        pipeline = ExportPipeline(max_workers=4, max_pending=len(material_faces) + 1)
+        container = SerializedContainer(pipeline_path)
+
+        try:
+            for index, faces in material_faces:
+                shape = prepare_serialized_mesh_numpy(buffers, faces)
+                delay = 0.02 * (len(material_faces) - index)
+                pipeline.submit(write_shape, container, container.reserve_shape(), delay, 'Mesh_%d' % index, *shape)
+
+            pipeline.submit(container.close)
+            pipeline.wait()
+
+        finally:
+            pipeline.shutdown()
+
+        with open(sequential_path, 'rb') as sequential, open(pipeline_path, 'rb') as pipelined:
+            self.assertEqual(sequential.read(), pipelined.read())
+
+
+def render_engine(cancelled=False):
+    engine = mock.MagicMock()
+    engine.test_break.return_value = cancelled
+
+    return engine
+
+
+class ExportProgressTest(unittest.TestCase):
+    def test_progress_shown(self):
+        engine = render_engine()
+        progress = ExportProgress(engine)
+        progress.start('Exporting objects', 4)
+
+        engine.update_stats.assert_called_with('', 'Mitsuba: Exporting objects 0/4')
+        engine.update_progress.assert_called_with(0.0)
+
+        progress.CHECK_PERIOD = 0.0
+        progress.step(2)
+
+        engine.update_stats.assert_called_with('', 'Mitsuba: Exporting objects 2/4')
+        engine.update_progress.assert_called_with(0.5)
+
+    def test_engine_polled_once_per_period(self):
+        engine = render_engine()
+        progress = ExportProgress(engine)
+        progress.CHECK_PERIOD = 60.0
+        progress.start('Exporting objects', 1000)
+
+        for index in range(1000):
+            progress.step()
+
+        self.assertEqual(engine.test_break.call_count, 1)
+
+    def test_cancel(self):
+        engine = render_engine()
+        progress = ExportProgress(engine)
+        progress.CHECK_PERIOD = 0.0
+        progress.start('Exporting objects', 10)
+        progress.step()
+
+        engine.test_break.return_value = True
+
+        with self.assertRaises(ExportCancelled):
+            progress.step()
+
+        # the export stays cancelled without asking the engine again
+        engine.test_break.reset_mock()
+        engine.test_break.return_value = False
+
+        with self.assertRaises(ExportCancelled):
+            progress.check()
+
+        engine.test_break.assert_not_called()
+
+    def test_without_engine(self):
+        progress = ExportProgress()
+        progress.CHECK_PERIOD = 0.0
+        progress.start('Exporting objects', 10)
+        progress.step()
+
+        self.assertFalse(progress.cancelled)
+
+
+class PipelineCancelTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def test_cancel_drops_queued_jobs(self):
+        pipeline = ExportPipeline(max_workers=1, max_pending=4)
+        queued = mock.MagicMock()
+
+        try:
+            running = pipeline.submit(self.release.wait, TIMEOUT)
+            queued_futures = [pipeline.submit(queued) for index in range(3)]
+
+            pipeline.cancel()
+            self.assertTrue(all(future.cancelled() for future in queued_futures))
+            self.assertFalse(running.cancelled())
+
+            self.release.set()
+
+        finally:
+            pipeline.shutdown()
+
+        self.assertTrue(running.result())
+        queued.assert_not_called()
+
+    def test_cancel_while_waiting_for_slot(self):
+        progress = ExportProgress(render_engine(cancelled=True))
+        progress.CHECK_PERIOD = 0.0
+        pipeline = ExportPipeline(max_workers=1, max_pending=1, poll=progress.check)
+
+        try:
+            pipeline.submit(self.release.wait, TIMEOUT)
+            start = time.perf_counter()
+
+            with self.assertRaises(ExportCancelled):
+                pipeline.submit(len, ())
+
+            # cancelled after one poll period
+            self.assertLess(time.perf_counter() - start, pipeline.POLL_PERIOD + 1.0)
+
+        finally:
+            self.release.set()
+            pipeline.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
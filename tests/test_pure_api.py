@@ -0,0 +1,91 @@
+# -*- coding: utf8 -*-
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# --------------------------------------------------------------------------
+# Blender Mitsuba Add-On
+# --------------------------------------------------------------------------
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ***** END GPL LICENSE BLOCK *****
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+from tests import support
+
+
+class InternalBufferDisplayTest(unittest.TestCase):
+    def setUp(self):
+        pure_api = support.load_pure_api()
+        self.assertTrue(pure_api.PYMTS_AVAILABLE)
+
+        display = pure_api.InternalBufferDisplay.__new__(pure_api.InternalBufferDisplay)
+        display.ctx = mock.MagicMock()
+        display.ctx.test_break.return_value = False
+        display.size = (4, 4)
+        display.fast_buffer = True
+        display.do_cancel = False
+        display.get_bitmap_buffer = mock.MagicMock(return_value=b'')
+        display.get_bitmap_list = mock.MagicMock(return_value=[])
+        self.display = display
+
+    def test_refresh_does_not_cancel(self):
+        self.display.update_result()
+        self.display.update_result()
+
+        self.display.ctx.render_cancel.assert_not_called()
+        self.assertTrue(self.display.fast_buffer)
+        self.assertEqual(self.display.ctx.render_engine.end_result.call_count, 2)
+
+    def test_failed_refresh_falls_back_then_cancels(self):
+        self.display.ctx.render_engine.begin_result.side_effect = RuntimeError('no result')
+
+        self.display.update_result()
+        self.assertFalse(self.display.fast_buffer)
+        self.display.ctx.render_cancel.assert_not_called()
+
+        self.display.update_result()
+        self.display.ctx.render_cancel.assert_called_once_with()
+
+
+class SerializerContainerTest(unittest.TestCase):
+    def setUp(self):
+        self.export_path = tempfile.mkdtemp()
+        self.pure_api = support.load_pure_api()
+
+    def tearDown(self):
+        shutil.rmtree(self.export_path)
+
+    def test_discard_removes_file(self):
+        path = os.path.join(self.export_path, 'Scene.serialized')
+        container = self.pure_api.SerializerContainer(mock.MagicMock(), path)
+
+        # the mocked FileStream does not create the file
+        with open(path, 'wb') as partial:
+            partial.write(b'partial')
+
+        container.discard()
+
+        container.fstream.close.assert_called_once_with()
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()